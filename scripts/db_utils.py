@@ -0,0 +1,182 @@
+import os
+import csv
+import time
+import atexit
+import logging
+import threading
+from io import StringIO
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Sequence
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2 import pool as pg_pool
+
+logger = logging.getLogger(__name__)
+
+# Marker written for NULL values in COPY buffers
+COPY_NULL = '\\N'
+
+# Connection pool sizing, shared by every script that talks to a user_{userId}_db database
+DB_POOL_MIN_CONNECTIONS = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX_CONNECTIONS = int(os.getenv('DB_POOL_MAX', '5'))
+# Idle connections older than this are checked with SELECT 1 before being handed out
+DB_POOL_HEALTHCHECK_SECONDS = float(os.getenv('DB_POOL_HEALTHCHECK_SECONDS', '30'))
+
+
+class ConnectionPool:
+    """Thread-safe pool of connections to one database, with health checks and usage statistics."""
+
+    def __init__(self, db_params: Dict[str, str], minconn: int, maxconn: int, healthcheck_seconds: float):
+        self.db_params = db_params
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.healthcheck_seconds = healthcheck_seconds
+        self._pool = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        self._stats = {
+            'checkouts': 0,
+            'connections_opened': 0,
+            'connections_reused': 0,
+            'waits': 0,
+            'health_checks': 0,
+            'discarded': 0,
+            'in_use': 0
+        }
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = pg_pool.ThreadedConnectionPool(self.minconn, self.maxconn, **self.db_params)
+            return self._pool
+
+    def _count(self, key: str, delta: int = 1):
+        with self._lock:
+            self._stats[key] += delta
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        with self._lock:
+            last_used = self._last_used.get(id(conn))
+        if last_used is None or time.monotonic() - last_used < self.healthcheck_seconds:
+            return True
+        self._count('health_checks')
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error as e:
+            logger.warning(f"Discarding unhealthy pooled connection to {self.db_params.get('dbname')}: {e}")
+            return False
+
+    def _discard(self, pool, conn):
+        with self._lock:
+            self._last_used.pop(id(conn), None)
+            self._stats['discarded'] += 1
+        pool.putconn(conn, close=True)
+
+    def _checkout(self):
+        pool = self._get_pool()
+        for _ in range(self.maxconn + 1):
+            conn = pool.getconn()
+            with self._lock:
+                is_new = id(conn) not in self._last_used
+            if self._is_healthy(conn):
+                self._count('connections_opened' if is_new else 'connections_reused')
+                return conn
+            self._discard(pool, conn)
+        raise psycopg2.OperationalError(f"Could not get a healthy connection to {self.db_params.get('dbname')}")
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection. Any open transaction is rolled back before it goes back to the pool."""
+        if not self._slots.acquire(blocking=False):
+            self._count('waits')
+            self._slots.acquire()
+        conn = None
+        broken = False
+        try:
+            conn = self._checkout()
+            self._count('checkouts')
+            self._count('in_use')
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            if conn is not None:
+                self._count('in_use', -1)
+                if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    try:
+                        conn.rollback()
+                    except psycopg2.Error:
+                        broken = True
+                if broken or conn.closed:
+                    self._discard(self._get_pool(), conn)
+                else:
+                    with self._lock:
+                        self._last_used[id(conn)] = time.monotonic()
+                    self._get_pool().putconn(conn)
+            self._slots.release()
+
+    def stats(self) -> Dict[str, int]:
+        """Return a snapshot of the pool usage counters."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['open_connections'] = stats['connections_opened'] - stats['discarded']
+        stats['max_size'] = self.maxconn
+        return stats
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None and not self._pool.closed:
+                self._pool.closeall()
+            self._pool = None
+            self._last_used.clear()
+
+
+_pools: Dict[tuple, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_params: Dict[str, str], minconn: int = None, maxconn: int = None) -> ConnectionPool:
+    """Return the shared pool for the database described by db_params, creating it on first use."""
+    key = (db_params.get('dbname'), db_params.get('host'), db_params.get('port'), db_params.get('user'))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(
+                db_params,
+                minconn if minconn is not None else DB_POOL_MIN_CONNECTIONS,
+                maxconn if maxconn is not None else DB_POOL_MAX_CONNECTIONS,
+                DB_POOL_HEALTHCHECK_SECONDS
+            )
+        return _pools[key]
+
+
+@atexit.register
+def close_all_pools():
+    """Close every pooled connection opened by this process."""
+    with _pools_lock:
+        for connection_pool in _pools.values():
+            connection_pool.close()
+        _pools.clear()
+
+
+def copy_rows(cursor, rows: Iterable[Sequence], table_name: str, columns: List[str]):
+    """
+    COPY plain row tuples into table_name in CSV format, without building a DataFrame.
+    None is written as NULL; every other value is written with str().
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    for row in rows:
+        writer.writerow([COPY_NULL if value is None else value for value in row] if None in row else row)
+    buffer.seek(0)
+    cursor.copy_expert(
+        f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')",
+        buffer
+    )
@@ -1,17 +1,116 @@
 import sys
 import psycopg2
 from psycopg2 import Error
+from psycopg2.extras import execute_values
 from datetime import datetime
 import openai
-from typing import Dict, List
+from typing import Dict, Iterator, List, Optional, Tuple
 import json
 import logging
 import os
+import time
+import sqlite3
+import hashlib
+import html
+import random
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# Must match the LEDGER_GROUP_MODE used by ledgergroups.py and group_and_ledgers.py. In 'view'
+# mode ledger_table only stores parent_group and the group details are read through
+# ledger_table_enriched.
+LEDGER_GROUP_MODE = os.getenv('LEDGER_GROUP_MODE', 'copy')
+LEDGER_SOURCE_TABLE = 'ledger_table_enriched' if LEDGER_GROUP_MODE == 'view' else 'ledger_table'
+
+# Next free GL code per account group code, so allocation never scans ledger_table_gl_code
+GL_COUNTERS_TABLE_NAME = "gl_code_counters"
+# Column order of the rows built by LedgerGLCodeAssignment.build_gl_code_row
+GL_CODE_COLUMNS = [
+    'gl_code', 'ledger_id', 'ledger_name', 'category_name', 'account_group_name', 'primary_group',
+    'parent_group', 'group_parent', 'isupdate', 'group_name', 'is_revenue', 'is_deemed_positive',
+    'affects_gross_profit'
+]
+# Fields compared between ledger_table and ledger_table_gl_code to decide whether an updated
+# ledger needs a new GL code
+GL_CODE_TRACKED_FIELDS = [
+    'ledger_name', 'parent_group', 'primary_group', 'group_name', 'group_parent',
+    'is_revenue', 'is_deemed_positive', 'affects_gross_profit'
+]
+
+CLASSIFICATION_MODEL = "gpt-3.5-turbo"
+# On-disk classification cache shared by every gl_code.py run on this machine, whichever
+# user database it works on. Entries older than the TTL are classified again; fallback
+# answers, given when the API had no valid answer, expire sooner so the API is asked again.
+CLASSIFICATION_CACHE_PATH = os.getenv(
+    'GL_CLASSIFICATION_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'classification_cache.sqlite3')
+)
+CLASSIFICATION_CACHE_TTL_DAYS = float(os.getenv('GL_CLASSIFICATION_CACHE_TTL_DAYS', '90'))
+CLASSIFICATION_FALLBACK_TTL_DAYS = float(os.getenv('GL_CLASSIFICATION_FALLBACK_TTL_DAYS', '7'))
+# Uncached entries are split into requests of at most this many entries and this many
+# estimated prompt tokens, and up to GL_CLASSIFICATION_CONCURRENCY requests run at once
+CLASSIFICATION_CONCURRENCY = max(1, int(os.getenv('GL_CLASSIFICATION_CONCURRENCY', '4')))
+CLASSIFICATION_MAX_BATCH_ENTRIES = max(1, int(os.getenv('GL_CLASSIFICATION_MAX_BATCH_ENTRIES', '50')))
+CLASSIFICATION_MAX_BATCH_TOKENS = int(os.getenv('GL_CLASSIFICATION_MAX_BATCH_TOKENS', '2000'))
+# Rate-limited or timed-out requests are retried with exponential backoff and jitter
+CLASSIFICATION_MAX_RETRIES = int(os.getenv('GL_CLASSIFICATION_MAX_RETRIES', '5'))
+CLASSIFICATION_RETRY_BASE_SECONDS = float(os.getenv('GL_CLASSIFICATION_RETRY_BASE_SECONDS', '1'))
+CLASSIFICATION_RETRY_MAX_SECONDS = 60
+RETRYABLE_OPENAI_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError
+)
+
+# Tally's reserved groups and the account group code their ledgers belong to. Entries are
+# matched on their parent group, then that group's parent, then their primary group, so
+# ledgers under user-defined subgroups of a reserved group are resolved as well.
+TALLY_RESERVED_GROUP_CODES = {
+    'capital account': 'SHCP',
+    'reserves & surplus': 'RESV',
+    'loans (liability)': 'LTBR',
+    'secured loans': 'LTBR',
+    'unsecured loans': 'LTBR',
+    'bank od a/c': 'STBR',
+    'sundry creditors': 'TRPY-C',
+    'duties & taxes': 'OCLI',
+    'provisions': 'STPR',
+    'current liabilities': 'OCLI',
+    'fixed assets': 'PPEA',
+    'investments': 'NCIN',
+    'deposits (asset)': 'LTLA',
+    'loans & advances (asset)': 'STLA',
+    'stock-in-hand': 'INVT',
+    'sundry debtors': 'TRDR-C',
+    'cash-in-hand': 'CASH',
+    'bank accounts': 'CASH',
+    'current assets': 'OCCA',
+    'misc. expenses (asset)': 'OCCA',
+    'sales accounts': 'REVO',
+    'direct incomes': 'REVO',
+    'indirect incomes': 'OTHI',
+    'purchase accounts': 'PURC',
+    'direct expenses': 'COGS',
+    'indirect expenses': 'OTHE',
+}
+# Broad reserved groups whose user-defined subgroups (e.g. Salaries under Indirect
+# Expenses) can belong to other codes. They only decide ledgers placed directly in them.
+TALLY_BROAD_GROUPS = {
+    'current liabilities', 'current assets', 'direct incomes', 'indirect incomes',
+    'direct expenses', 'indirect expenses',
+}
+
+
+def normalize_group_name(name: Optional[str]) -> str:
+    """Lower-case a Tally group name with its XML entities decoded and whitespace collapsed."""
+    return ' '.join(html.unescape(name or '').lower().split())
+
 # Define a filter to allow only logs below a certain level
 class MaxLevelFilter(logging.Filter):
     def __init__(self, max_level):
@@ -44,9 +143,15 @@ logger.addHandler(error_handler)
 
 class LedgerAIClassifier:
     """AI-powered classifier for ledger entries using OpenAI's GPT models."""
-    def __init__(self, api_key: str, classification_schema: str = None):
+    def __init__(self, api_key: str, classification_schema: str = None, cache_path: str = CLASSIFICATION_CACHE_PATH):
         openai.api_key = api_key
-        self.classification_cache = {}
+        # Loaded from cache_path on first use; see load_classification_cache
+        self.classification_cache = None
+        # Entries seen during this run, and how each distinct cache key was first resolved:
+        # 'rules', 'cache', 'api', or 'fallback' when the API gave no valid answer
+        self.classified_entry_count = 0
+        self.classification_sources = {}
+        self.cache_path = cache_path
         if classification_schema is None:
             self.classification_schema = (
                 "You are a financial accounting expert. Given the following account groups and categories with their GL code ranges, "
@@ -106,56 +211,269 @@ class LedgerAIClassifier:
             )
         else:
             self.classification_schema = classification_schema
+        # Cached answers only hold for the prompt and model that produced them
+        self.schema_version = hashlib.sha1(
+            f"{CLASSIFICATION_MODEL}\n{self.classification_schema}".encode('utf-8')
+        ).hexdigest()[:16]
 
     def get_cache_key(self, entry_data: Dict) -> str:
         return f"{entry_data['primary_group']}::{entry_data['parent_group']}"
 
+    def load_classification_cache(self):
+        """
+        Load the unexpired classifications for the current schema version from the on-disk
+        cache, once per classifier. Each row records whether it came from the API or the
+        fallback rules, which decides its TTL. The cache is an optimisation only, so an
+        unreadable cache file is logged and the run carries on without it.
+        """
+        if self.classification_cache is not None:
+            return
+        self.classification_cache = {}
+        if not self.cache_path:
+            return
+        try:
+            with closing(sqlite3.connect(self.cache_path, timeout=30)) as cache_db:
+                with cache_db:
+                    cache_db.execute("""
+                        CREATE TABLE IF NOT EXISTS classification_cache (
+                            cache_key TEXT NOT NULL,
+                            schema_version TEXT NOT NULL,
+                            category TEXT NOT NULL,
+                            created_at REAL NOT NULL,
+                            source TEXT NOT NULL DEFAULT 'api',
+                            PRIMARY KEY (cache_key, schema_version)
+                        )
+                    """)
+                    columns = {row[1] for row in cache_db.execute("PRAGMA table_info(classification_cache)")}
+                    if 'source' not in columns:
+                        # Caches written before fallback answers were stored hold API answers only
+                        cache_db.execute("ALTER TABLE classification_cache ADD COLUMN source TEXT NOT NULL DEFAULT 'api'")
+                api_cutoff, fallback_cutoff = self._cache_cutoffs(time.time())
+                rows = cache_db.execute("""
+                    SELECT cache_key, category, source
+                    FROM classification_cache
+                    WHERE schema_version = ?
+                      AND created_at >= CASE source WHEN 'fallback' THEN ? ELSE ? END
+                """, (self.schema_version, fallback_cutoff, api_cutoff)).fetchall()
+            valid_categories = self._get_valid_categories()
+            fallback_count = 0
+            for cache_key, category, source in rows:
+                if category in valid_categories:
+                    self.classification_cache[cache_key] = category
+                    fallback_count += source == 'fallback'
+            logger.info(f"Loaded {len(self.classification_cache)} cached classifications "
+                        f"({fallback_count} from fallback rules) from {self.cache_path}")
+        except sqlite3.Error as e:
+            logger.warning(f"Classification cache {self.cache_path} unavailable, continuing without it: {e}")
+
+    @staticmethod
+    def _cache_cutoffs(now: float) -> Tuple[float, float]:
+        """Oldest created_at still valid for API answers and for fallback answers."""
+        return now - CLASSIFICATION_CACHE_TTL_DAYS * 86400, now - CLASSIFICATION_FALLBACK_TTL_DAYS * 86400
+
+    def save_classifications(self, new_classifications: Dict[str, Tuple[str, str]]):
+        """
+        Write classifications made during this run to the on-disk cache, given as
+        {cache_key: (category, source)} with source 'api' or 'fallback'.
+        """
+        if not new_classifications or not self.cache_path:
+            return
+        now = time.time()
+        api_cutoff, fallback_cutoff = self._cache_cutoffs(now)
+        try:
+            with closing(sqlite3.connect(self.cache_path, timeout=30)) as cache_db:
+                with cache_db:
+                    cache_db.executemany("""
+                        INSERT OR REPLACE INTO classification_cache (cache_key, schema_version, category, created_at, source)
+                        VALUES (?, ?, ?, ?, ?)
+                    """, [
+                        (cache_key, self.schema_version, category, now, source)
+                        for cache_key, (category, source) in new_classifications.items()
+                    ])
+                    cache_db.execute(
+                        "DELETE FROM classification_cache WHERE created_at < CASE source WHEN 'fallback' THEN ? ELSE ? END",
+                        (fallback_cutoff, api_cutoff)
+                    )
+            logger.debug(f"Saved {len(new_classifications)} new classifications to {self.cache_path}")
+        except sqlite3.Error as e:
+            logger.warning(f"Could not update classification cache {self.cache_path}: {e}")
+
     def batch_classify_entries(self, entries: List[Dict]) -> Dict[str, str]:
+        """
+        Classify entries by cache key. Entries under Tally's reserved groups are resolved
+        by rules, the rest from the cache or the API; see iter_classification_results.
+        """
+        classifications, unique_entries = self._resolve_known_classifications(entries)
+        for results in self.iter_classification_results(unique_entries):
+            classifications.update(results)
+        return classifications
+
+    def iter_classified_batches(self, entries: List[Dict], batch_size: int) -> Iterator[Tuple[int, List[str]]]:
+        """
+        Classify entries like batch_classify_entries, yielding (start, categories) for each
+        slice entries[start:start + batch_size] as soon as every key in it is resolved.
+        The API requests for later slices keep running while a slice is being written.
+        """
+        classifications, unique_entries = self._resolve_known_classifications(entries)
+        results = self.iter_classification_results(unique_entries)
+        for start in range(0, len(entries), batch_size):
+            cache_keys = [self.get_cache_key(entry) for entry in entries[start:start + batch_size]]
+            for cache_key in cache_keys:
+                # Requests follow the order keys first appear in, so this never skips ahead
+                while cache_key not in classifications:
+                    classifications.update(next(results))
+            yield start, [classifications[cache_key] for cache_key in cache_keys]
+
+    def _resolve_known_classifications(self, entries: List[Dict]) -> Tuple[Dict[str, str], Dict[str, Dict]]:
+        """
+        Split entries into classifications already known from the rules or the cache, and
+        one entry per remaining cache key, in the order the keys first appear.
+        """
         unique_entries = {}
         classifications = {}
+        self.load_classification_cache()
 
+        sources = self.classification_sources
+        self.classified_entry_count += len(entries)
         for entry in entries:
             cache_key = self.get_cache_key(entry)
-            if cache_key in self.classification_cache:
+            category = self.rule_classification(entry)
+            if category is not None:
+                classifications[cache_key] = category
+                sources.setdefault(cache_key, 'rules')
+            elif cache_key in self.classification_cache:
                 classifications[cache_key] = self.classification_cache[cache_key]
-            elif cache_key not in unique_entries:
-                unique_entries[cache_key] = entry
+                sources.setdefault(cache_key, 'cache')
+            else:
+                unique_entries.setdefault(cache_key, entry)
+        return classifications, unique_entries
 
+    def iter_classification_results(self, unique_entries: Dict[str, Dict]) -> Iterator[Dict[str, str]]:
+        """
+        Classify uncached keys with the API, yielding {cache_key: category} per request.
+        Keys are split into token-bounded requests that run on a thread pool of
+        CLASSIFICATION_CONCURRENCY workers. Results come back in request order, so the
+        outcome does not depend on which request finishes first, and each request's
+        answers are written to the on-disk cache as soon as they come back. Fallback
+        answers are cached too, under CLASSIFICATION_FALLBACK_TTL_DAYS, so a re-run does
+        not ask the API again for keys it could not classify.
+        """
         if not unique_entries:
-            return classifications
-
+            return
+        batches = self._split_batches(list(unique_entries.items()))
+        workers = min(CLASSIFICATION_CONCURRENCY, len(batches))
+        logger.info(f"Classifying {len(unique_entries)} entries in {len(batches)} requests with {workers} workers")
+        executor = ThreadPoolExecutor(max_workers=workers)
         try:
-            entries_description = "\n".join(
-                f"Entry: Primary Group: {entry['primary_group']}, Parent Group: {entry['parent_group']}, Name: {entry['ledger_name']}"
-                for entry in unique_entries.values()
-            )
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": self.classification_schema},
-                    {"role": "user", "content": f"Classify these entries (return an array of account group codes only):\n{entries_description}"}
-                ],
-                temperature=0.1
-            )
+            for future in [executor.submit(self._classify_batch, batch) for batch in batches]:
+                classifications = {}
+                new_classifications = {}
+                for cache_key, (category, from_api) in future.result().items():
+                    source = 'api' if from_api else 'fallback'
+                    classifications[cache_key] = category
+                    self.classification_cache[cache_key] = category
+                    new_classifications[cache_key] = (category, source)
+                    self.classification_sources.setdefault(cache_key, source)
+                self.save_classifications(new_classifications)
+                yield classifications
+        finally:
+            # A caller that stops early does not wait for the requests it no longer needs
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def rule_classification(self, entry_data: Dict) -> Optional[str]:
+        """Account group code implied by the reserved Tally group an entry sits under, if any."""
+        parent_group = normalize_group_name(entry_data.get('parent_group'))
+        if parent_group in TALLY_RESERVED_GROUP_CODES:
+            return TALLY_RESERVED_GROUP_CODES[parent_group]
+        for group in (entry_data.get('group_parent'), entry_data.get('primary_group')):
+            group = normalize_group_name(group)
+            if group in TALLY_RESERVED_GROUP_CODES and group not in TALLY_BROAD_GROUPS:
+                return TALLY_RESERVED_GROUP_CODES[group]
+        return None
+
+    def log_classification_stats(self):
+        if not self.classified_entry_count:
+            return
+        counts = Counter(self.classification_sources.values())
+        total_keys = len(self.classification_sources)
+        logger.info(
+            f"Classified {self.classified_entry_count} entries under {total_keys} distinct keys: {counts['rules']} by reserved-group rules "
+            f"({counts['rules'] / total_keys:.0%}), {counts['cache']} from cache, {counts['api']} by the API, "
+            f"{counts['fallback']} by fallback rules after the API gave no valid answer"
+        )
+
+    @staticmethod
+    def _describe_entry(entry: Dict) -> str:
+        return f"Entry: Primary Group: {entry['primary_group']}, Parent Group: {entry['parent_group']}, Name: {entry['ledger_name']}"
+
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        # Roughly four characters per token for English text, plus a margin for the
+        # JSON array element returned per entry
+        return len(text) // 4 + 8
+
+    def _split_batches(self, items: List[tuple]) -> List[List[tuple]]:
+        batches = []
+        batch = []
+        batch_tokens = 0
+        for cache_key, entry in items:
+            entry_tokens = self._estimate_tokens(self._describe_entry(entry))
+            if batch and (len(batch) >= CLASSIFICATION_MAX_BATCH_ENTRIES
+                          or batch_tokens + entry_tokens > CLASSIFICATION_MAX_BATCH_TOKENS):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+            batch.append((cache_key, entry))
+            batch_tokens += entry_tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _request_classification(self, entries_description: str):
+        for attempt in range(CLASSIFICATION_MAX_RETRIES + 1):
+            try:
+                return openai.ChatCompletion.create(
+                    model=CLASSIFICATION_MODEL,
+                    messages=[
+                        {"role": "system", "content": self.classification_schema},
+                        {"role": "user", "content": f"Classify these entries (return an array of account group codes only):\n{entries_description}"}
+                    ],
+                    temperature=0.1
+                )
+            except RETRYABLE_OPENAI_ERRORS as e:
+                if attempt == CLASSIFICATION_MAX_RETRIES:
+                    raise
+                delay = min(CLASSIFICATION_RETRY_MAX_SECONDS, CLASSIFICATION_RETRY_BASE_SECONDS * 2 ** attempt)
+                delay = delay / 2 + random.uniform(0, delay / 2)
+                logger.warning(f"Classification request failed ({type(e).__name__}), retrying in {delay:.1f}s "
+                               f"({attempt + 1}/{CLASSIFICATION_MAX_RETRIES})")
+                time.sleep(delay)
+
+    def _classify_batch(self, batch: List[tuple]) -> Dict[str, tuple]:
+        """
+        Classify one request's worth of entries. Returns {cache_key: (category, from_api)};
+        entries the API could not classify get the rule-based fallback.
+        """
+        results = {}
+        try:
+            entries_description = "\n".join(self._describe_entry(entry) for _, entry in batch)
+            response = self._request_classification(entries_description)
             try:
                 categories = json.loads(response.choices[0].message.content)
-                for (cache_key, _), category in zip(unique_entries.items(), categories):
-                    if category in self._get_valid_categories():
-                        self.classification_cache[cache_key] = category
-                        classifications[cache_key] = category
+                valid_categories = self._get_valid_categories()
+                for (cache_key, _), category in zip(batch, categories):
+                    if category in valid_categories:
+                        results[cache_key] = (category, True)
                     else:
                         logger.warning(f"Invalid category received: {category}")
-                        classifications[cache_key] = self._fallback_classification(unique_entries[cache_key])
             except json.JSONDecodeError:
                 logger.error("Failed to parse AI response as JSON")
-                for cache_key, entry in unique_entries.items():
-                    classifications[cache_key] = self._fallback_classification(entry)
         except Exception as e:
             logger.error(f"Batch AI classification failed: {e}")
-            for cache_key, entry in unique_entries.items():
-                classifications[cache_key] = self._fallback_classification(entry)
-
-        return classifications
+        for cache_key, entry in batch:
+            if cache_key not in results:
+                results[cache_key] = (self._fallback_classification(entry), False)
+        return results
 
     def _get_valid_categories(self):
         return {
@@ -192,6 +510,8 @@ class LedgerGLCodeAssignment:
         self.batch_size = 50
         self.category_ranges = {}
         self.gl_counters = None
+        # Categories whose counter moved since it was last written to GL_COUNTERS_TABLE_NAME
+        self.dirty_gl_counters = set()
 
     def connect(self):
         try:
@@ -257,6 +577,17 @@ class LedgerGLCodeAssignment:
             )
             """
             self.cur.execute(create_table_query)
+            # Lets the one-off counter seeding below find each range's max with an index probe
+            self.cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_ledger_table_gl_code_gl_code_int
+                ON ledger_table_gl_code ((CAST(gl_code AS INTEGER)))
+            """)
+            self.cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {GL_COUNTERS_TABLE_NAME} (
+                    category_code VARCHAR(10) PRIMARY KEY,
+                    next_value INTEGER NOT NULL
+                )
+            """)
             self.conn.commit()
             logger.info("ledger_table_gl_code table checked/created successfully")
         except Error as e:
@@ -265,38 +596,65 @@ class LedgerGLCodeAssignment:
             raise
 
     def initialize_gl_counters(self):
-        """Initialize GL counters based on existing entries."""
+        """
+        Load the GL counters from gl_code_counters. Categories without a stored counter yet
+        are seeded from the existing entries with a single query over all of their ranges.
+        """
         try:
             if not self.category_ranges:
                 self.load_category_ranges()
             self.gl_counters = {code: info['start'] for code, info in self.category_ranges.items()}
-            for category_code in self.category_ranges.keys():
-                query = """
-                SELECT MAX(CAST(gl_code AS INTEGER))
-                FROM ledger_table_gl_code
-                WHERE CAST(gl_code AS INTEGER) BETWEEN %s AND %s
-                """
-                self.cur.execute(query, (
-                    self.category_ranges[category_code]['start'],
-                    self.category_ranges[category_code]['end']
-                ))
-                max_gl_code = self.cur.fetchone()[0]
-                if max_gl_code:
-                    self.gl_counters[category_code] = max_gl_code + 1
-            logger.info("GL counters initialized successfully")
+            self.cur.execute(f"SELECT category_code, next_value FROM {GL_COUNTERS_TABLE_NAME}")
+            stored = dict(self.cur.fetchall())
+            missing = [code for code in self.category_ranges if code not in stored]
+            if missing:
+                # Each scalar subquery is answered from idx_ledger_table_gl_code_gl_code_int
+                seeded = execute_values(self.cur, """
+                    SELECT r.category_code,
+                           COALESCE((SELECT MAX(CAST(gl.gl_code AS INTEGER)) + 1
+                                     FROM ledger_table_gl_code gl
+                                     WHERE CAST(gl.gl_code AS INTEGER) BETWEEN r.start_value AND r.end_value),
+                                    r.start_value)
+                    FROM (VALUES %s) AS r (category_code, start_value, end_value)
+                """, [(code, self.category_ranges[code]['start'], self.category_ranges[code]['end']) for code in missing],
+                    fetch=True)
+                stored.update(seeded)
+                self.dirty_gl_counters.update(missing)
+            for code, next_value in stored.items():
+                if code in self.gl_counters:
+                    self.gl_counters[code] = max(next_value, self.gl_counters[code])
+            self.save_gl_counters()
+            self.conn.commit()
+            logger.info(f"GL counters initialized successfully ({len(missing)} seeded from ledger_table_gl_code)")
         except Error as e:
             logger.error(f"Error initializing GL counters: {e}")
+            self.conn.rollback()
             raise
 
+    def save_gl_counters(self):
+        """
+        Write the counters that moved to gl_code_counters, in the caller's transaction, so
+        they are committed together with the GL codes they handed out.
+        """
+        if not self.dirty_gl_counters:
+            return
+        execute_values(self.cur, f"""
+            INSERT INTO {GL_COUNTERS_TABLE_NAME} (category_code, next_value)
+            VALUES %s
+            ON CONFLICT (category_code)
+            DO UPDATE SET next_value = GREATEST({GL_COUNTERS_TABLE_NAME}.next_value, EXCLUDED.next_value)
+        """, [(code, self.gl_counters[code]) for code in sorted(self.dirty_gl_counters)])
+        self.dirty_gl_counters.clear()
+
     def get_unprocessed_entries(self):
         """
         Fetch entries from ledger_table that haven't been processed yet.
         This function assumes that ledger_table is already present in the database.
         """
         try:
-            query = """
+            query = f"""
             SELECT lt.*
-            FROM ledger_table lt
+            FROM {LEDGER_SOURCE_TABLE} lt
             LEFT JOIN ledger_table_gl_code gl ON lt.ledger_id = gl.ledger_id
             WHERE gl.ledger_id IS NULL
             """
@@ -313,8 +671,25 @@ class LedgerGLCodeAssignment:
             raise ValueError(f"GL code range exceeded for category {category_code}")
         gl_code = f"{current_value:06d}"
         self.gl_counters[category_code] += 1
+        self.dirty_gl_counters.add(category_code)
         return gl_code
 
+    @staticmethod
+    def build_gl_code_row(gl_code: str, entry: tuple, category_info: Dict) -> tuple:
+        """Row in GL_CODE_COLUMNS order for a ledger_table entry and its category."""
+        return (
+            gl_code, entry[0], entry[1], category_info['category'], category_info['group'], entry[3],
+            entry[2], entry[5], False, entry[4], entry[6], entry[7], entry[8]
+        )
+
+    def insert_gl_code_rows(self, rows: List[tuple]):
+        if not rows:
+            return
+        execute_values(self.cur, f"""
+            INSERT INTO ledger_table_gl_code ({', '.join(GL_CODE_COLUMNS)})
+            VALUES %s
+        """, rows, page_size=1000)
+
     def process_ledger_entries(self):
         """Process new ledger entries in batches and insert them into ledger_table_gl_code."""
         try:
@@ -326,59 +701,34 @@ class LedgerGLCodeAssignment:
                 return
             processed_count = 0
             logger.info(f"Found {total_entries} new entries to process")
-            for i in range(0, total_entries, self.batch_size):
-                batch = unprocessed_entries[i:i + self.batch_size]
-                batch_entries = []
-                for entry in batch:
-                    entry_dict = {
-                        'ledger_id': entry[0],
-                        'ledger_name': entry[1],
-                        'parent_group': entry[2],
-                        'primary_group': entry[3],
-                        'group_name': entry[4],
-                        'group_parent': entry[5]
-                    }
-                    batch_entries.append((entry, entry_dict))
-                classifications = self.ai_classifier.batch_classify_entries(
-                    [entry_dict for _, entry_dict in batch_entries]
-                )
-                for entry, entry_dict in batch_entries:
+            entry_dicts = [
+                {
+                    'ledger_id': entry[0],
+                    'ledger_name': entry[1],
+                    'parent_group': entry[2],
+                    'primary_group': entry[3],
+                    'group_name': entry[4],
+                    'group_parent': entry[5]
+                }
+                for entry in unprocessed_entries
+            ]
+            # The API requests for all entries run concurrently, and each batch is written
+            # as soon as its classifications are in; GL codes are still assigned in entry order
+            for i, categories in self.ai_classifier.iter_classified_batches(entry_dicts, self.batch_size):
+                batch = unprocessed_entries[i:i + len(categories)]
+                rows = []
+                for entry, category_code in zip(batch, categories):
                     try:
-                        cache_key = self.ai_classifier.get_cache_key(entry_dict)
-                        category_code = classifications.get(cache_key, 'CASH')
                         gl_code = self.get_next_gl_code(category_code)
-                        category_info = self.category_ranges[category_code]
-                        params = {
-                            'gl_code': gl_code,
-                            'ledger_id': entry[0],
-                            'ledger_name': entry[1],
-                            'category_name': category_info['category'],
-                            'account_group_name': category_info['group'],
-                            'primary_group': entry[3],
-                            'parent_group': entry[2],
-                            'group_parent': entry[5],
-                            'isupdate': False,
-                            'group_name': entry[4],
-                            'is_revenue': entry[6],
-                            'is_deemed_positive': entry[7],
-                            'affects_gross_profit': entry[8]
-                        }
-                        insert_query = """
-                        INSERT INTO ledger_table_gl_code (
-                            gl_code, ledger_id, ledger_name, category_name, account_group_name, primary_group, parent_group, group_parent, isupdate, group_name, is_revenue, is_deemed_positive, affects_gross_profit
-                        ) VALUES (
-                            %(gl_code)s, %(ledger_id)s, %(ledger_name)s, %(category_name)s, %(account_group_name)s, %(primary_group)s, %(parent_group)s, %(group_parent)s, %(isupdate)s, %(group_name)s, %(is_revenue)s, %(is_deemed_positive)s, %(affects_gross_profit)s
-                        )
-                        """
-                        self.cur.execute(insert_query, params)
-                        processed_count += 1
-                        if processed_count % 10 == 0:
-                            logger.info(f"Processed {processed_count}/{total_entries} entries")
+                        rows.append(self.build_gl_code_row(gl_code, entry, self.category_ranges[category_code]))
                     except Exception as e:
                         logger.error(f"Error processing entry {entry[0]}: {e}")
                         continue
+                self.insert_gl_code_rows(rows)
+                self.save_gl_counters()
                 self.conn.commit()
-                logger.info(f"Committed batch of {len(batch)} entries")
+                processed_count += len(rows)
+                logger.info(f"Committed batch of {len(rows)} entries ({processed_count}/{total_entries})")
             logger.info(f"Successfully processed all {total_entries} new entries")
         except Error as e:
             logger.error(f"Database error: {e}")
@@ -407,6 +757,22 @@ class LedgerGLCodeAssignment:
             FROM ledger_table
             WHERE isupdate = TRUE
             """
+            if LEDGER_GROUP_MODE == 'view':
+                # A group change does not touch ledger_table in view mode, so ledgers whose
+                # group details no longer match their GL code row are picked up as well
+                query = """
+                SELECT lt.*
+                FROM ledger_table_enriched lt
+                JOIN ledger_table l ON l.ledger_id = lt.ledger_id
+                LEFT JOIN ledger_table_gl_code gl ON gl.ledger_id = lt.ledger_id
+                WHERE l.isupdate = TRUE
+                   OR (gl.ledger_id IS NOT NULL
+                       AND (lt.primary_group, lt.group_name, lt.group_parent,
+                            lt.is_revenue, lt.is_deemed_positive, lt.affects_gross_profit)
+                           IS DISTINCT FROM
+                           (gl.primary_group, gl.group_name, gl.group_parent,
+                            gl.is_revenue, gl.is_deemed_positive, gl.affects_gross_profit))
+                """
             self.cur.execute(query)
             updated_entries = self.cur.fetchall()
             if not updated_entries:
@@ -427,121 +793,71 @@ class LedgerGLCodeAssignment:
             classifications = self.ai_classifier.batch_classify_entries(
                 [entry_dict for _, entry_dict in batch_entries]
             )
+            ledger_ids = [entry[0] for entry, _ in batch_entries]
+            # Existing GL code rows of every updated ledger, read in one statement
+            self.cur.execute(f"""
+                SELECT ledger_id, account_group_name, category_name, {', '.join(GL_CODE_TRACKED_FIELDS)}
+                FROM ledger_table_gl_code
+                WHERE ledger_id = ANY(%s)
+            """, (ledger_ids,))
+            existing_rows = {row[0]: row[1:] for row in self.cur.fetchall()}
+
+            new_rows = []
+            changed_rows = []
+            failed_ids = set()
             for entry, entry_dict in batch_entries:
                 ledger_id = entry[0]
                 cache_key = self.ai_classifier.get_cache_key(entry_dict)
                 new_category_code = classifications.get(cache_key, 'CASH')
                 new_category_info = self.category_ranges[new_category_code]
-                # Fetch the existing record from ledger_table_gl_code (selecting needed fields)
-                select_query = """
-                    SELECT account_group_name, category_name, ledger_name, parent_group, primary_group, group_name, group_parent, is_revenue, is_deemed_positive, affects_gross_profit
-                    FROM ledger_table_gl_code
-                    WHERE ledger_id = %s
-                """
-                self.cur.execute(select_query, (ledger_id,))
-                result = self.cur.fetchone()
-                # Current values from ledger_table
-                current_values = {
-                    'ledger_name': entry[1],
-                    'parent_group': entry[2],
-                    'primary_group': entry[3],
-                    'group_name': entry[4],
-                    'group_parent': entry[5],
-                    'is_revenue': entry[6],
-                    'is_deemed_positive': entry[7],
-                    'affects_gross_profit': entry[8]
-                }
-                update_required = False
-                if result:
-                    existing_values = {
-                        'account_group_name': result[0],
-                        'category_name': result[1],
-                        'ledger_name': result[2],
-                        'parent_group': result[3],
-                        'primary_group': result[4],
-                        'group_name': result[5],
-                        'group_parent': result[6],
-                        'is_revenue': result[7],
-                        'is_deemed_positive': result[8],
-                        'affects_gross_profit': result[9]
-                    }
-                    # Check if classification changed
-                    if (existing_values['account_group_name'] != new_category_info['group'] or 
-                        existing_values['category_name'] != new_category_info['category']):
-                        update_required = True
-                    # Check if any of the critical fields have changed
-                    for field in ['ledger_name', 'parent_group', 'primary_group', 'group_name', 'group_parent', 'is_revenue', 'is_deemed_positive', 'affects_gross_profit']:
-                        if str(existing_values.get(field)) != str(current_values.get(field)):
-                            update_required = True
-                            break
-                    if update_required:
-                        try:
-                            new_gl_code = self.get_next_gl_code(new_category_code)
-                        except Exception as e:
-                            logger.error(f"Error generating new GL code for ledger_id {ledger_id}: {e}")
-                            continue
-                        update_query = """
-                            UPDATE ledger_table_gl_code
-                            SET gl_code = %s, account_group_name = %s, category_name = %s,
-                                ledger_name = %s, primary_group = %s, parent_group = %s, group_parent = %s,
-                                isupdate = false, group_name = %s, is_revenue = %s, is_deemed_positive = %s, affects_gross_profit = %s
-                            WHERE ledger_id = %s
-                        """
-                        self.cur.execute(update_query, (
-                            new_gl_code,
-                            new_category_info['group'],
-                            new_category_info['category'],
-                            current_values['ledger_name'],
-                            current_values['primary_group'],
-                            current_values['parent_group'],
-                            current_values['group_parent'],
-                            current_values['group_name'],
-                            current_values['is_revenue'],
-                            current_values['is_deemed_positive'],
-                            current_values['affects_gross_profit'],
-                            ledger_id
-                        ))
-                        logger.info(f"Updated ledger {ledger_id} with new GL code and updated fields.")
-                    else:
-                        logger.info(f"Ledger {ledger_id} has no changes in critical fields. No update needed.")
+                # Current values from ledger_table, in GL_CODE_TRACKED_FIELDS order
+                current_values = (entry[1], entry[2], entry[3], entry[4], entry[5], entry[6], entry[7], entry[8])
+                existing = existing_rows.get(ledger_id)
+                if existing is not None:
+                    # Changed classification (account_group_name, category_name) or tracked fields
+                    update_required = (
+                        existing[0] != new_category_info['group']
+                        or existing[1] != new_category_info['category']
+                        or any(str(old) != str(new) for old, new in zip(existing[2:], current_values))
+                    )
+                    if not update_required:
+                        continue
                 else:
-                    # No record exists: insert new record into ledger_table_gl_code
                     logger.warning(f"Updated ledger {ledger_id} not found in ledger_table_gl_code. Inserting new record.")
-                    try:
-                        new_gl_code = self.get_next_gl_code(new_category_code)
-                    except Exception as e:
-                        logger.error(f"Error generating new GL code for ledger_id {ledger_id}: {e}")
-                        continue
-                    params = {
-                        'gl_code': new_gl_code,
-                        'ledger_id': entry[0],
-                        'ledger_name': entry[1],
-                        'category_name': new_category_info['category'],
-                        'account_group_name': new_category_info['group'],
-                        'primary_group': entry[3],
-                        'parent_group': entry[2],
-                        'group_parent': entry[5],
-                        'isupdate': False,
-                        'group_name': entry[4],
-                        'is_revenue': entry[6],
-                        'is_deemed_positive': entry[7],
-                        'affects_gross_profit': entry[8]
-                    }
-                    insert_query = """
-                        INSERT INTO ledger_table_gl_code (
-                            gl_code, ledger_id, ledger_name, category_name, account_group_name, primary_group, parent_group, group_parent, isupdate, group_name, is_revenue, is_deemed_positive, affects_gross_profit
-                        ) VALUES (
-                            %(gl_code)s, %(ledger_id)s, %(ledger_name)s, %(category_name)s, %(account_group_name)s, %(primary_group)s, %(parent_group)s, %(group_parent)s, %(isupdate)s, %(group_name)s, %(is_revenue)s, %(is_deemed_positive)s, %(affects_gross_profit)s
-                        )
-                    """
-                    self.cur.execute(insert_query, params)
-                # In all cases, update the isupdate flag in ledger_table to false.
-                update_ledger_query = """
-                    UPDATE ledger_table
-                    SET isupdate = false
-                    WHERE ledger_id = %s
-                """
-                self.cur.execute(update_ledger_query, (ledger_id,))
+                try:
+                    new_gl_code = self.get_next_gl_code(new_category_code)
+                except Exception as e:
+                    logger.error(f"Error generating new GL code for ledger_id {ledger_id}: {e}")
+                    failed_ids.add(ledger_id)
+                    continue
+                row = self.build_gl_code_row(new_gl_code, entry, new_category_info)
+                (changed_rows if existing is not None else new_rows).append(row)
+
+            if changed_rows:
+                # Explicit casts, since a column that is NULL in every VALUES row would
+                # otherwise be typed text
+                execute_values(self.cur, f"""
+                    UPDATE ledger_table_gl_code gl
+                    SET {', '.join(f"{column} = v.{column}" for column in GL_CODE_COLUMNS if column != 'ledger_id')}
+                    FROM (VALUES %s) AS v ({', '.join(GL_CODE_COLUMNS)})
+                    WHERE gl.ledger_id = v.ledger_id
+                """, changed_rows, template="""(
+                    %s::varchar, %s::integer, %s::varchar, %s::varchar, %s::varchar, %s::varchar,
+                    %s::varchar, %s::varchar, %s::boolean, %s::varchar, %s::boolean, %s::boolean,
+                    %s::boolean
+                )""", page_size=1000)
+            self.insert_gl_code_rows(new_rows)
+            # Clear the isupdate flag in ledger_table, except for ledgers left for the next run
+            self.cur.execute("""
+                UPDATE ledger_table
+                SET isupdate = false
+                WHERE ledger_id = ANY(%s) AND isupdate
+            """, ([ledger_id for ledger_id in ledger_ids if ledger_id not in failed_ids],))
+            logger.info(
+                f"Updated {len(changed_rows)} ledgers with new GL codes, inserted {len(new_rows)}, "
+                f"{len(batch_entries) - len(changed_rows) - len(new_rows) - len(failed_ids)} needed no change"
+            )
+            self.save_gl_counters()
             self.conn.commit()
             logger.info("Processed all updated entries successfully")
         except Error as e:
@@ -584,6 +900,7 @@ def main(session_data):
         processor.process_ledger_entries()
         # Process entries that have been updated (isupdate = TRUE)
         processor.process_updated_entries()
+        processor.ai_classifier.log_classification_stats()
         logger.info("GL code assignment completed successfully")
     except Exception as e:
         logger.error(f"An error occurred: {e}")
@@ -5,7 +5,7 @@ from datetime import datetime
 import xml.etree.ElementTree as ET
 import logging
 from logging.handlers import RotatingFileHandler
-from typing import List, Dict
+from typing import Iterator, List, Dict, Tuple
 import re
 import html
 import csv
@@ -15,6 +15,11 @@ import pandas as pd
 import numpy as np  # To handle numerical data types
 import os
 from dotenv import load_dotenv
+from tally_parsing import scan_tally_ledger_parents, unescape_xml_text
+from group_tables import (
+    LEDGER_GROUP_MODE, ensure_group_closure_table, ensure_ledger_enriched_view, refresh_group_closure,
+    upsert_ledgers
+)
 
 # Load environment variables from .env file
 load_dotenv()
@@ -30,6 +35,8 @@ logger.addHandler(handler)
 
 # Tally's HTTP interface URL from environment variables
 TALLY_URL = os.getenv("TALLY_URL", "http://localhost:9000")
+# Size of the response pieces read from Tally when streaming the ledger export
+TALLY_CHUNK_SIZE = 64 * 1024
 
 # PostgreSQL connection configuration from environment variables
 POSTGRES_CONFIG = {
@@ -49,7 +56,6 @@ class TallyLedgerSync:
         self.db_params = db_params
         self.tally_url = tally_url
         self.setup_logging()
-        self.group_cache = {}  # Cache for group information
 
     def setup_logging(self):
         self.logger = logging.getLogger('TallyLedgerSync')
@@ -60,31 +66,6 @@ class TallyLedgerSync:
             handler.setFormatter(formatter)
             self.logger.addHandler(handler)
 
-    def load_group_cache(self, conn):
-        """Load all tally groups into cache for efficient lookups."""
-        with conn.cursor() as cursor:
-            cursor.execute(f"""
-                SELECT name, primary_group, parent_group, group_name, 
-                       is_revenue, is_deemed_positive, affects_gross_profit, 
-                       sort_position 
-                FROM {GROUP_TABLE_NAME}
-            """)
-            for row in cursor.fetchall():
-                self.group_cache[row[0]] = {
-                    'primary_group': row[1],
-                    'parent_group': row[2],
-                    'group_name': row[3],
-                    'is_revenue': row[4],
-                    'is_deemed_positive': row[5],
-                    'affects_gross_profit': row[6],
-                    'sort_position': row[7]
-                }
-        self.logger.info(f"Loaded {len(self.group_cache)} groups into cache")
-
-    def get_group_details(self, parent_group_name: str) -> Dict:
-        """Get group details from cache."""
-        return self.group_cache.get(parent_group_name, {})
-
     def get_tally_data(self, payload: str, export_format: str = "XML") -> str:
         """Send XML payload to Tally and retrieve response."""
         headers = {"Content-Type": "text/xml;charset=utf-8"}
@@ -102,6 +83,32 @@ class TallyLedgerSync:
             self.logger.error(f"Error fetching data from Tally: {str(e)}")
             raise
 
+    def get_tally_data_stream(self, payload: str) -> Tuple[Iterator[bytes], str]:
+        """
+        Send payload to Tally and return the response body as raw byte chunks, read
+        while it downloads, together with the response encoding.
+        """
+        try:
+            self.logger.info(f"Sending streaming request to Tally: {self.tally_url}")
+            response = requests.post(
+                self.tally_url,
+                data=payload.encode('utf-8'),
+                headers={"Content-Type": "text/xml;charset=utf-8"},
+                timeout=120,
+                stream=True
+            )
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            self.logger.error(f"Error fetching data from Tally: {str(e)}", exc_info=True)
+            raise
+
+        def iter_chunks():
+            with response:
+                yield from response.iter_content(chunk_size=TALLY_CHUNK_SIZE)
+            self.logger.info("Received response from Tally")
+
+        return iter_chunks(), response.encoding or 'utf-8'
+
     def clean_xml(self, xml_string: str) -> str:
         """Clean the XML string to handle invalid characters and encoding issues."""
         # Remove invalid XML characters
@@ -197,7 +204,10 @@ class TallyLedgerSync:
         
         with conn.cursor() as cursor:
             cursor.execute(create_groups_table_query)
+            ensure_group_closure_table(cursor)
             cursor.execute(create_ledger_table_query)
+            if LEDGER_GROUP_MODE == 'view':
+                ensure_ledger_enriched_view(cursor, LEDGER_TABLE_NAME, GROUP_TABLE_NAME)
         conn.commit()
         self.logger.info("Ensured all tables exist with correct schema")
 
@@ -238,6 +248,8 @@ class TallyLedgerSync:
                     ) for group in group_data]
                     
                     extras.execute_batch(cursor, upsert_query.as_string(conn), values)
+                    # Keep group_closure on the same parent links as group_data
+                    refresh_group_closure(cursor, GROUP_TABLE_NAME, self.logger)
                     
                 conn.commit()
                 self.logger.info(f"Inserted/Updated {len(group_data)} group records into {GROUP_TABLE_NAME}")
@@ -392,39 +404,32 @@ class TallyLedgerSync:
 </ENVELOPE>"""
         return payload_xml
 
-    def parse_tally_ledger_response(self, xml_response: str) -> List[Dict]:
-        """Parse XML response from Tally and extract ledger information."""
+    def parse_tally_ledger_response(self, xml_response, encoding: str = 'utf-8') -> List[Dict]:
+        """
+        Parse XML response from Tally and extract ledger information.
+        xml_response may be the whole response text or an iterable of raw response chunks
+        in the given encoding; it is scanned in one pass and each ledger is paired with its
+        own PARENT. A ledger without a PARENT is kept with parent_group None, so
+        save_to_database reports it among the ledgers without a matching group.
+        """
         ledgers = []
+        missing_parent_count = 0
+        parent_groups = {None: None}
         try:
-            cleaned_xml = self.clean_xml(xml_response)
-           
-            # Parse using line-by-line approach
-            ledger_pattern = re.compile(r'<LEDGER\s+NAME="([^"]+)"[^>]*>')
-            parent_pattern = re.compile(r'<PARENT>([^<]+)</PARENT>')
-           
-            current_ledger = None
-            current_parent = None
-           
-            for line in cleaned_xml.splitlines():
-                ledger_match = ledger_pattern.search(line)
-                if ledger_match:
-                    current_ledger = self.decode_html_entities(ledger_match.group(1))
-               
-                parent_match = parent_pattern.search(line)
-                if parent_match:
-                    current_parent = self.decode_html_entities(parent_match.group(1))
-               
-                if current_ledger and current_parent:
-                    ledger_info = {
-                        'name': current_ledger.strip(),
-                        'parent_group': current_parent.strip()
-                    }
-                    ledgers.append(ledger_info)
-                    if len(ledgers) <= 3:
-                        self.logger.info(f"Sample ledger: {ledger_info}")
-                    current_ledger = None
-                    current_parent = None
-           
+            xml_chunks = [xml_response] if isinstance(xml_response, str) else xml_response
+            for names, parents in scan_tally_ledger_parents(xml_chunks, encoding):
+                # One decode per batch: the scanner strips NUL and no entity decodes to it
+                names = [name.strip() for name in unescape_xml_text('\x00'.join(names)).split('\x00')]
+                for parent in set(parents).difference(parent_groups):
+                    parent_groups[parent] = self.decode_html_entities(parent).strip() or None
+                parents = [parent_groups[parent] for parent in parents]
+                missing_parent_count += parents.count(None)
+                ledgers.extend([{'name': name, 'parent_group': parent} for name, parent in zip(names, parents)])
+
+            for ledger_info in ledgers[:3]:
+                self.logger.info(f"Sample ledger: {ledger_info}")
+            if missing_parent_count:
+                self.logger.warning(f"Found {missing_parent_count} ledgers without a parent group")
             self.logger.info(f"Successfully parsed {len(ledgers)} valid ledgers")
             return ledgers
         except Exception as e:
@@ -432,7 +437,7 @@ class TallyLedgerSync:
             raise
 
     def save_to_database(self, ledgers: List[Dict]):
-        """Insert or update ledger data into the database."""
+        """Insert or update ledger data into the database; see group_tables.upsert_ledgers."""
         if not ledgers:
             self.logger.warning("No ledgers to save to database")
             return
@@ -440,68 +445,14 @@ class TallyLedgerSync:
         try:
             with psycopg2.connect(**self.db_params) as conn:
                 self.ensure_tables_exist(conn)
-                self.load_group_cache(conn)
-                
-                inserted_count = 0
-                updated_count = 0
-                skipped_count = 0
-                
+
                 with conn.cursor() as cursor:
-                    for ledger in ledgers:
-                        if not ledger['name']:
-                            self.logger.warning(f"Skipping ledger with empty name: {ledger}")
-                            skipped_count += 1
-                            continue
-                        
-                        # Get group details from cache
-                        group_details = self.get_group_details(ledger['parent_group'])
-                        
-                        if not group_details:
-                            self.logger.warning(f"No matching group found for ledger {ledger['name']} with parent {ledger['parent_group']}")
-                            skipped_count += 1
-                            continue
-
-                        upsert_query = sql.SQL("""
-                        INSERT INTO {ledger_table} (
-                            ledger_name, parent_group, primary_group, group_name, group_parent,
-                            is_revenue, is_deemed_positive, affects_gross_profit, sort_position
-                        )
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ON CONFLICT (ledger_name)
-                        DO UPDATE SET
-                            parent_group = EXCLUDED.parent_group,
-                            primary_group = EXCLUDED.primary_group,
-                            group_name = EXCLUDED.group_name,
-                            group_parent = EXCLUDED.group_parent,
-                            is_revenue = EXCLUDED.is_revenue,
-                            is_deemed_positive = EXCLUDED.is_deemed_positive,
-                            affects_gross_profit = EXCLUDED.affects_gross_profit,
-                            sort_position = EXCLUDED.sort_position,
-                            created_at = CURRENT_TIMESTAMP
-                        RETURNING (xmax = 0) AS inserted;
-                        """).format(ledger_table=sql.Identifier(LEDGER_TABLE_NAME))
-                        
-                        cursor.execute(upsert_query, (
-                            ledger['name'],
-                            ledger['parent_group'],
-                            group_details.get('primary_group'),
-                            group_details.get('group_name'),
-                            group_details.get('parent_group'),  # This is the parent_group from group_data
-                            group_details.get('is_revenue'),
-                            group_details.get('is_deemed_positive'),
-                            group_details.get('affects_gross_profit'),
-                            group_details.get('sort_position')
-                        ))
-                        
-                        # Check if it was an insert or update
-                        result = cursor.fetchone()
-                        if result and result[0]:
-                            inserted_count += 1
-                        else:
-                            updated_count += 1
-                            
+                    inserted_count, updated_count, unchanged_count, skipped_count = upsert_ledgers(
+                        cursor, ledgers, LEDGER_TABLE_NAME, GROUP_TABLE_NAME, self.logger
+                    )
+
                 conn.commit()
-                self.logger.info(f"Database sync completed: {inserted_count} inserted, {updated_count} updated, {skipped_count} skipped")
+                self.logger.info(f"Database sync completed: {inserted_count} inserted, {updated_count} updated, {unchanged_count} unchanged, {skipped_count} skipped")
                 
         except psycopg2.Error as e:
             self.logger.error(f"Database error: {str(e)}")
@@ -512,8 +463,8 @@ class TallyLedgerSync:
         try:
             self.logger.info("Starting ledger synchronization...")
             payload = self.construct_ledger_payload()
-            xml_response = self.get_tally_data(payload, export_format="XML")
-            ledgers = self.parse_tally_ledger_response(xml_response)
+            response_chunks, encoding = self.get_tally_data_stream(payload)
+            ledgers = self.parse_tally_ledger_response(response_chunks, encoding)
             
             if ledgers:
                 self.save_to_database(ledgers)
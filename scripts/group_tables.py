@@ -0,0 +1,227 @@
+import os
+import logging
+from typing import Dict, List, Tuple
+
+import psycopg2
+from psycopg2 import sql, extras
+
+# 'copy' stores group details on every ledger_table row. 'view' stores only parent_group
+# and reads group details through LEDGER_ENRICHED_VIEW_NAME, so a group change rewrites
+# one group_data row instead of all of its ledgers.
+LEDGER_GROUP_MODE = os.getenv('LEDGER_GROUP_MODE', 'copy')
+LEDGER_ENRICHED_VIEW_NAME = "ledger_table_enriched"
+# Ledgers sent to Postgres per INSERT ... SELECT statement
+LEDGER_UPSERT_BATCH_SIZE = int(os.getenv('LEDGER_UPSERT_BATCH_SIZE', '1000'))
+# Every (ancestor, descendant) pair of the group tree, including each group with itself
+# at depth 0, so rollups to any group level are a plain join
+GROUP_CLOSURE_TABLE_NAME = "group_closure"
+
+
+def ensure_group_closure_table(cursor):
+    """Create the group_closure table and its descendant index if they do not exist."""
+    cursor.execute(sql.SQL("""
+        CREATE TABLE IF NOT EXISTS {closure} (
+            ancestor TEXT NOT NULL,
+            descendant TEXT NOT NULL,
+            depth INTEGER NOT NULL,
+            PRIMARY KEY (ancestor, descendant)
+        );
+        CREATE INDEX IF NOT EXISTS {index} ON {closure} (descendant);
+    """).format(
+        closure=sql.Identifier(GROUP_CLOSURE_TABLE_NAME),
+        index=sql.Identifier(f"idx_{GROUP_CLOSURE_TABLE_NAME}_descendant")
+    ))
+
+
+def refresh_group_closure(cursor, group_table: str, logger: logging.Logger):
+    """
+    Bring group_closure in line with the parent_group links in group_table.
+    The closure is recomputed with a recursive CTE into a temporary table and only the
+    pairs that differ are deleted or inserted. Ledger amounts roll up to any group level
+    with a join on group_closure.descendant = ledger_table.parent_group.
+    """
+    identifiers = {
+        'group_table': sql.Identifier(group_table),
+        'closure': sql.Identifier(GROUP_CLOSURE_TABLE_NAME)
+    }
+    try:
+        cursor.execute(sql.SQL("""
+            CREATE TEMP TABLE new_group_closure AS
+            WITH RECURSIVE closure (ancestor, descendant, depth, path) AS (
+                SELECT name, name, 0, ARRAY[name]
+                FROM {group_table}
+                UNION ALL
+                SELECT parent.name, c.descendant, c.depth + 1, c.path || parent.name
+                FROM closure c
+                JOIN {group_table} child ON child.name = c.ancestor
+                JOIN {group_table} parent ON parent.name = child.parent_group
+                WHERE parent.name <> ALL (c.path)
+            )
+            SELECT ancestor, descendant, depth FROM closure
+        """).format(**identifiers))
+        cursor.execute(sql.SQL("""
+            DELETE FROM {closure} gc
+            WHERE NOT EXISTS (
+                SELECT 1 FROM new_group_closure n
+                WHERE n.ancestor = gc.ancestor AND n.descendant = gc.descendant AND n.depth = gc.depth
+            )
+        """).format(**identifiers))
+        deleted_count = cursor.rowcount
+        cursor.execute(sql.SQL("""
+            INSERT INTO {closure} (ancestor, descendant, depth)
+            SELECT n.ancestor, n.descendant, n.depth
+            FROM new_group_closure n
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {closure} gc
+                WHERE gc.ancestor = n.ancestor AND gc.descendant = n.descendant
+            )
+        """).format(**identifiers))
+        inserted_count = cursor.rowcount
+        cursor.execute("DROP TABLE new_group_closure")
+        logger.info(f"Refreshed {GROUP_CLOSURE_TABLE_NAME}: {inserted_count} pairs added, {deleted_count} removed")
+    except psycopg2.Error as e:
+        logger.error(f"Error refreshing group closure: {str(e)}")
+        raise
+
+
+def ensure_ledger_enriched_view(cursor, ledger_table: str, group_table: str):
+    """
+    Create the view that joins ledgers to their group details.
+    The columns are in ledger_table order, so readers of ledger_table can switch to it.
+    A plain view is used on purpose: a materialized view can only be refreshed by
+    recomputing the whole join, which is the O(ledgers) write this mode avoids.
+    """
+    cursor.execute(sql.SQL("""
+        CREATE INDEX IF NOT EXISTS {index} ON {ledger_table} (parent_group)
+    """).format(
+        index=sql.Identifier(f"idx_{ledger_table}_parent_group"),
+        ledger_table=sql.Identifier(ledger_table)
+    ))
+    cursor.execute(sql.SQL("""
+        CREATE OR REPLACE VIEW {view} AS
+        SELECT
+            l.ledger_id, l.ledger_name, l.parent_group, g.primary_group, g.group_name,
+            g.parent_group AS group_parent, g.is_revenue, g.is_deemed_positive,
+            g.affects_gross_profit, g.sort_position, l.created_at
+        FROM {ledger_table} l
+        LEFT JOIN {group_table} g ON g.name = l.parent_group
+    """).format(
+        view=sql.Identifier(LEDGER_ENRICHED_VIEW_NAME),
+        ledger_table=sql.Identifier(ledger_table),
+        group_table=sql.Identifier(group_table)
+    ))
+
+
+def build_ledger_upsert_query(ledger_table: str, group_table: str) -> sql.Composed:
+    """
+    Build the batched ledger upsert for execute_values, returning one
+    (ledger_name, inserted) row per ledger whose parent group exists in group_table.
+    In view mode only parent_group is stored, and inserted is NULL for a ledger
+    that was left unchanged.
+    """
+    if LEDGER_GROUP_MODE != 'view':
+        return sql.SQL("""
+        INSERT INTO {ledger_table} (
+            ledger_name, parent_group, primary_group, group_name, group_parent,
+            is_revenue, is_deemed_positive, affects_gross_profit, sort_position
+        )
+        SELECT
+            l.ledger_name, l.parent_group, g.primary_group, g.group_name, g.parent_group,
+            g.is_revenue, g.is_deemed_positive, g.affects_gross_profit, g.sort_position
+        FROM (VALUES %s) AS l (ledger_name, parent_group)
+        JOIN {group_table} g ON g.name = l.parent_group
+        ON CONFLICT (ledger_name)
+        DO UPDATE SET
+            parent_group = EXCLUDED.parent_group,
+            primary_group = EXCLUDED.primary_group,
+            group_name = EXCLUDED.group_name,
+            group_parent = EXCLUDED.group_parent,
+            is_revenue = EXCLUDED.is_revenue,
+            is_deemed_positive = EXCLUDED.is_deemed_positive,
+            affects_gross_profit = EXCLUDED.affects_gross_profit,
+            sort_position = EXCLUDED.sort_position,
+            created_at = CURRENT_TIMESTAMP
+        RETURNING ledger_name, (xmax = 0) AS inserted;
+        """).format(
+            ledger_table=sql.Identifier(ledger_table),
+            group_table=sql.Identifier(group_table)
+        )
+
+    return sql.SQL("""
+    WITH incoming AS (
+        SELECT l.ledger_name, l.parent_group
+        FROM (VALUES %s) AS l (ledger_name, parent_group)
+        JOIN {group_table} g ON g.name = l.parent_group
+    ), upserted AS (
+        INSERT INTO {ledger_table} (ledger_name, parent_group)
+        SELECT ledger_name, parent_group FROM incoming
+        ON CONFLICT (ledger_name)
+        DO UPDATE SET
+            parent_group = EXCLUDED.parent_group,
+            primary_group = NULL,
+            group_name = NULL,
+            group_parent = NULL,
+            is_revenue = NULL,
+            is_deemed_positive = NULL,
+            affects_gross_profit = NULL,
+            sort_position = NULL,
+            created_at = CURRENT_TIMESTAMP
+        WHERE {ledger_table}.parent_group IS DISTINCT FROM EXCLUDED.parent_group
+           OR {ledger_table}.primary_group IS NOT NULL
+        RETURNING ledger_name, (xmax = 0) AS inserted
+    )
+    SELECT i.ledger_name, u.inserted
+    FROM incoming i
+    LEFT JOIN upserted u ON u.ledger_name = i.ledger_name;
+    """).format(
+        ledger_table=sql.Identifier(ledger_table),
+        group_table=sql.Identifier(group_table)
+    )
+
+
+def upsert_ledgers(cursor, ledgers: List[Dict], ledger_table: str, group_table: str,
+                   logger: logging.Logger) -> Tuple[int, int, int, int]:
+    """
+    Insert or update parsed ledgers in batches of LEDGER_UPSERT_BATCH_SIZE, with one
+    INSERT ... SELECT per batch. Group details are joined from group_table in SQL, and a
+    ledger without a name or whose parent group is not there is skipped. See
+    LEDGER_GROUP_MODE for what is stored on each row. Returns the inserted, updated,
+    unchanged and skipped counts.
+    """
+    inserted_count = 0
+    updated_count = 0
+    unchanged_count = 0
+    skipped_count = 0
+
+    # One row per ledger name, since a batch may not update the same row twice
+    parent_groups = {}
+    for ledger in ledgers:
+        if not ledger['name']:
+            logger.warning(f"Skipping ledger with empty name: {ledger}")
+            skipped_count += 1
+            continue
+        parent_groups[ledger['name']] = ledger['parent_group']
+    rows = list(parent_groups.items())
+    upsert_query = build_ledger_upsert_query(ledger_table, group_table)
+
+    for start in range(0, len(rows), LEDGER_UPSERT_BATCH_SIZE):
+        batch = rows[start:start + LEDGER_UPSERT_BATCH_SIZE]
+        results = extras.execute_values(
+            cursor, upsert_query, batch, page_size=len(batch), fetch=True
+        )
+        saved_names = set()
+        for ledger_name, inserted in results:
+            saved_names.add(ledger_name)
+            if inserted is None:
+                unchanged_count += 1
+            elif inserted:
+                inserted_count += 1
+            else:
+                updated_count += 1
+
+        for ledger_name, parent_group in batch:
+            if ledger_name not in saved_names:
+                logger.warning(f"No matching group found for ledger {ledger_name} with parent {parent_group}")
+                skipped_count += 1
+
+    return inserted_count, updated_count, unchanged_count, skipped_count
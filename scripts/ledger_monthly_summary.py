@@ -0,0 +1,200 @@
+import logging
+import datetime
+from decimal import Decimal
+from typing import Iterable, List, Optional
+
+import pandas as pd
+from psycopg2.extras import execute_values
+
+SUMMARY_TABLE_NAME = "ledger_monthly_summary"
+# Months whose transactions changed since the summary was last refreshed, written in the
+# same transaction as the transactions they belong to
+PENDING_MONTHS_TABLE_NAME = "ledger_summary_pending_months"
+SUMMARY_COLUMNS = ['opening', 'debit', 'credit', 'closing']
+
+
+def month_label(month: datetime.date) -> str:
+    """Month key used by ledger_monthly_summary, e.g. '2023-04'."""
+    return month.strftime('%Y-%m')
+
+
+def financial_year(month: datetime.date) -> str:
+    """Indian financial year (April to March) a month falls in, e.g. '2023-24'."""
+    start_year = month.year if month.month >= 4 else month.year - 1
+    return f"{start_year}-{(start_year + 1) % 100:02d}"
+
+
+def _from_paise(value: int) -> Decimal:
+    return Decimal(int(value)).scaleb(-2)
+
+
+class LedgerMonthlySummary:
+    """
+    Maintains ledger_monthly_summary from transaction_details joined to transactions.date.
+    Balances are debit-positive: closing = opening + debit - credit. ledger_amount is stored
+    unsigned, so debit is the sum of ledger_amounts whose amount_status is 'Dr' and credit
+    the sum of those marked 'Cr'; entries with any other status are left out. The
+    first month a ledger appears in opens at zero, and every later month opens with the
+    previous month's closing, across financial years as well.
+    """
+
+    def __init__(self, db_cursor, transactions_table: str = "transactions", logger: logging.Logger = None):
+        self.db_cursor = db_cursor
+        self.transactions_table = transactions_table
+        self.logger = logger or logging.getLogger(__name__)
+
+    def ensure_tables(self, cursor):
+        """Create the summary and pending-month tables, and the index the month aggregation uses."""
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {SUMMARY_TABLE_NAME} (
+                id SERIAL PRIMARY KEY,
+                subscribe_id INTEGER,
+                ledger TEXT,
+                financial_year TEXT,
+                month TEXT,
+                opening NUMERIC,
+                debit NUMERIC,
+                credit NUMERIC,
+                closing NUMERIC,
+                UNIQUE (subscribe_id, ledger, financial_year, month)
+            )
+        """)
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {PENDING_MONTHS_TABLE_NAME} (
+                subscribe_id INTEGER NOT NULL,
+                month DATE NOT NULL,
+                PRIMARY KEY (subscribe_id, month)
+            )
+        """)
+        cursor.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_{self.transactions_table}_subscribe_id_date
+            ON {self.transactions_table} (subscribe_id, date)
+        """)
+
+    def refresh(self, subscribe_id, months: Optional[Iterable[datetime.date]] = None) -> int:
+        """
+        Recompute the summary rows of the given months (first days), or of the pending
+        months recorded by the sync when months is None, and carry the closing balances
+        forward through every later month. A subscriber without any summary rows yet is
+        built from all of its transactions. Returns the number of rows written or removed.
+        """
+        try:
+            with self.db_cursor() as cursor:
+                # One refresh per subscriber at a time, so two syncs cannot interleave their carry-forward
+                cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"{SUMMARY_TABLE_NAME}:{subscribe_id}",))
+                cursor.execute(f"SELECT month FROM {PENDING_MONTHS_TABLE_NAME} WHERE subscribe_id = %s", (subscribe_id,))
+                pending_months = [row[0] for row in cursor.fetchall()]
+                if months is None:
+                    months = pending_months
+                months = sorted({month.replace(day=1) for month in months})
+                cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {SUMMARY_TABLE_NAME} WHERE subscribe_id = %s)", (subscribe_id,))
+                if not cursor.fetchone()[0]:
+                    cursor.execute(f"""
+                        SELECT DISTINCT date_trunc('month', date)::date
+                        FROM {self.transactions_table}
+                        WHERE subscribe_id = %s AND date IS NOT NULL
+                    """, (subscribe_id,))
+                    months = sorted(row[0] for row in cursor.fetchall())
+                if not months:
+                    self.logger.info(f"No months to refresh in {SUMMARY_TABLE_NAME} for subscriber {subscribe_id}")
+                    return 0
+
+                changes = self._refresh_months(cursor, subscribe_id, months)
+                cursor.execute(f"""
+                    DELETE FROM {PENDING_MONTHS_TABLE_NAME}
+                    WHERE subscribe_id = %s AND month = ANY(%s::date[])
+                """, (subscribe_id, pending_months))
+            self.logger.info(f"Refreshed {SUMMARY_TABLE_NAME} for {len(months)} months from {month_label(months[0])}: {changes} rows changed")
+            return changes
+        except Exception as e:
+            self.logger.error(f"Error refreshing {SUMMARY_TABLE_NAME}: {str(e)}")
+            raise
+
+    def aggregate_months(self, cursor, subscribe_id, months: List[datetime.date]) -> pd.DataFrame:
+        """Debit and credit per ledger for the given months, in paise, summed in Postgres."""
+        cursor.execute(f"""
+            SELECT d.ledger_name AS ledger,
+                   m.month,
+                   (SUM(CASE WHEN d.amount_status = 'Dr' THEN d.ledger_amount ELSE 0 END) * 100)::bigint AS debit,
+                   (SUM(CASE WHEN d.amount_status = 'Cr' THEN d.ledger_amount ELSE 0 END) * 100)::bigint AS credit
+            FROM unnest(%s::date[]) AS m (month)
+            JOIN {self.transactions_table} t
+              ON t.subscribe_id = %s
+             AND t.date >= m.month AND t.date < m.month + INTERVAL '1 month'
+            JOIN transaction_details d ON d.GUID = t.GUID AND d.subscribe_id = t.subscribe_id
+            WHERE d.ledger_name IS NOT NULL AND d.ledger_amount IS NOT NULL
+              AND d.amount_status IN ('Dr', 'Cr')
+            GROUP BY d.ledger_name, m.month
+        """, (months, subscribe_id))
+        return pd.DataFrame(
+            [(ledger, month_label(month), debit, credit) for ledger, month, debit, credit in cursor.fetchall()],
+            columns=['ledger', 'month', 'debit', 'credit']
+        )
+
+    def _refresh_months(self, cursor, subscribe_id, months: List[datetime.date]) -> int:
+        first_month = month_label(months[0])
+        touched = {month_label(month) for month in months}
+        fresh = self.aggregate_months(cursor, subscribe_id, months)
+
+        # Summary rows from the first touched month on, which the carry-forward may change
+        cursor.execute(f"""
+            SELECT ledger, month, (opening * 100)::bigint, (debit * 100)::bigint,
+                   (credit * 100)::bigint, (closing * 100)::bigint
+            FROM {SUMMARY_TABLE_NAME}
+            WHERE subscribe_id = %s AND month >= %s
+        """, (subscribe_id, first_month))
+        existing = pd.DataFrame(cursor.fetchall(), columns=['ledger', 'month'] + SUMMARY_COLUMNS)
+        # Closing balance of each ledger just before the first touched month
+        cursor.execute(f"""
+            SELECT DISTINCT ON (ledger) ledger, (closing * 100)::bigint
+            FROM {SUMMARY_TABLE_NAME}
+            WHERE subscribe_id = %s AND month < %s
+            ORDER BY ledger, month DESC
+        """, (subscribe_id, first_month))
+        carried_in = pd.Series(dict(cursor.fetchall()), dtype='int64')
+
+        kept = existing.loc[~existing['month'].isin(touched), ['ledger', 'month', 'debit', 'credit']]
+        movements = pd.concat([kept, fresh], ignore_index=True)
+        movements[['debit', 'credit']] = movements[['debit', 'credit']].astype('int64')
+        movements = movements.sort_values(['ledger', 'month'], kind='stable', ignore_index=True)
+        net = movements['debit'] - movements['credit']
+        movements['closing'] = (
+            net.groupby(movements['ledger']).cumsum()
+            + movements['ledger'].map(carried_in).fillna(0).astype('int64')
+        )
+        movements['opening'] = movements['closing'] - net
+
+        merged = movements.merge(existing, on=['ledger', 'month'], how='outer', suffixes=('', '_old'), indicator=True)
+        removed = merged.loc[merged['_merge'] == 'right_only', ['ledger', 'month']]
+        current = merged.loc[merged['_merge'] != 'right_only']
+        changed = current.loc[
+            (current['_merge'] == 'left_only')
+            | (current[SUMMARY_COLUMNS].values != current[[f"{column}_old" for column in SUMMARY_COLUMNS]].values).any(axis=1)
+        ]
+
+        if len(removed):
+            execute_values(cursor, f"""
+                DELETE FROM {SUMMARY_TABLE_NAME} s
+                USING (VALUES %s) AS r (subscribe_id, ledger, month)
+                WHERE s.subscribe_id = r.subscribe_id AND s.ledger = r.ledger AND s.month = r.month
+            """, [(int(subscribe_id), ledger, month) for ledger, month in removed.itertuples(index=False, name=None)],
+                page_size=1000)
+        if len(changed):
+            rows = [
+                (int(subscribe_id), ledger, financial_year(datetime.date(int(month[:4]), int(month[5:]), 1)), month,
+                 _from_paise(opening), _from_paise(debit), _from_paise(credit), _from_paise(closing))
+                for ledger, month, opening, debit, credit, closing
+                in changed[['ledger', 'month'] + SUMMARY_COLUMNS].itertuples(index=False, name=None)
+            ]
+            execute_values(cursor, f"""
+                INSERT INTO {SUMMARY_TABLE_NAME}
+                    (subscribe_id, ledger, financial_year, month, opening, debit, credit, closing)
+                VALUES %s
+                ON CONFLICT (subscribe_id, ledger, financial_year, month)
+                DO UPDATE SET
+                    opening = EXCLUDED.opening,
+                    debit = EXCLUDED.debit,
+                    credit = EXCLUDED.credit,
+                    closing = EXCLUDED.closing
+            """, rows, page_size=1000)
+        return len(removed) + len(changed)
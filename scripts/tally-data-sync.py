@@ -13,6 +13,7 @@ import requests
 import time
 from contextlib import contextmanager
 import psycopg2.extras
+from db_utils import get_pool
 
 load_dotenv()
 
@@ -31,6 +32,7 @@ class TallyDataSync:
             'port': os.getenv('DB_PORT')
         }
             
+        self.pool = get_pool(self.db_params)
         self.tally_url = tally_url or os.getenv('TALLY_URL')
         self.setup_logging()
 
@@ -48,22 +50,17 @@ class TallyDataSync:
 
     @contextmanager
     def db_cursor(self):
-        """Context manager for database operations."""
-        conn = None
-        try:
-            self.logger.debug(f"Connecting to database with params: {self.db_params}")
-            conn = psycopg2.connect(**self.db_params)
-            cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            yield cursor
-            conn.commit()
-        except Exception as e:
-            if conn:
+        """Context manager for database operations on a pooled connection."""
+        self.logger.debug(f"Using pooled connection to database: {self.db_params['dbname']}")
+        with self.pool.connection() as conn:
+            try:
+                with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                    yield cursor
+                conn.commit()
+            except Exception as e:
                 conn.rollback()
-            self.logger.error(f"Database error: {e}")
-            raise
-        finally:
-            if conn:
-                conn.close()
+                self.logger.error(f"Database error: {e}")
+                raise
 
     def get_or_create_subscriber(self) -> int:
         try:
@@ -71,7 +68,7 @@ class TallyDataSync:
             company_id = self.session_data.get('userCompanyId')
             tally_company = self.session_data.get('tallyCompanyId')
 
-            with psycopg2.connect(**self.db_params) as conn:
+            with self.pool.connection() as conn:
                 cur = conn.cursor()
                 cur.execute("""
     INSERT INTO subscriber_db (user_id, company_id, tally_company)
@@ -95,7 +92,7 @@ class TallyDataSync:
             return
 
         try:
-            with psycopg2.connect(**self.db_params) as conn:
+            with self.pool.connection() as conn:
                 # Prepare the DataFrame for insertion
                 buffer = StringIO()
                 # Use a tab delimiter and a known null representation
@@ -414,6 +411,7 @@ def main():
 
         print("\nScript completed successfully.")
         sync.logger.info("Script completed successfully.")
+        sync.logger.info(f"Connection pool stats: {sync.pool.stats()}")
         
     except Exception as e:
         sync.logger.error(f"An unexpected error occurred: {e}")
@@ -800,16 +800,103 @@ import psycopg2
 import requests
 import xml.etree.ElementTree as ET
 import uuid
-from typing import Dict, List, Tuple, Generator
+from decimal import Decimal
+from typing import Dict, Iterator, List, Optional, Tuple, Generator
 from tqdm import tqdm
 from contextlib import contextmanager
 from psycopg2 import sql
 from psycopg2.extras import execute_values, DictCursor
 from dotenv import load_dotenv
 import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from db_utils import copy_rows, get_pool
+from ledger_monthly_summary import PENDING_MONTHS_TABLE_NAME, LedgerMonthlySummary
+from tally_parsing import ZERO_AMOUNT, parse_tally_amount, parse_tally_date
 
 load_dotenv()
 
+# Size of the pieces fed to the incremental XML parser
+XML_CHUNK_SIZE = 64 * 1024
+# Transaction numbers are reserved from this sequence in blocks, one nextval per block
+TRANSACTION_ID_SEQUENCE = "transactions_transaction_id_block_seq"
+TRANSACTION_ID_BLOCK_SIZE = 1000
+# Marks the end of a prefetched window in its chunk queue
+_WINDOW_END = object()
+
+
+class TallyWindowTooLarge(Exception):
+    """Raised when the Tally response for one date window exceeds TALLY_WINDOW_MAX_BYTES."""
+
+
+class TallyCheckpointMismatch(ValueError):
+    """Raised when a resumed window no longer matches the vouchers its checkpoint recorded."""
+
+
+class TallyResponseInterrupted(Exception):
+    """Raised when a streamed Tally response breaks off part way, e.g. on a read timeout."""
+
+
+class TransactionDetailsReconcileError(Exception):
+    """Raised when a batch of transaction_details could not be reconciled at all."""
+
+
+class TallyResponseParseError(Exception):
+    """Raised when a Tally voucher export is not well-formed XML."""
+
+
+# Errors on a multi-day window that mean it is too large for one request and should be bisected
+WINDOW_SPLIT_ERRORS = (requests.exceptions.Timeout, TallyResponseInterrupted, TallyWindowTooLarge)
+
+
+class TransactionChunk:
+    """
+    A chunk of transactions rows in columnar form: one list per per-voucher column,
+    with the columns that are the same for the whole sync (subscribe_id,
+    push_status, ...) stored once in constants.
+    """
+    # transaction_id is not among them: it is only assigned to rows that are actually
+    # inserted, by insert_transactions_into_postgres
+    VOUCHER_COLUMNS = ("GUID", "date", "document_type", "document_number",
+                       "narration", "party_name", "total_amount")
+    COLUMNS = ("transaction_id", "batch_id", "transaction_batch_id", "GUID", "subscribe_id", "file_status",
+               "original_filename", "masterkeyids", "date", "document_type", "document_number", "narration",
+               "party_name", "total_amount", "user_id", "filepath", "push_status", "pushed_at",
+               "created_by", "updated_by")
+
+    def __init__(self, constants: Dict):
+        self.constants = constants
+        self.columns: Dict[str, List] = {name: [] for name in self.VOUCHER_COLUMNS}
+        self._appenders = [self.columns[name].append for name in self.VOUCHER_COLUMNS]
+
+    def __len__(self):
+        return len(self.columns["GUID"])
+
+    def append(self, values: Tuple):
+        """Add one voucher, with values in VOUCHER_COLUMNS order."""
+        for append, value in zip(self._appenders, values):
+            append(value)
+
+    def column(self, name: str) -> List:
+        """Return one per-voucher column as a list, without copying it."""
+        return self.columns[name]
+
+    def iter_rows(self) -> Iterator[Tuple]:
+        """Yield per-voucher row tuples in VOUCHER_COLUMNS order."""
+        return zip(*(self.columns[name] for name in self.VOUCHER_COLUMNS))
+
+    def to_dicts(self) -> List[Dict]:
+        """Expand the chunk into one dict per row, in the transactions column order."""
+        template = {column: self.constants.get(column) for column in self.COLUMNS}
+        rows = []
+        for values in self.iter_rows():
+            row = template.copy()
+            row.update(zip(self.VOUCHER_COLUMNS, values))
+            rows.append(row)
+        return rows
+
 class TallyIntegration:
     def __init__(self, session_data: Dict[str, str]):
         self.session_data = session_data
@@ -820,12 +907,37 @@ class TallyIntegration:
             'host': os.getenv('DB_HOST'),
             'port': os.getenv('DB_PORT')
         }
+        self.pool = get_pool(self.db_params)
+        self.transaction_id_sequence_ready = False
+        # Transaction numbers reserved for this run and not handed out yet
+        self.transaction_id_next = 1
+        self.transaction_id_end = 0
+        # transaction_details outcomes, filled in alongside the transactions by sync_tally_data
+        self.details_success_count = 0
+        self.details_failure_count = 0
         self.tally_url = os.getenv('TALLY_URL')
+        # Stream Tally responses straight into the XML parser instead of buffering them
+        self.stream_tally_response = os.getenv('TALLY_STREAM_RESPONSE', 'true').lower() not in ('0', 'false', 'no')
+        # Windows fetched from Tally at the same time; Tally copes with very little parallelism
+        self.fetch_concurrency = max(1, int(os.getenv('TALLY_FETCH_CONCURRENCY', '2')))
+        # Response chunks a window may buffer ahead of the parser before its fetch waits
+        self.prefetch_max_chunks = max(1, int(os.getenv('TALLY_PREFETCH_MAX_CHUNKS', '256')))
+        # Adaptive window sizing: windows are planned to hold about this many vouchers / bytes
+        self.window_target_vouchers = int(os.getenv('TALLY_WINDOW_TARGET_VOUCHERS', '5000'))
+        self.window_target_bytes = int(os.getenv('TALLY_WINDOW_TARGET_BYTES', str(32 * 1024 * 1024)))
+        self.window_max_days = int(os.getenv('TALLY_WINDOW_MAX_DAYS', '366'))
+        # Responses above this size are abandoned and their window is bisected
+        self.window_max_bytes = int(os.getenv('TALLY_WINDOW_MAX_BYTES', str(128 * 1024 * 1024)))
+        # sync_mode=incremental only pulls vouchers altered since the stored AlterID watermark
+        self.sync_mode = session_data.get('sync_mode', 'full').lower()
+        # Highest voucher AlterID seen by parse_tally_vouchers during this run
+        self.max_alter_id_seen = None
 
         # Register UUID adapter for psycopg2
         import psycopg2.extensions
         psycopg2.extensions.register_adapter(uuid.UUID, lambda u: psycopg2.extensions.AsIs(f"'{u}'"))
         self.setup_logging()
+        self.monthly_summary = LedgerMonthlySummary(self.db_cursor, self.tally_data_config["table_name"], self.logger)
 
     def setup_logging(self):
         logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -840,37 +952,64 @@ class TallyIntegration:
 
     @contextmanager
     def db_cursor(self):
-        """Context manager for database operations."""
-        conn = None
-        try:
-            conn = psycopg2.connect(**self.db_params)
-            cursor = conn.cursor(cursor_factory=DictCursor)
-            yield cursor
-            conn.commit()
-        except Exception as e:
-            if conn:
+        """Context manager for database operations on a pooled connection."""
+        with self.pool.connection() as conn:
+            try:
+                with conn.cursor(cursor_factory=DictCursor) as cursor:
+                    yield cursor
+                conn.commit()
+            except Exception as e:
                 conn.rollback()
-            self.logger.error(f"Database error: {e}")
-            raise
-        finally:
-            if conn:
-                conn.close()
+                self.logger.error(f"Database error: {e}")
+                raise
 
-    def get_next_transaction_id(self) -> str:
-        """Get the next transaction ID (TRN00001, TRN00002, etc.)"""
-        try:
-            with self.db_cursor() as cursor:
-                cursor.execute("SELECT transaction_id FROM transactions ORDER BY transaction_id DESC LIMIT 1")
-                result = cursor.fetchone()
-                if result is None or not result[0]:
-                    return "TRN00001"
-                last_id = result[0]
-                numeric_part = int(last_id[3:])
-                next_numeric = numeric_part + 1
-                return f"TRN{next_numeric:05d}"
-        except Exception as e:
-            self.logger.error(f"Error getting next transaction ID: {str(e)}")
-            return "TRN00001"
+    def ensure_transaction_id_sequence(self):
+        """
+        Create the transaction ID block sequence on first use, starting it after the
+        highest numeric TRN id already in transactions. The advisory lock keeps two
+        syncs from seeding it at the same time.
+        """
+        if self.transaction_id_sequence_ready:
+            return
+        with self.db_cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (TRANSACTION_ID_SEQUENCE,))
+            cursor.execute("SELECT to_regclass(%s)", (TRANSACTION_ID_SEQUENCE,))
+            if cursor.fetchone()[0] is None:
+                cursor.execute(f"""
+                    CREATE SEQUENCE {TRANSACTION_ID_SEQUENCE}
+                    INCREMENT BY {TRANSACTION_ID_BLOCK_SIZE} MINVALUE 0 START WITH 0
+                """)
+                cursor.execute("""
+                    SELECT COALESCE(MAX(CAST(SUBSTRING(transaction_id FROM 4) AS BIGINT)), 0)
+                    FROM transactions
+                    WHERE transaction_id ~ '^TRN[0-9]+$'
+                """)
+                last_numeric = cursor.fetchone()[0]
+                cursor.execute("SELECT setval(%s, %s, true)", (TRANSACTION_ID_SEQUENCE, last_numeric))
+                self.logger.info(f"Created {TRANSACTION_ID_SEQUENCE} after TRN{last_numeric:05d}")
+        self.transaction_id_sequence_ready = True
+
+    def allocate_transaction_id_block(self, cursor) -> Tuple[int, int]:
+        """Reserve TRANSACTION_ID_BLOCK_SIZE consecutive transaction numbers. Returns (first, last)."""
+        self.ensure_transaction_id_sequence()
+        cursor.execute("SELECT nextval(%s)", (TRANSACTION_ID_SEQUENCE,))
+        block_end = cursor.fetchone()[0]
+        return block_end - TRANSACTION_ID_BLOCK_SIZE + 1, block_end
+
+    def take_transaction_ids(self, cursor, count: int) -> List[str]:
+        """
+        Hand out count transaction IDs from the numbers reserved for this run, reserving
+        another block only when they run out, so at most one partly used block is left
+        behind per run however many windows it syncs.
+        """
+        transaction_ids = []
+        while len(transaction_ids) < count:
+            if self.transaction_id_next > self.transaction_id_end:
+                self.transaction_id_next, self.transaction_id_end = self.allocate_transaction_id_block(cursor)
+            take = min(count - len(transaction_ids), self.transaction_id_end - self.transaction_id_next + 1)
+            transaction_ids.extend(f"TRN{number:05d}" for number in range(self.transaction_id_next, self.transaction_id_next + take))
+            self.transaction_id_next += take
+        return transaction_ids
 
     def convert_guid(self, guid_text: str) -> uuid.UUID:
         """
@@ -886,9 +1025,15 @@ class TallyIntegration:
             self.logger.info(f"Converted non-standard GUID using uuid5 to: {new_uuid}")
             return new_uuid
 
-    def construct_tally_data_payload(self, from_date, to_date, company):
-        """Constructs XML payload for Tally request with GUID."""
+    def construct_tally_data_payload(self, from_date, to_date, company, min_alter_id=None):
+        """
+        Constructs XML payload for Tally request with GUID.
+        When min_alter_id is given, only vouchers with an AlterID above it are exported.
+        """
         company = company.strip().strip('"').strip("'") if company else ""
+        voucher_filters = "Fltr01,Fltr02" if min_alter_id is None else "Fltr01,Fltr02,Fltr03"
+        alter_id_filter = "" if min_alter_id is None else f"""
+                    <SYSTEM TYPE="Formulae" NAME="Fltr03">$AlterID > {int(min_alter_id)}</SYSTEM>"""
         payload_xml = f"""<?xml version="1.0" encoding="utf-8"?>
 <ENVELOPE>
     <HEADER>
@@ -931,7 +1076,7 @@ class TallyIntegration:
                         <SCROLLED>Vertical</SCROLLED>
                     </PART>
                     <LINE NAME="MyLine01">
-                        <FIELDS>FldGUID,FldDate,FldVoucherType,FldVoucherNumber,FldPartyName,FldVoucherCategory,FldNarration</FIELDS>
+                        <FIELDS>FldGUID,FldDate,FldVoucherType,FldVoucherNumber,FldPartyName,FldVoucherCategory,FldNarration,FldAlterID</FIELDS>
                         <EXPLODE>MyPart02</EXPLODE>
                         <XMLTAG>VOUCHER</XMLTAG>
                     </LINE>
@@ -969,6 +1114,10 @@ class TallyIntegration:
                         <SET>if $$IsEmpty:$Narration then $$StrByCharCode:245 else $Narration</SET>
                         <XMLTAG>Narration</XMLTAG>
                     </FIELD>
+                    <FIELD NAME="FldAlterID">
+                        <SET>$AlterID</SET>
+                        <XMLTAG>ALTERID</XMLTAG>
+                    </FIELD>
                     <FIELD NAME="FldLedgerName">
                         <SET>$LedgerName</SET>
                         <XMLTAG>LEDGER</XMLTAG>
@@ -998,10 +1147,10 @@ class TallyIntegration:
                         <FETCH>Reference</FETCH>
                         <FETCH>AlterID</FETCH>
                         <FETCH>MasterID</FETCH>
-                        <FILTER>Fltr01,Fltr02</FILTER>
+                        <FILTER>{voucher_filters}</FILTER>
                     </COLLECTION>
                     <SYSTEM TYPE="Formulae" NAME="Fltr01">NOT $IsCancelled</SYSTEM>
-                    <SYSTEM TYPE="Formulae" NAME="Fltr02">NOT $IsOptional</SYSTEM>
+                    <SYSTEM TYPE="Formulae" NAME="Fltr02">NOT $IsOptional</SYSTEM>{alter_id_filter}
                 </TDLMESSAGE>
             </TDL>
         </DESC>
@@ -1012,8 +1161,55 @@ class TallyIntegration:
         self.logger.info(f"Payload XML: {payload_xml[:200]}...")
         return payload_xml
 
-    def fetch_tally_data(self, payload):
-        """Fetch data from Tally server."""
+    def construct_company_alter_id_payload(self, company):
+        """Constructs XML payload that exports the company's last voucher AlterID (AltVchID)."""
+        company = company.strip().strip('"').strip("'") if company else ""
+        return f"""<?xml version="1.0" encoding="utf-8"?>
+<ENVELOPE>
+    <HEADER>
+        <VERSION>1</VERSION>
+        <TALLYREQUEST>Export</TALLYREQUEST>
+        <TYPE>Collection</TYPE>
+        <ID>MyCompanyAlterIDs</ID>
+    </HEADER>
+    <BODY>
+        <DESC>
+            <STATICVARIABLES>
+                <SVEXPORTFORMAT>XML (Data Interchange)</SVEXPORTFORMAT>
+                {"<SVCURRENTCOMPANY>" + company + "</SVCURRENTCOMPANY>" if company else ""}
+            </STATICVARIABLES>
+            <TDL>
+                <TDLMESSAGE>
+                    <COLLECTION NAME="MyCompanyAlterIDs">
+                        <TYPE>Company</TYPE>
+                        <NATIVEMETHOD>Name</NATIVEMETHOD>
+                        <NATIVEMETHOD>AltVchID</NATIVEMETHOD>
+                        <FILTER>FltrCurrentCompany</FILTER>
+                    </COLLECTION>
+                    <SYSTEM TYPE="Formulae" NAME="FltrCurrentCompany">$Name = ##SVCurrentCompany</SYSTEM>
+                </TDLMESSAGE>
+            </TDL>
+        </DESC>
+    </BODY>
+</ENVELOPE>
+"""
+
+    def get_company_alter_id(self):
+        """Return the company's current last voucher AlterID, or None if Tally could not report it."""
+        try:
+            payload = self.construct_company_alter_id_payload(self.tally_data_config["company_name"])
+            root = ET.fromstring(self.fetch_tally_data(payload))
+            alter_id_text = root.findtext(".//ALTVCHID")
+            if alter_id_text is None or not alter_id_text.strip():
+                self.logger.warning("Tally response did not include the company AltVchID")
+                return None
+            return int(alter_id_text.strip())
+        except Exception as e:
+            self.logger.warning(f"Could not read company AltVchID from Tally: {e}")
+            return None
+
+    def fetch_tally_data(self, payload, retry_timeouts: bool = True):
+        """Fetch data from Tally server. With retry_timeouts=False a timeout is raised straight away."""
         max_retries = 3
         retry_delay = 5  # seconds
         for attempt in range(max_retries):
@@ -1027,7 +1223,7 @@ class TallyIntegration:
                 return response.text
             except requests.exceptions.Timeout:
                 self.logger.warning(f"Timeout while connecting to Tally server (Attempt {attempt + 1}/{max_retries})")
-                if attempt < max_retries - 1:
+                if retry_timeouts and attempt < max_retries - 1:
                     time.sleep(retry_delay)
                 else:
                     raise
@@ -1044,181 +1240,549 @@ class TallyIntegration:
                 self.logger.error(f"Unexpected error while fetching Tally data: {str(e)}")
                 raise
 
-    def parse_tally_data_xml(self, xml_data, subscribe_id) -> Generator[List[Dict], None, None]:
-        """Parse Tally XML response for transactions table."""
+    def fetch_tally_data_stream(self, payload, retry_timeouts: bool = True) -> Generator[bytes, None, None]:
+        """
+        Fetch data from Tally server as a stream of raw byte chunks.
+        Chunks are yielded as they arrive so parsing and inserts can start before
+        the export has finished downloading, and the body is never held as one str.
+        With retry_timeouts=False a timeout is raised straight away.
+        """
+        max_retries = 3
+        retry_delay = 5  # seconds
+        response = None
+        for attempt in range(max_retries):
+            try:
+                self.logger.info(f"Sending streaming request to Tally server: {self.tally_url}")
+                response = requests.post(self.tally_url, data=payload, timeout=60, stream=True)
+                self.logger.info(f"Received response from Tally. Status code: {response.status_code}")
+                response.raise_for_status()
+                break
+            except requests.exceptions.Timeout:
+                self.logger.warning(f"Timeout while connecting to Tally server (Attempt {attempt + 1}/{max_retries})")
+                if retry_timeouts and attempt < max_retries - 1:
+                    time.sleep(retry_delay)
+                else:
+                    raise
+            except requests.exceptions.ConnectionError:
+                self.logger.warning(f"Could not connect to Tally server at {self.tally_url} (Attempt {attempt + 1}/{max_retries})")
+                if attempt < max_retries - 1:
+                    time.sleep(retry_delay)
+                else:
+                    raise
+            except requests.exceptions.RequestException as e:
+                self.logger.error(f"Error fetching data from Tally: {str(e)}")
+                raise
+
+        with response:
+            received_bytes = 0
+            try:
+                for chunk in response.iter_content(chunk_size=XML_CHUNK_SIZE):
+                    if chunk:
+                        received_bytes += len(chunk)
+                        yield chunk
+            except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError) as e:
+                # A read timeout in the middle of the body surfaces as one of these, not as Timeout
+                raise TallyResponseInterrupted(f"Tally response broke off after {received_bytes} bytes: {e}") from e
+            if not received_bytes:
+                raise ValueError("Received empty response from Tally server")
+            self.logger.info(f"Finished streaming {received_bytes} bytes from Tally")
+
+    def get_tally_xml_source(self, payload, retry_timeouts: bool = True):
+        """Return the Tally response for payload, streamed unless TALLY_STREAM_RESPONSE is disabled."""
+        if self.stream_tally_response:
+            return self.fetch_tally_data_stream(payload, retry_timeouts)
+        return self.fetch_tally_data(payload, retry_timeouts)
+
+    def put_window_chunk(self, chunk_queue: queue.Queue, item, cancel_event: threading.Event) -> bool:
+        """Put item on chunk_queue, waiting for room. Returns False if the window was cancelled first."""
+        while not cancel_event.is_set():
+            try:
+                chunk_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def prefetch_tally_window(self, payload, chunk_queue: queue.Queue, cancel_event: threading.Event, splittable: bool = False):
+        """
+        Fetch worker: stream the Tally response for payload into chunk_queue.
+        The queue ends with _WINDOW_END, or with the exception that stopped the fetch.
+        For splittable windows timeouts are not retried and responses above
+        window_max_bytes raise TallyWindowTooLarge, so the window can be bisected.
+        """
+        chunks = None
         try:
-            root = ET.fromstring(xml_data)
-            self.logger.info(f"XML Response (first 500 chars): {xml_data[:500]}...")
-        except ET.ParseError as e:
-            self.logger.error(f"transactions: Error parsing XML: {e}")
-            sys.exit(1)
+            xml_source = self.get_tally_xml_source(payload, retry_timeouts=not splittable)
+            chunks = [xml_source] if isinstance(xml_source, (str, bytes)) else xml_source
+            received_bytes = 0
+            for chunk in chunks:
+                received_bytes += len(chunk)
+                if splittable and received_bytes > self.window_max_bytes:
+                    raise TallyWindowTooLarge(f"response exceeded {self.window_max_bytes} bytes")
+                if not self.put_window_chunk(chunk_queue, chunk, cancel_event):
+                    self.logger.info("Window fetch cancelled")
+                    return
+            self.put_window_chunk(chunk_queue, _WINDOW_END, cancel_event)
+        except Exception as e:
+            self.put_window_chunk(chunk_queue, e, cancel_event)
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
 
-        next_transaction_id = self.get_next_transaction_id()
-        transaction_counter = int(next_transaction_id[3:])
-        
+    def iter_prefetched_window(self, chunk_queue: queue.Queue):
+        """Yield the chunks a fetch worker puts on chunk_queue, re-raising its error if it failed."""
+        while True:
+            item = chunk_queue.get()
+            if item is _WINDOW_END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def iter_xml_chunks(self, xml_source, chunk_size: int = XML_CHUNK_SIZE):
+        """Yield pieces of an XML document given as str/bytes or as an iterable of chunks."""
+        if isinstance(xml_source, (str, bytes)):
+            for start in range(0, len(xml_source), chunk_size):
+                yield xml_source[start:start + chunk_size]
+        else:
+            yield from xml_source
+
+    def iter_voucher_elements(self, xml_source) -> Generator[ET.Element, None, None]:
+        """
+        Incrementally parse Tally XML and yield each VOUCHER element as soon as it closes.
+        The element is cleared and detached from its parent once the caller moves on,
+        so memory is bounded by a single voucher rather than the whole export.
+        """
+        parser = ET.XMLPullParser(events=("start", "end"))
+        open_elements = []
+
+        def read_vouchers():
+            for event, elem in parser.read_events():
+                if event == "start":
+                    open_elements.append(elem)
+                    continue
+                open_elements.pop()
+                if elem.tag == "VOUCHER":
+                    yield elem
+                    elem.clear()
+                    if open_elements:
+                        open_elements[-1].remove(elem)
+
+        preview_logged = False
+        for chunk in self.iter_xml_chunks(xml_source):
+            if not preview_logged:
+                self.logger.info(f"XML Response (first 500 chars): {chunk[:500]}...")
+                preview_logged = True
+            parser.feed(chunk)
+            yield from read_vouchers()
+        parser.close()
+        yield from read_vouchers()
+
+    def parse_tally_data_xml(self, xml_data, subscribe_id) -> Generator[List[Dict], None, None]:
+        """
+        Parse Tally XML response for transactions table.
+        xml_data may be the full response or an iterable of response chunks; vouchers
+        are parsed incrementally and yielded in chunks of 1000 rows.
+        """
+        for chunk, _, _ in self.parse_tally_vouchers(xml_data, subscribe_id):
+            if chunk:
+                yield chunk.to_dicts()
+
+    def parse_tally_vouchers(self, xml_data, subscribe_id, skip_vouchers: int = 0, skip_until_guid: str = None) -> Generator[Tuple[TransactionChunk, List[Tuple[str, List[Dict]]], Tuple[int, str]], None, None]:
+        """
+        Parse Tally XML response once for both the transactions and transaction_details tables.
+        Yields (TransactionChunk, ledger_batch, progress) chunks, where ledger_batch holds
+        (guid_str, ledger_entries) pairs ready for reconcile_transaction_details and
+        progress is (vouchers read so far, GUID text of the last voucher read).
+        The first skip_vouchers vouchers are passed over when resuming a window; the
+        last of them must have GUID skip_until_guid, otherwise TallyCheckpointMismatch is raised.
+        A response that is not well-formed XML raises TallyResponseParseError.
+        """
         processed_vouchers = {}  # To track unique vouchers by their number
-        data = []
-        
-        vouchers = root.findall(".//VOUCHER")
-        self.logger.info(f"Total vouchers found in XML: {len(vouchers)}")
-        for voucher in vouchers:
-            guid_text = voucher.findtext("GUID")
-            date_text = voucher.findtext("DATE")
-            voucher_type = voucher.findtext("VOUCHERTYPE") or ""
-            voucher_number = voucher.findtext("VOUCHERNUMBER") or ""
-            party_name = voucher.findtext("PARTYNAME") or ""
-            narration = voucher.findtext("Narration") or ""
+        constants = {
+            "batch_id": None,
+            "transaction_batch_id": None,
+            "subscribe_id": subscribe_id,
+            "file_status": None,
+            "original_filename": None,
+            "masterkeyids": None,
+            "user_id": self.session_data.get('userId', None),
+            "filepath": None,
+            "push_status": 0,
+            "pushed_at": None,
+            "created_by": self.session_data.get('userId', None),
+            "updated_by": self.session_data.get('userId', None)
+        }
+        data = TransactionChunk(constants)
+        ledger_batch = []
+        total_vouchers = 0
+        guid_text = None
+
+        vouchers = self.iter_voucher_elements(xml_data)
+        try:
+            for voucher in vouchers:
+                total_vouchers += 1
+                guid_text = voucher.findtext("GUID")
+                alter_id_text = voucher.findtext("ALTERID")
+                if alter_id_text and alter_id_text.strip().isdigit():
+                    alter_id = int(alter_id_text.strip())
+                    if self.max_alter_id_seen is None or alter_id > self.max_alter_id_seen:
+                        self.max_alter_id_seen = alter_id
+                if total_vouchers <= skip_vouchers:
+                    if total_vouchers == skip_vouchers and (guid_text or "").strip() != (skip_until_guid or ""):
+                        raise TallyCheckpointMismatch(f"Checkpoint mismatch: voucher {skip_vouchers} has GUID {guid_text}, expected {skip_until_guid}")
+                    continue
+                date_text = voucher.findtext("DATE")
+                voucher_type = voucher.findtext("VOUCHERTYPE") or ""
+                voucher_number = voucher.findtext("VOUCHERNUMBER") or ""
+                party_name = voucher.findtext("PARTYNAME") or ""
+                narration = voucher.findtext("Narration") or ""
+                allocations = self.parse_voucher_allocations(voucher)
             
-            self.logger.info(f"Processing Voucher - Type: {voucher_type}, Number: {voucher_number}, GUID: {guid_text}")
-            self.logger.info(f"GUID from XML: {guid_text}, Narration: {narration}")
+                self.logger.info(f"Processing Voucher - Type: {voucher_type}, Number: {voucher_number}, GUID: {guid_text}")
+                self.logger.info(f"GUID from XML: {guid_text}, Narration: {narration}")
             
-            # Use our helper to convert GUID
-            if guid_text:
-                guid_text = guid_text.strip()
-                self.logger.info(f"Attempting to convert GUID: {guid_text}")
-                guid_uuid = self.convert_guid(guid_text)
-            else:
-                guid_uuid = uuid.uuid4()
-                self.logger.info(f"No GUID found, generated: {guid_uuid}")
+                # Use our helper to convert GUID
+                if guid_text:
+                    guid_text = guid_text.strip()
+                    self.logger.info(f"Attempting to convert GUID: {guid_text}")
+                    guid_uuid = self.convert_guid(guid_text)
+                    ledger_entries = self.parse_ledger_entries_from_voucher(voucher, guid_uuid, subscribe_id, allocations)
+                    if ledger_entries:
+                        ledger_batch.append((str(guid_uuid), ledger_entries))
+                    else:
+                        self.logger.warning(f"No ledger entries found for voucher with GUID {guid_uuid}")
+                else:
+                    guid_uuid = uuid.uuid4()
+                    self.logger.info(f"No GUID found, generated: {guid_uuid}")
             
-            try:
-                date_obj = datetime.datetime.strptime(date_text.strip(), '%d-%b-%y').date()
-            except (ValueError, AttributeError):
-                self.logger.warning(f"Invalid date format: {date_text}")
-                continue
-
-            voucher_key = f"{date_obj}_{voucher_type}_{voucher_number}"
-            if voucher_key in processed_vouchers:
-                continue
-                
-            total_amount = 0.0
-            allocations = voucher.findall(".//ACCOUNTING_ALLOCATION")
-            for allocation in allocations:
-                amount_text = allocation.findtext("AMOUNT") or "0"
-                amount_text = amount_text.replace("(-)", "-")
                 try:
-                    amount = float(amount_text)
-                    total_amount += abs(amount)
+                    date_obj = parse_tally_date(date_text)
                 except ValueError:
-                    pass
-            
-            transaction_id = f"TRN{transaction_counter:05d}"
-            transaction_counter += 1
-            
-            row = {
-                "transaction_id": transaction_id,
-                "batch_id": None,
-                "transaction_batch_id": None,
-                "GUID": guid_uuid,
-                "subscribe_id": subscribe_id,
-                "file_status": None,
-                "original_filename": None,
-                "masterkeyids": None,
-                "date": date_obj,
-                "document_type": voucher_type,
-                "document_number": voucher_number,
-                "narration": narration,
-                "party_name": party_name,
-                "total_amount": total_amount,
-                "user_id": self.session_data.get('userId', None),
-                "filepath": None,
-                "push_status": 0,
-                "pushed_at": None,
-                "created_by": self.session_data.get('userId', None),
-                "updated_by": self.session_data.get('userId', None)
-            }
+                    self.logger.warning(f"Invalid date format: {date_text}")
+                    continue
+
+                voucher_key = f"{date_obj}_{voucher_type}_{voucher_number}"
+                if voucher_key in processed_vouchers:
+                    continue
+                
+                total_amount = sum((abs(amount) for _, amount, _ in allocations if amount is not None), ZERO_AMOUNT)
             
-            data.append(row)
-            processed_vouchers[voucher_key] = True
+                # Same order as TransactionChunk.VOUCHER_COLUMNS
+                data.append((guid_uuid, date_obj, voucher_type, voucher_number,
+                             narration, party_name, total_amount))
+                processed_vouchers[voucher_key] = True
             
-            if len(data) >= 1000:
-                yield data
-                data = []
-        if data:
-            yield data
+                if len(data) >= 1000 or len(ledger_batch) >= 1000:
+                    yield data, ledger_batch, (total_vouchers, (guid_text or "").strip())
+                    data = TransactionChunk(constants)
+                    ledger_batch = []
+        except ET.ParseError as e:
+            # Fails only the window being parsed; sync_data_by_year records it as failed
+            self.logger.error(f"transactions: Error parsing XML: {e}")
+            raise TallyResponseParseError(f"Malformed XML in Tally response: {e}") from e
+        if total_vouchers < skip_vouchers:
+            raise TallyCheckpointMismatch(f"Checkpoint mismatch: response has {total_vouchers} vouchers, {skip_vouchers} were already committed")
+        if data or ledger_batch:
+            yield data, ledger_batch, (total_vouchers, (guid_text or "").strip())
+        self.logger.info(f"Total vouchers found in XML: {total_vouchers}")
         self.logger.info(f"transactions: Parsed all records.")
 
-    def insert_transactions_into_postgres(self, data: List[Dict], table_name: str):
-        """Insert data into transactions table."""
+    def ensure_sync_indexes(self):
+        """Create the indexes and bookkeeping tables the sync relies on, if they are missing."""
+        with self.db_cursor() as cursor:
+            cursor.execute(f"""
+                CREATE INDEX IF NOT EXISTS idx_{self.tally_data_config["table_name"]}_document_number
+                ON {self.tally_data_config["table_name"]} (document_number)
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS sync_watermarks (
+                    subscribe_id TEXT PRIMARY KEY,
+                    last_alter_id BIGINT NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS tally_window_density (
+                    subscribe_id TEXT NOT NULL,
+                    period DATE NOT NULL,
+                    voucher_count INTEGER NOT NULL,
+                    covered_days INTEGER NOT NULL,
+                    byte_count BIGINT NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (subscribe_id, period)
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS tally_sync_checkpoints (
+                    subscribe_id TEXT NOT NULL,
+                    run_key TEXT NOT NULL,
+                    window_start DATE NOT NULL,
+                    window_end DATE NOT NULL,
+                    status TEXT NOT NULL,
+                    vouchers_committed INTEGER NOT NULL DEFAULT 0,
+                    last_guid TEXT,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (subscribe_id, run_key, window_start, window_end)
+                )
+            """)
+            self.monthly_summary.ensure_tables(cursor)
+
+    def load_sync_checkpoints(self, subscribe_id: str, run_key: str) -> Dict[Tuple[datetime.date, datetime.date], Dict]:
+        """Return the checkpoints left by an unfinished run with the same run_key, keyed by window."""
+        with self.db_cursor() as cursor:
+            cursor.execute("""
+                SELECT window_start, window_end, status, vouchers_committed, last_guid
+                FROM tally_sync_checkpoints
+                WHERE subscribe_id = %s AND run_key = %s
+            """, (str(subscribe_id), run_key))
+            return {(row['window_start'], row['window_end']): dict(row) for row in cursor.fetchall()}
+
+    def save_sync_checkpoint(self, subscribe_id: str, run_key: str, window_start: datetime.date, window_end: datetime.date,
+                             status: str, vouchers_committed: int, last_guid: str = None):
+        """Record how far a window got: status is 'in_progress' or 'completed'."""
+        with self.db_cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO tally_sync_checkpoints
+                    (subscribe_id, run_key, window_start, window_end, status, vouchers_committed, last_guid, updated_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+                ON CONFLICT (subscribe_id, run_key, window_start, window_end) DO UPDATE
+                SET status = EXCLUDED.status,
+                    vouchers_committed = EXCLUDED.vouchers_committed,
+                    last_guid = EXCLUDED.last_guid,
+                    updated_at = EXCLUDED.updated_at
+            """, (str(subscribe_id), run_key, window_start, window_end, status, vouchers_committed, last_guid))
+
+    def delete_sync_checkpoints(self, subscribe_id: str, window: Tuple[datetime.date, datetime.date] = None):
+        """Delete the checkpoints of one window, or every checkpoint of subscribe_id."""
+        with self.db_cursor() as cursor:
+            if window is None:
+                cursor.execute("DELETE FROM tally_sync_checkpoints WHERE subscribe_id = %s", (str(subscribe_id),))
+            else:
+                cursor.execute("""
+                    DELETE FROM tally_sync_checkpoints
+                    WHERE subscribe_id = %s AND window_start = %s AND window_end = %s
+                """, (str(subscribe_id), window[0], window[1]))
+
+    def get_alter_id_watermark(self, subscribe_id: str):
+        """Return the highest voucher AlterID already synced for subscribe_id, or None."""
+        with self.db_cursor() as cursor:
+            cursor.execute("SELECT last_alter_id FROM sync_watermarks WHERE subscribe_id = %s", (str(subscribe_id),))
+            result = cursor.fetchone()
+            return result[0] if result else None
+
+    def save_alter_id_watermark(self, subscribe_id: str, alter_id: int):
+        """Store alter_id as the AlterID watermark for subscribe_id."""
+        with self.db_cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO sync_watermarks (subscribe_id, last_alter_id, updated_at)
+                VALUES (%s, %s, CURRENT_TIMESTAMP)
+                ON CONFLICT (subscribe_id) DO UPDATE
+                SET last_alter_id = EXCLUDED.last_alter_id, updated_at = EXCLUDED.updated_at
+            """, (str(subscribe_id), alter_id))
+        self.logger.info(f"AlterID watermark for subscribe_id {subscribe_id} set to {alter_id}")
+
+    def load_window_densities(self, subscribe_id: str) -> Dict[datetime.date, Tuple[float, float]]:
+        """Return learned (vouchers per day, bytes per day) for each month synced before, keyed by month start."""
+        with self.db_cursor() as cursor:
+            cursor.execute("""
+                SELECT period, voucher_count, byte_count, covered_days
+                FROM tally_window_density
+                WHERE subscribe_id = %s AND covered_days > 0
+            """, (str(subscribe_id),))
+            return {
+                row['period']: (row['voucher_count'] / row['covered_days'], row['byte_count'] / row['covered_days'])
+                for row in cursor.fetchall()
+            }
+
+    def record_window_density(self, subscribe_id: str, start_date: datetime.date, end_date: datetime.date,
+                              month_counts: Dict[datetime.date, int], byte_count: int):
+        """
+        Store how many vouchers and bytes each month of a synced window produced.
+        Bytes are shared out by voucher count, or by days for a window with no vouchers.
+        """
+        total_vouchers = sum(month_counts.values())
+        window_days = (end_date - start_date).days + 1
+        rows = []
+        month_start = start_date.replace(day=1)
+        while month_start <= end_date:
+            next_month = (month_start + datetime.timedelta(days=32)).replace(day=1)
+            covered_days = (min(end_date, next_month - datetime.timedelta(days=1)) - max(start_date, month_start)).days + 1
+            voucher_count = month_counts.get(month_start, 0)
+            share = voucher_count / total_vouchers if total_vouchers else covered_days / window_days
+            rows.append((str(subscribe_id), month_start, voucher_count, covered_days, int(byte_count * share)))
+            month_start = next_month
+        with self.db_cursor() as cursor:
+            execute_values(cursor, """
+                INSERT INTO tally_window_density (subscribe_id, period, voucher_count, covered_days, byte_count)
+                VALUES %s
+                ON CONFLICT (subscribe_id, period) DO UPDATE
+                SET voucher_count = EXCLUDED.voucher_count,
+                    covered_days = EXCLUDED.covered_days,
+                    byte_count = EXCLUDED.byte_count,
+                    updated_at = CURRENT_TIMESTAMP
+            """, rows)
+
+    def resolve_min_alter_id(self, subscribe_id: str):
+        """
+        Decide the AlterID filter for this run. Returns None for a full sync, which is
+        used outside incremental mode, on the first run, and when the company's AltVchID
+        has gone below the stored watermark (restored or re-created company data).
+        """
+        if self.sync_mode != 'incremental':
+            return None
+        watermark = self.get_alter_id_watermark(subscribe_id)
+        if watermark is None:
+            self.logger.info("No AlterID watermark stored yet, running a full sync")
+            return None
+        company_alter_id = self.get_company_alter_id()
+        if company_alter_id is not None and company_alter_id < watermark:
+            self.logger.warning(f"Company AltVchID {company_alter_id} is below the watermark {watermark}, running a full resync")
+            return None
+        self.logger.info(f"Incremental sync of vouchers with AlterID > {watermark} (company AltVchID: {company_alter_id})")
+        return watermark
+
+    def insert_transactions_into_postgres(self, data: TransactionChunk, table_name: str) -> Tuple[int, int]:
+        """
+        Insert or update a chunk of rows in the transactions table.
+        Only the per-voucher columns are COPYed into a temporary staging table; the
+        chunk's constant columns are passed once as query parameters. The staging rows
+        are merged with one UPDATE for document numbers that already exist and one
+        INSERT for the rest; only the inserted rows take a transaction ID.
+        Returns (inserted, updated) counts.
+        """
         if not data:
             self.logger.info("No data to insert.")
-            return
+            return 0, 0
         self.logger.info(f"Processing {len(data)} records for insertion/update")
-        if data:
-            self.logger.info(f"Sample record before insertion: {data[0]}")
-            if 'GUID' in data[0]:
-                self.logger.info(f"GUID value: {data[0]['GUID']}, Type: {type(data[0]['GUID'])}")
-            if 'narration' in data[0]:
-                self.logger.info(f"Narration value: {data[0]['narration']}")
-            if 'document_number' in data[0]:
-                self.logger.info(f"Document number (voucher number) value: {data[0]['document_number']}")
+        self.logger.info(f"Sample record before insertion: {dict(zip(TransactionChunk.VOUCHER_COLUMNS, next(data.iter_rows())))}")
+        voucher_columns = list(TransactionChunk.VOUCHER_COLUMNS)
+        constant_columns = list(data.constants.keys())
+        staging_table = f"{table_name}_staging"
         try:
             with self.db_cursor() as cursor:
-                for idx, record in enumerate(data):
-                    self.logger.info(f"Processing record {idx+1}/{len(data)}: document_number={record['document_number']}, document_type={record['document_type']}")
-                    guid_str = str(record['GUID']) if isinstance(record.get('GUID'), uuid.UUID) else None
-                    check_query = f"""
-                        SELECT transaction_id FROM {table_name} 
-                        WHERE document_number = %s
-                    """
-                    self.logger.info(f"Checking if document_number '{record['document_number']}' exists in database")
-                    cursor.execute(check_query, (record['document_number'],))
-                    existing = cursor.fetchone()
-                    if existing:
-                        self.logger.info(f"FOUND: Document number '{record['document_number']}' exists with transaction_id {existing[0]}, updating GUID and subscribe_id")
-                        update_query = f"""
-                            UPDATE {table_name}
-                            SET GUID = %s, 
-                                subscribe_id = %s,
-                                updated_at = CURRENT_TIMESTAMP
-                            WHERE document_number = %s
-                        """
-                        cursor.execute(update_query, (guid_str, record['subscribe_id'], record['document_number']))
-                        self.logger.info(f"Updated record with document_number '{record['document_number']}'")
-                    else:
-                        self.logger.info(f"NOT FOUND: Document number '{record['document_number']}' not found, inserting new record")
-                        insert_record = {k: (str(v) if isinstance(v, uuid.UUID) else v) for k, v in record.items()}
-                        columns = ', '.join(insert_record.keys())
-                        placeholders = ', '.join(['%s'] * len(insert_record))
-                        insert_query = f"""
-                            INSERT INTO {table_name} ({columns})
-                            VALUES ({placeholders})
-                        """
-                        cursor.execute(insert_query, tuple(insert_record.values()))
-                        self.logger.info(f"Inserted new record with document_number '{record['document_number']}'")
-                self.logger.info("Data chunk processed successfully.")
+                cursor.execute(f"""
+                    CREATE TEMP TABLE {staging_table} ON COMMIT DROP AS
+                    SELECT 0 AS staging_seq, transaction_id, {', '.join(voucher_columns)} FROM {table_name} WITH NO DATA
+                """)
+                copy_rows(cursor, zip(range(len(data)), *(data.column(name) for name in voucher_columns)), staging_table,
+                          ['staging_seq'] + voucher_columns)
+
+                # Existing document numbers only get GUID and subscribe_id refreshed,
+                # taking the last occurrence in the chunk as the per-row path did. A new
+                # document number is inserted from its first occurrence with the GUID of
+                # its last one, which is where the per-row path's insert-then-update ended.
+                # The months of every written row are queued for the ledger monthly summary.
+                cursor.execute(f"""
+                    WITH updated AS (
+                        UPDATE {table_name} AS t
+                        SET GUID = s.GUID,
+                            subscribe_id = %(subscribe_id)s,
+                            updated_at = CURRENT_TIMESTAMP
+                        FROM (
+                            SELECT DISTINCT ON (document_number) document_number, GUID
+                            FROM {staging_table}
+                            ORDER BY document_number, staging_seq DESC
+                        ) AS s
+                        WHERE t.document_number = s.document_number
+                        RETURNING t.date
+                    ), pending AS (
+                        INSERT INTO {PENDING_MONTHS_TABLE_NAME} (subscribe_id, month)
+                        SELECT DISTINCT %(subscribe_id)s::integer, date_trunc('month', date)::date
+                        FROM updated
+                        WHERE date IS NOT NULL
+                        ON CONFLICT DO NOTHING
+                    )
+                    SELECT count(*) FROM updated
+                """, {'subscribe_id': data.constants['subscribe_id']})
+                updated_count = cursor.fetchone()[0]
+
+                # Number the first occurrence of each new document number, in chunk order
+                cursor.execute(f"""
+                    SELECT staging_seq
+                    FROM (
+                        SELECT DISTINCT ON (document_number) staging_seq, document_number
+                        FROM {staging_table}
+                        ORDER BY document_number, staging_seq
+                    ) AS s
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM {table_name} AS t WHERE t.document_number = s.document_number
+                    )
+                    ORDER BY staging_seq
+                """)
+                new_seqs = [row[0] for row in cursor.fetchall()]
+                if new_seqs:
+                    execute_values(cursor, f"""
+                        UPDATE {staging_table} AS s
+                        SET transaction_id = v.transaction_id
+                        FROM (VALUES %s) AS v (staging_seq, transaction_id)
+                        WHERE s.staging_seq = v.staging_seq
+                    """, list(zip(new_seqs, self.take_transaction_ids(cursor, len(new_seqs)))), page_size=1000)
+
+                cursor.execute(f"""
+                    WITH inserted AS (
+                        INSERT INTO {table_name} ({', '.join(['transaction_id'] + voucher_columns + constant_columns)})
+                        SELECT {', '.join(['transaction_id']
+                                          + ['last_guid' if column == 'GUID' else column for column in voucher_columns]
+                                          + [f'%({column})s' for column in constant_columns])}
+                        FROM (
+                            SELECT DISTINCT ON (document_number) *,
+                                   first_value(GUID) OVER (PARTITION BY document_number ORDER BY staging_seq DESC) AS last_guid
+                            FROM {staging_table}
+                            ORDER BY document_number, staging_seq
+                        ) AS s
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM {table_name} AS t WHERE t.document_number = s.document_number
+                        )
+                        ORDER BY staging_seq
+                        RETURNING date
+                    ), pending AS (
+                        INSERT INTO {PENDING_MONTHS_TABLE_NAME} (subscribe_id, month)
+                        SELECT DISTINCT %(subscribe_id)s::integer, date_trunc('month', date)::date
+                        FROM inserted
+                        WHERE date IS NOT NULL
+                        ON CONFLICT DO NOTHING
+                    )
+                    SELECT count(*) FROM inserted
+                """, data.constants)
+                inserted_count = cursor.fetchone()[0]
+            self.logger.info(f"Data chunk processed successfully: {inserted_count} inserted, {updated_count} updated.")
+            return inserted_count, updated_count
         except Exception as e:
             self.logger.error(f"Error processing data: {str(e)}")
             raise
 
-    def insert_transaction_details(self, ledger_entries: List[Dict]):
-        """Insert ledger entries into transaction_details table."""
+    def insert_transaction_details(self, ledger_entries: List[Dict], cursor=None):
+        """Insert ledger entries into transaction_details table, optionally inside the caller's transaction."""
         if not ledger_entries:
             self.logger.info("No ledger entries provided for insertion.")
             return
-        try:
-            with self.db_cursor() as cursor:
-                values = []
-                for entry in ledger_entries:
-                    values.append((
-                        entry['ledger_name'],
-                        entry['ledger_amount'],
-                        str(entry['GUID']),
-                        entry['subscribe_id'],
-                        entry['amount_status'],
-                        self.session_data.get('userId'),
-                        self.session_data.get('userId')
-                    ))
-                insert_query = """
-                    INSERT INTO transaction_details 
-                    (ledger_name, ledger_amount, GUID, subscribe_id, amount_status, created_by, updated_by)
-                    VALUES %s
-                """
-                execute_values(cursor, insert_query, values)
-            self.logger.info("Inserted new transaction_details records.")
-        except Exception as e:
-            self.logger.error(f"Error inserting transaction_details: {str(e)}")
-            raise
+        if cursor is None:
+            try:
+                with self.db_cursor() as cursor:
+                    self.insert_transaction_details(ledger_entries, cursor)
+            except Exception as e:
+                self.logger.error(f"Error inserting transaction_details: {str(e)}")
+                raise
+            return
+        values = []
+        for entry in ledger_entries:
+            values.append((
+                entry['ledger_name'],
+                entry['ledger_amount'],
+                str(entry['GUID']),
+                entry['subscribe_id'],
+                entry['amount_status'],
+                self.session_data.get('userId'),
+                self.session_data.get('userId')
+            ))
+        insert_query = """
+            INSERT INTO transaction_details 
+            (ledger_name, ledger_amount, GUID, subscribe_id, amount_status, created_by, updated_by)
+            VALUES %s
+        """
+        execute_values(cursor, insert_query, values, page_size=1000)
+        self.logger.info(f"Inserted {len(values)} new transaction_details records.")
 
     def sync_transaction_details(self, subscribe_id: str):
         """Sync transaction details data with the updated XML format"""
@@ -1227,7 +1791,7 @@ class TallyIntegration:
         try:
             self.logger.info(f"Starting transaction details sync from {start_date} to {end_date}")
             payload = self.construct_tally_data_payload(start_date, end_date, self.tally_data_config["company_name"])
-            xml_data = self.fetch_tally_data(payload)
+            xml_data = self.get_tally_xml_source(payload)
             success_count, failure_count = self.verify_and_update_transaction_details(xml_data, subscribe_id)
             self.logger.info(f"Transaction details sync completed. Success: {success_count}, Failures: {failure_count}")
             if failure_count > 0:
@@ -1250,26 +1814,38 @@ class TallyIntegration:
             self.logger.error(f"Error getting transaction details by GUID: {str(e)}")
             return []
 
-    def parse_ledger_entries_from_voucher(self, voucher, guid_uuid, subscribe_id):
-        """Parse ledger entries from a voucher element and return structured data"""
-        ledger_entries = []
-        allocations = voucher.findall(".//ACCOUNTING_ALLOCATION")
-        for allocation in allocations:
+    def parse_voucher_allocations(self, voucher) -> List[Tuple[str, Optional[Decimal], str]]:
+        """
+        Read every ACCOUNTING_ALLOCATION of a voucher once.
+        Returns (ledger_name, signed amount or None if unparseable, DRCR text) per allocation.
+        """
+        allocations = []
+        for allocation in voucher.iter("ACCOUNTING_ALLOCATION"):
             ledger_name = allocation.findtext("LEDGER") or ""
             amount_text = allocation.findtext("AMOUNT") or "0"
-            amount_status = allocation.findtext("DRCR") or ""
-            if not amount_status:
-                try:
-                    amount = float(amount_text.replace("(-)", "-"))
-                    amount_status = "Dr" if amount < 0 else "Cr"
-                except ValueError:
-                    self.logger.warning(f"Invalid amount format for ledger {ledger_name}: {amount_text}")
-                    amount_status = "Unknown"
             try:
-                ledger_amount = abs(float(amount_text.replace("(-)", "-")))
+                amount = parse_tally_amount(amount_text)
             except ValueError:
                 self.logger.warning(f"Invalid amount format for ledger {ledger_name}: {amount_text}")
-                ledger_amount = 0.0
+                amount = None
+            allocations.append((ledger_name, amount, allocation.findtext("DRCR") or ""))
+        return allocations
+
+    def parse_ledger_entries_from_voucher(self, voucher, guid_uuid, subscribe_id, allocations=None):
+        """
+        Parse ledger entries from a voucher element and return structured data.
+        allocations may be passed in when the caller already ran parse_voucher_allocations.
+        """
+        if allocations is None:
+            allocations = self.parse_voucher_allocations(voucher)
+        ledger_entries = []
+        for ledger_name, amount, amount_status in allocations:
+            if not amount_status:
+                if amount is None:
+                    amount_status = "Unknown"
+                else:
+                    amount_status = "Dr" if amount < 0 else "Cr"
+            ledger_amount = abs(amount) if amount is not None else ZERO_AMOUNT
             ledger_entries.append({
                 "ledger_name": ledger_name,
                 "ledger_amount": ledger_amount,
@@ -1279,16 +1855,115 @@ class TallyIntegration:
             })
         return ledger_entries
 
-    def verify_and_update_transaction_details(self, xml_data, subscribe_id):
+    def get_transaction_details_by_guids(self, cursor, guid_strs: List[str]) -> Dict[str, List]:
+        """Load existing transaction_details rows for a batch of GUIDs in one query, grouped by GUID."""
+        details_by_guid = {}
+        if not guid_strs:
+            return details_by_guid
+        # IN with a tuple lets Postgres coerce the literals to the GUID column type
+        cursor.execute("""
+            SELECT GUID::text AS guid, entry_id, ledger_name, ledger_amount
+            FROM transaction_details
+            WHERE GUID IN %s
+        """, (tuple(guid_strs),))
+        for row in cursor.fetchall():
+            details_by_guid.setdefault(row['guid'], []).append(row)
+        return details_by_guid
+
+    def reconcile_transaction_details(self, vouchers: List[Tuple[str, List[Dict]]], subscribe_id,
+                                      raise_errors: bool = False) -> Tuple[int, int]:
+        """
+        Verify and apply ledger entries for a batch of vouchers given as (guid_str, ledger_entries).
+        Existing rows for the whole batch are loaded with one query and diffed in memory;
+        inserts and amount_status updates are then written in a single transaction.
+        If that transaction fails, the whole batch is counted as failed, or with
+        raise_errors TransactionDetailsReconcileError is raised instead.
+        """
+        success_count = 0
+        failure_count = 0
+        try:
+            with self.db_cursor() as cursor:
+                existing_details = self.get_transaction_details_by_guids(cursor, [guid_str for guid_str, _ in vouchers])
+                new_entries = []
+                entry_ids_by_status = {}
+                seen_guids = set()
+                for guid_str, api_ledger_entries in vouchers:
+                    if guid_str in seen_guids:
+                        continue
+                    seen_guids.add(guid_str)
+
+                    db_entries = existing_details.get(guid_str)
+                    if not db_entries:
+                        new_entries.extend(api_ledger_entries)
+                        success_count += 1
+                        continue
+
+                    db_entries_map = {row['ledger_name']: {
+                        'entry_id': row['entry_id'], 
+                        'amount': Decimal(str(row['ledger_amount']))
+                    } for row in db_entries}
+                    api_entries_map = {entry['ledger_name']: entry for entry in api_ledger_entries}
+
+                    missing_in_api = set(db_entries_map.keys()) - set(api_entries_map.keys())
+                    if missing_in_api:
+                        self.logger.error(f"Ledgers in DB not found in API response for GUID {guid_str}: {missing_in_api}")
+                        failure_count += 1
+                        continue
+
+                    missing_in_db = set(api_entries_map.keys()) - set(db_entries_map.keys())
+                    if missing_in_db:
+                        self.logger.warning(f"New ledgers in API not in DB for GUID {guid_str}: {missing_in_db}")
+
+                    amount_mismatches = []
+                    for ledger_name in set(db_entries_map.keys()) & set(api_entries_map.keys()):
+                        db_amount = db_entries_map[ledger_name]['amount']
+                        api_amount = api_entries_map[ledger_name]['ledger_amount']
+                        if abs(db_amount - api_amount) > Decimal('0.01'):
+                            amount_mismatches.append(f"{ledger_name}: DB={db_amount}, API={api_amount}")
+                    if amount_mismatches:
+                        self.logger.error(f"Amount mismatches for GUID {guid_str}: {amount_mismatches}")
+                        failure_count += 1
+                        continue
+
+                    for ledger_name, entry in db_entries_map.items():
+                        amount_status = api_entries_map[ledger_name]['amount_status']
+                        entry_ids_by_status.setdefault(amount_status, []).append(entry['entry_id'])
+                    success_count += 1
+
+                self.insert_transaction_details(new_entries, cursor)
+                for amount_status, entry_ids in entry_ids_by_status.items():
+                    cursor.execute("""
+                        UPDATE transaction_details
+                        SET subscribe_id = %s,
+                            amount_status = %s,
+                            updated_at = CURRENT_TIMESTAMP,
+                            updated_by = %s
+                        WHERE entry_id = ANY(%s)
+                    """, (
+                        subscribe_id,
+                        amount_status,
+                        self.session_data.get('userId'),
+                        entry_ids
+                    ))
+            self.logger.info(f"Reconciled transaction_details for {len(vouchers)} vouchers: {success_count} succeeded, {failure_count} failed")
+            return success_count, failure_count
+        except Exception as e:
+            self.logger.error(f"Error reconciling transaction_details for {len(vouchers)} vouchers: {str(e)}")
+            if raise_errors:
+                raise TransactionDetailsReconcileError(f"transaction_details reconcile failed for {len(vouchers)} vouchers: {e}") from e
+            return 0, len(vouchers)
+
+    def verify_and_update_transaction_details(self, xml_data, subscribe_id, batch_size: int = 1000):
         """
         Parse Tally XML, verify transaction details for each voucher, and either insert
         new details if missing or update existing details if matching ledger entries are found.
         If ledger amounts or names do not match, a warning is raised.
+        Vouchers are reconciled in batches of batch_size.
         """
-        root = ET.fromstring(xml_data)
         success_count = 0
         failure_count = 0
-        for voucher in root.findall(".//VOUCHER"):
+        batch = []
+        for voucher in self.iter_voucher_elements(xml_data):
             guid_text = voucher.findtext("GUID") or ""
             if not guid_text:
                 self.logger.warning("Voucher without GUID found, skipping.")
@@ -1302,75 +1977,35 @@ class TallyIntegration:
             if not api_ledger_entries:
                 self.logger.warning(f"No ledger entries found for voucher with GUID {guid_str}")
                 continue
-            
-            db_entries = self.get_transaction_details_by_guid(guid_str)
-            if not db_entries:
-                self.logger.info(f"No transaction_details found with GUID {guid_str}, inserting new transaction_details.")
-                try:
-                    self.insert_transaction_details(api_ledger_entries)
-                    success_count += 1
-                except Exception as e:
-                    self.logger.error(f"Error inserting transaction_details for GUID {guid_str}: {e}")
-                    failure_count += 1
-                continue
-            
-            db_entries_map = {row['ledger_name']: {
-                'entry_id': row['entry_id'], 
-                'amount': float(row['ledger_amount'])
-            } for row in db_entries}
-            api_entries_map = {entry['ledger_name']: entry for entry in api_ledger_entries}
-            
-            missing_in_api = set(db_entries_map.keys()) - set(api_entries_map.keys())
-            if missing_in_api:
-                self.logger.error(f"Ledgers in DB not found in API response for GUID {guid_str}: {missing_in_api}")
-                failure_count += 1
-                continue
-            
-            missing_in_db = set(api_entries_map.keys()) - set(db_entries_map.keys())
-            if missing_in_db:
-                self.logger.warning(f"New ledgers in API not in DB for GUID {guid_str}: {missing_in_db}")
-            
-            amount_mismatches = []
-            for ledger_name in set(db_entries_map.keys()) & set(api_entries_map.keys()):
-                db_amount = db_entries_map[ledger_name]['amount']
-                api_amount = float(api_entries_map[ledger_name]['ledger_amount'])
-                if abs(db_amount - api_amount) > 0.01:
-                    amount_mismatches.append(f"{ledger_name}: DB={db_amount}, API={api_amount}")
-            if amount_mismatches:
-                self.logger.error(f"Amount mismatches for GUID {guid_str}: {amount_mismatches}")
-                failure_count += 1
-                continue
-            
-            try:
-                with self.db_cursor() as cursor:
-                    for ledger_name, entry in db_entries_map.items():
-                        if ledger_name in api_entries_map:
-                            api_entry = api_entries_map[ledger_name]
-                            entry_id = entry['entry_id']
-                            cursor.execute("""
-                                UPDATE transaction_details
-                                SET GUID = %s,
-                                    subscribe_id = %s,
-                                    amount_status = %s,
-                                    updated_at = CURRENT_TIMESTAMP,
-                                    updated_by = %s
-                                WHERE entry_id = %s
-                            """, (
-                                guid_str,
-                                subscribe_id,
-                                api_entry['amount_status'],
-                                self.session_data.get('userId'),
-                                entry_id
-                            ))
-                success_count += 1
-                self.logger.info(f"Updated transaction_details for GUID {guid_str}")
-            except Exception as e:
-                self.logger.error(f"Error updating transaction_details for GUID {guid_str}: {str(e)}")
-                failure_count += 1
+            batch.append((guid_str, api_ledger_entries))
+
+            if len(batch) >= batch_size:
+                batch_success, batch_failure = self.reconcile_transaction_details(batch, subscribe_id)
+                success_count += batch_success
+                failure_count += batch_failure
+                batch = []
+        if batch:
+            batch_success, batch_failure = self.reconcile_transaction_details(batch, subscribe_id)
+            success_count += batch_success
+            failure_count += batch_failure
         return success_count, failure_count
 
-    def sync_data_by_year(self, start_date: datetime.date, end_date: datetime.date, overall_pbar, subscribe_id: str) -> bool:
-        """Sync data for a specific year range with progress tracking."""
+    def sync_data_by_year(self, start_date: datetime.date, end_date: datetime.date, overall_pbar, subscribe_id: str,
+                          min_alter_id=None, xml_source=None, split_oversized: bool = False,
+                          run_key: str = None, checkpoint: Dict = None) -> bool:
+        """
+        Sync data for a specific year range with progress tracking.
+        xml_source, when given, is the already requested Tally response for the range.
+        With split_oversized, a timeout, an interrupted response or TallyWindowTooLarge
+        is raised to the caller so it can bisect the window instead of counting it as failed.
+        With run_key, progress is checkpointed after every batch whose transactions and
+        transaction_details were both committed, and a checkpoint from an earlier attempt
+        skips the vouchers it already committed. The window is only marked completed
+        once all of its batches got that far.
+        """
+        skip_vouchers = checkpoint['vouchers_committed'] if checkpoint else 0
+        skip_until_guid = checkpoint['last_guid'] if checkpoint else None
+        year_pbar = None
         try:
             year_pbar = tqdm(
                 total=100,
@@ -1379,63 +2014,226 @@ class TallyIntegration:
                 position=1
             )
             self.logger.info(f"Processing data from {start_date} to {end_date}")
-            year_pbar.set_description("Constructing payload")
-            payload = self.construct_tally_data_payload(start_date, end_date, self.tally_data_config["company_name"])
-            year_pbar.update(20)
-            year_pbar.set_description("Fetching data")
-            xml_data = self.fetch_tally_data(payload)
+            if xml_source is None:
+                year_pbar.set_description("Constructing payload")
+                payload = self.construct_tally_data_payload(start_date, end_date, self.tally_data_config["company_name"], min_alter_id)
+                year_pbar.update(20)
+                year_pbar.set_description("Fetching data")
+                xml_data = self.get_tally_xml_source(payload)
+            else:
+                year_pbar.update(20)
+                xml_data = xml_source
             year_pbar.update(30)
             year_pbar.set_description("Parsing and inserting data")
             total_records = 0
-            for chunk in self.parse_tally_data_xml(xml_data, subscribe_id):
-                self.insert_transactions_into_postgres(chunk, self.tally_data_config["table_name"])
+            total_inserted = 0
+            total_updated = 0
+            received = {'bytes': 0}
+            month_counts = {}
+
+            def counted_chunks():
+                for xml_chunk in self.iter_xml_chunks(xml_data):
+                    received['bytes'] += len(xml_chunk)
+                    yield xml_chunk
+
+            if skip_vouchers:
+                self.logger.info(f"Resuming {start_date} to {end_date} after {skip_vouchers} committed vouchers")
+            for chunk, ledger_batch, (vouchers_read, last_guid) in self.parse_tally_vouchers(counted_chunks(), subscribe_id, skip_vouchers, skip_until_guid):
+                for voucher_date in chunk.column('date'):
+                    month = voucher_date.replace(day=1)
+                    month_counts[month] = month_counts.get(month, 0) + 1
+                inserted, updated = self.insert_transactions_into_postgres(chunk, self.tally_data_config["table_name"])
                 total_records += len(chunk)
+                total_inserted += inserted
+                total_updated += updated
+                if ledger_batch:
+                    # A failed reconcile fails the window, so neither its checkpoint nor the
+                    # AlterID watermark moves past vouchers whose details were not written
+                    try:
+                        details_success, details_failure = self.reconcile_transaction_details(ledger_batch, subscribe_id, raise_errors=True)
+                    except TransactionDetailsReconcileError:
+                        self.details_failure_count += len(ledger_batch)
+                        raise
+                    self.details_success_count += details_success
+                    self.details_failure_count += details_failure
+                if run_key is not None:
+                    self.save_sync_checkpoint(subscribe_id, run_key, start_date, end_date, 'in_progress', vouchers_read, last_guid)
                 year_pbar.update(50 * (len(chunk) / 100000))
-            self.logger.info(f"Total records processed: {total_records}")
+            self.logger.info(f"Total records processed: {total_records} (inserted: {total_inserted}, updated: {total_updated})")
+            # Incremental responses only hold altered vouchers, and a resumed window only part
+            # of its vouchers, so neither says anything about density
+            if min_alter_id is None and not skip_vouchers:
+                self.record_window_density(subscribe_id, start_date, end_date, month_counts, received['bytes'])
+            if run_key is not None:
+                self.save_sync_checkpoint(subscribe_id, run_key, start_date, end_date, 'completed', 0)
             year_pbar.close()
             overall_pbar.update(1)
             return True
+        except WINDOW_SPLIT_ERRORS as e:
+            if year_pbar is not None:
+                year_pbar.close()
+            if split_oversized:
+                self.logger.warning(f"Window {start_date} to {end_date} is too large for one request: {e}")
+                raise
+            self.logger.error(f"Error processing data: {str(e)}")
+            return False
+        except TallyCheckpointMismatch as e:
+            # Tally no longer returns the window in the same order; redo it from the start next time
+            self.logger.error(f"Error processing data: {str(e)}")
+            self.delete_sync_checkpoints(subscribe_id, (start_date, end_date))
+            return False
         except Exception as e:
             self.logger.error(f"Error processing data: {str(e)}")
             return False
 
+    def plan_sync_windows(self, subscribe_id: str, start_date: datetime.date, end_date: datetime.date, min_alter_id=None) -> List[Tuple[datetime.date, datetime.date]]:
+        """
+        Split the sync range into date windows sized from the learned voucher and byte
+        density of each month, so busy periods get short windows and sparse ones long
+        windows. Months never synced before use the average learned density. A company
+        with no history yet is synced in one-year windows, as before densities were
+        learned; windows that turn out too large are bisected while they are fetched.
+        """
+        # Incremental runs only return altered vouchers, so the whole range fits in one request
+        if min_alter_id is not None:
+            return [(start_date, end_date)]
+        densities = self.load_window_densities(subscribe_id)
+        if not densities:
+            windows = []
+            window_start = start_date
+            while window_start <= end_date:
+                try:
+                    next_start = window_start.replace(year=window_start.year + 1)
+                except ValueError:
+                    # 29 February
+                    next_start = datetime.date(window_start.year + 1, 3, 1)
+                windows.append((window_start, min(next_start - datetime.timedelta(days=1), end_date)))
+                window_start = next_start
+            self.logger.info(f"No learned voucher density yet, planned {len(windows)} one-year sync windows from {start_date} to {end_date}")
+            return windows
+        default_density = (
+            sum(vouchers for vouchers, _ in densities.values()) / len(densities),
+            sum(byte_count for _, byte_count in densities.values()) / len(densities)
+        )
+        windows = []
+        window_start = start_date
+        window_vouchers = 0.0
+        window_bytes = 0.0
+        day = start_date
+        while day <= end_date:
+            day_vouchers, day_bytes = densities.get(day.replace(day=1), default_density)
+            if day > window_start and (
+                window_vouchers + day_vouchers > self.window_target_vouchers
+                or window_bytes + day_bytes > self.window_target_bytes
+                or (day - window_start).days >= self.window_max_days
+            ):
+                windows.append((window_start, day - datetime.timedelta(days=1)))
+                window_start = day
+                window_vouchers = 0.0
+                window_bytes = 0.0
+            window_vouchers += day_vouchers
+            window_bytes += day_bytes
+            day += datetime.timedelta(days=1)
+        windows.append((window_start, end_date))
+        self.logger.info(f"Planned {len(windows)} sync windows from {start_date} to {end_date}")
+        return windows
+
     def sync_tally_data(self, subscribe_id: str):
-        """Sync all tally data with progress tracking."""
+        """
+        Sync all tally data with progress tracking.
+        Windows are fetched by a small worker pool while the main thread parses and
+        inserts the previous window, always in window order. A window that times out
+        or exceeds TALLY_WINDOW_MAX_BYTES is bisected and its halves synced in its place.
+        Progress is checkpointed per window, so a rerun after a failure skips completed
+        windows and resumes a partly committed one after its last committed batch.
+        """
         start_date = self.tally_data_config['from_date']
         end_date = self.tally_data_config['to_date']
-        years_diff = end_date.year - start_date.year
-        if end_date.month < start_date.month or (end_date.month == start_date.month and end_date.day < start_date.day):
-            years_diff -= 1
-        total_chunks = max(1, years_diff + 1)
+        self.ensure_sync_indexes()
+        min_alter_id = self.resolve_min_alter_id(subscribe_id)
+        self.max_alter_id_seen = None
+        run_key = f"{start_date}:{end_date}:{'full' if min_alter_id is None else f'alterid>{min_alter_id}'}"
+        checkpoints = self.load_sync_checkpoints(subscribe_id, run_key)
+        windows = []
+        gap_start = start_date
+        for window, checkpoint in sorted(checkpoints.items()):
+            if window[0] > gap_start:
+                windows.extend(self.plan_sync_windows(subscribe_id, gap_start, window[0] - datetime.timedelta(days=1), min_alter_id))
+            if checkpoint['status'] != 'completed':
+                windows.append(window)
+            gap_start = max(gap_start, window[1] + datetime.timedelta(days=1))
+        if gap_start <= end_date:
+            windows.extend(self.plan_sync_windows(subscribe_id, gap_start, end_date, min_alter_id))
+        if checkpoints:
+            completed = sum(1 for checkpoint in checkpoints.values() if checkpoint['status'] == 'completed')
+            self.logger.info(f"Resuming run {run_key}: {completed} windows already completed")
         overall_pbar = tqdm(
-            total=total_chunks,
+            total=len(windows),
             desc="Overall Progress",
             leave=True,
             position=0
         )
         success_chunks = []
         failed_chunks = []
-        print(f"\nProcessing data in {total_chunks} {'chunk' if total_chunks == 1 else 'chunks'}...")
-        if total_chunks == 1:
-            if self.sync_data_by_year(start_date, end_date, overall_pbar, subscribe_id):
-                success_chunks.append(f"{start_date} to {end_date}")
-            else:
-                failed_chunks.append(f"{start_date} to {end_date}")
-        else:
-            current_date = start_date
-            while current_date < end_date:
-                year_end = min(
-                    datetime.date(current_date.year + 1, current_date.month, current_date.day) - datetime.timedelta(days=1),
-                    end_date
-                )
-                if self.sync_data_by_year(current_date, year_end, overall_pbar, subscribe_id):
-                    success_chunks.append(f"{current_date} to {year_end}")
-                else:
-                    failed_chunks.append(f"{current_date} to {year_end}")
-                current_date = year_end + datetime.timedelta(days=1)
+        print(f"\nProcessing data in {len(windows)} {'chunk' if len(windows) == 1 else 'chunks'}...")
+        pending = deque(windows)
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.fetch_concurrency, thread_name_prefix="tally-fetch") as executor:
+            def start_window_fetches():
+                while pending and len(in_flight) < self.fetch_concurrency:
+                    window_start, window_end = pending.popleft()
+                    payload = self.construct_tally_data_payload(window_start, window_end, self.tally_data_config["company_name"], min_alter_id)
+                    chunk_queue = queue.Queue(maxsize=self.prefetch_max_chunks)
+                    cancel_event = threading.Event()
+                    executor.submit(self.prefetch_tally_window, payload, chunk_queue, cancel_event, window_end > window_start)
+                    in_flight.append(((window_start, window_end), chunk_queue, cancel_event))
+
+            try:
+                start_window_fetches()
+                while in_flight:
+                    (window_start, window_end), chunk_queue, cancel_event = in_flight.popleft()
+                    try:
+                        if self.sync_data_by_year(window_start, window_end, overall_pbar, subscribe_id, min_alter_id,
+                                                  xml_source=self.iter_prefetched_window(chunk_queue),
+                                                  split_oversized=window_end > window_start,
+                                                  run_key=run_key,
+                                                  checkpoint=checkpoints.get((window_start, window_end))):
+                            success_chunks.append(f"{window_start} to {window_end}")
+                        else:
+                            # Stop the fetch if processing gave up before the response was fully read
+                            cancel_event.set()
+                            failed_chunks.append(f"{window_start} to {window_end}")
+                    except WINDOW_SPLIT_ERRORS:
+                        # Bisect, and refetch the windows queued behind it so they stay in order
+                        cancel_event.set()
+                        self.delete_sync_checkpoints(subscribe_id, (window_start, window_end))
+                        checkpoints.pop((window_start, window_end), None)
+                        middle = window_start + (window_end - window_start) // 2
+                        requeued = [(window_start, middle), (middle + datetime.timedelta(days=1), window_end)]
+                        for queued_window, _, queued_cancel_event in in_flight:
+                            queued_cancel_event.set()
+                            requeued.append(queued_window)
+                        in_flight.clear()
+                        pending.extendleft(reversed(requeued))
+                        overall_pbar.total += 1
+                        overall_pbar.refresh()
+                    start_window_fetches()
+            finally:
+                for _, _, queued_cancel_event in in_flight:
+                    queued_cancel_event.set()
         overall_pbar.close()
+        # Months left pending by a failure here stay queued and are refreshed after the next sync
+        try:
+            self.monthly_summary.refresh(subscribe_id)
+        except Exception as e:
+            self.logger.error(f"Ledger monthly summary refresh failed: {str(e)}")
+        # Only move the watermark once every chunk is in, so a failed window is retried next run
+        if not failed_chunks:
+            if self.max_alter_id_seen is not None:
+                self.save_alter_id_watermark(subscribe_id, max(self.max_alter_id_seen, min_alter_id or 0))
+            self.delete_sync_checkpoints(subscribe_id)
         print("\nSync Summary:")
-        print(f"Total Chunks Processed: {total_chunks}")
+        print(f"Total Chunks Processed: {len(success_chunks) + len(failed_chunks)}")
         print(f"Successfully Processed: {len(success_chunks)}")
         print(f"Failed: {len(failed_chunks)}")
         if failed_chunks:
@@ -1459,12 +2257,11 @@ def main():
         sys.exit(1)
     tally = TallyIntegration(session_data)
     subscribe_id = session_data['subscribeId']
-    # Sync transactions
+    # Sync transactions and their transaction details (ledger entries) in a single pass
     success_chunks, failed_chunks = tally.sync_tally_data(subscribe_id)
     print(f"Transactions sync completed. Success chunks: {success_chunks}, Failed chunks: {failed_chunks}")
-    # Sync transaction details (upsert or insert ledger entries)
-    success_count, failure_count = tally.sync_transaction_details(subscribe_id)
-    print(f"Transaction details sync completed. Success: {success_count}, Failures: {failure_count}")
+    print(f"Transaction details sync completed. Success: {tally.details_success_count}, Failures: {tally.details_failure_count}")
+    tally.logger.info(f"Connection pool stats: {tally.pool.stats()}")
 
 if __name__ == "__main__":
     main()
@@ -1,14 +1,24 @@
 import requests
 import xml.etree.ElementTree as ET
-import psycopg2
 from decimal import Decimal
-from typing import Dict, Any, Set
+from typing import Dict, Any, List, Tuple
 import re
 import os
+import hashlib
 from dotenv import load_dotenv
+from db_utils import copy_rows, get_pool
 
 load_dotenv()
 
+# tally_ledgers columns written by the sync, in parse_ledger order
+LEDGER_COLUMNS = [
+    'subscribe_id', 'name', 'parent', 'address', 'led_state_name', 'pincode', 'ledger_mobile',
+    'opening_balance', 'closing_balance', 'bill_by_bill', 'is_bill_wise_on', 'credit_days',
+    'country_of_residence', 'gst_registration_type', 'party_gstin', 'bank_details', 'ifsc_code',
+    'bank_name', 'account_number', 'income_tax_number', 'registration_type', 'vattin_number',
+    'interstate_st_number', 'content_hash'
+]
+
 class TallyIntegration:
     def __init__(self, session_data: Dict[str, str]):
         self.session_data = session_data
@@ -19,8 +29,8 @@ class TallyIntegration:
             'host': os.getenv('DB_HOST'),
             'port': os.getenv('DB_PORT')
         }
+        self.pool = get_pool(self.db_params)
         self.tally_url = os.getenv('TALLY_URL')
-        self.existing_entries: Set[tuple] = set() # Updated: changed to Set[tuple]
         self.xml_request = self.construct_xml_request()
 
     def construct_xml_request(self):
@@ -88,8 +98,6 @@ class TallyIntegration:
             updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
         );
 
-        CREATE INDEX IF NOT EXISTS idx_tally_ledgers_name_subscribe_id ON tally_ledgers(name, subscribe_id);
-
         CREATE OR REPLACE FUNCTION update_updated_at_column()
         RETURNS TRIGGER AS $$
         BEGIN
@@ -104,15 +112,23 @@ class TallyIntegration:
             FOR EACH ROW
             EXECUTE FUNCTION update_updated_at_column();
         """
-        with psycopg2.connect(**self.db_params) as conn:
+        with self.pool.connection() as conn:
             with conn.cursor() as cur:
                 cur.execute(create_table_query)
-
-    def load_existing_entries(self):
-        with psycopg2.connect(**self.db_params) as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT name, subscribe_id FROM tally_ledgers")
-                self.existing_entries = {(row[0], row[1]) for row in cur.fetchall()}
+                cur.execute("ALTER TABLE tally_ledgers ADD COLUMN IF NOT EXISTS content_hash TEXT")
+                cur.execute("SELECT to_regclass('uq_tally_ledgers_name_subscribe_id')")
+                if cur.fetchone()[0] is None:
+                    # Older syncs could leave duplicate ledgers behind; keep the newest row of each
+                    cur.execute("""
+                        DELETE FROM tally_ledgers a
+                        USING tally_ledgers b
+                        WHERE a.name = b.name AND a.subscribe_id = b.subscribe_id AND a.id < b.id
+                    """)
+                    if cur.rowcount:
+                        print(f"Removed {cur.rowcount} duplicate ledger rows")
+                    cur.execute("DROP INDEX IF EXISTS idx_tally_ledgers_name_subscribe_id")
+                    cur.execute("CREATE UNIQUE INDEX uq_tally_ledgers_name_subscribe_id ON tally_ledgers(name, subscribe_id)")
+            conn.commit()
 
     def clean_xml_content(self, content: bytes) -> str:
         # First, try to decode as UTF-8, fallback to Latin-1
@@ -185,7 +201,7 @@ class TallyIntegration:
         if not name:  # Skip ledgers without names
             return {}
 
-        return {
+        ledger_data = {
             'subscribe_id': int(self.session_data['subscribeId']),
             'name': name,
             'parent': get_text(ledger, 'PARENT'),
@@ -210,57 +226,61 @@ class TallyIntegration:
             'vattin_number': get_text(ledger, 'VATTINNUMBER')[:20],
             'interstate_st_number': get_text(ledger, 'INTERSTATESTNUMBER')[:20]
         }
+        ledger_data['content_hash'] = self.content_hash(ledger_data)
+        return ledger_data
 
-    def upsert_data(self, ledger_data: Dict[str, Any]) -> bool:
-        if not ledger_data or not ledger_data.get('name'):
-            return False
+    def content_hash(self, ledger_data: Dict[str, Any]) -> str:
+        """Hash of a parsed ledger's normalized fields, stored so unchanged ledgers are not rewritten."""
+        normalized = '\x1f'.join(str(ledger_data[column]) for column in LEDGER_COLUMNS if column != 'content_hash')
+        return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
 
-        params = (
-            ledger_data['parent'], ledger_data['address'],
-            ledger_data['led_state_name'], ledger_data['pincode'],
-            ledger_data['ledger_mobile'], ledger_data['opening_balance'],
-            ledger_data['closing_balance'], ledger_data['bill_by_bill'],
-            ledger_data['is_bill_wise_on'], ledger_data['credit_days'],
-            ledger_data['country_of_residence'], ledger_data['gst_registration_type'],
-            ledger_data['party_gstin'], ledger_data['bank_details'],
-            ledger_data['ifsc_code'], ledger_data['bank_name'],
-            ledger_data['account_number'], ledger_data['income_tax_number'],
-            ledger_data['registration_type'], ledger_data['vattin_number'],
-            ledger_data['interstate_st_number'], ledger_data['name'],
-            ledger_data['subscribe_id']
-        )
+    def upsert_ledgers(self, ledgers: List[Dict[str, Any]]) -> Tuple[int, int, int]:
+        """
+        Write all parsed ledgers in one transaction: COPY them into a staging table,
+        then merge into tally_ledgers with ON CONFLICT (name, subscribe_id). Existing
+        rows whose content_hash is unchanged are left alone.
+        Returns (inserted, updated, unchanged) counts.
+        """
+        # A ledger listed twice keeps its last occurrence, as the per-ledger path did
+        unique_ledgers = {}
+        for ledger_data in ledgers:
+            if ledger_data and ledger_data.get('name'):
+                unique_ledgers[(ledger_data['name'], ledger_data['subscribe_id'])] = ledger_data
+        if not unique_ledgers:
+            return 0, 0, 0
 
-        with psycopg2.connect(**self.db_params) as conn:
-            with conn.cursor() as cur:
-                if (ledger_data['name'], ledger_data['subscribe_id']) in self.existing_entries:
-                    cur.execute("""
-                        UPDATE tally_ledgers SET
-                            parent = %s, address = %s, led_state_name = %s, pincode = %s,
-                            ledger_mobile = %s, opening_balance = %s, closing_balance = %s,
-                            bill_by_bill = %s, is_bill_wise_on = %s, credit_days = %s,
-                            country_of_residence = %s, gst_registration_type = %s,
-                            party_gstin = %s, bank_details = %s, ifsc_code = %s,
-                            bank_name = %s, account_number = %s, income_tax_number = %s,
-                            registration_type = %s, vattin_number = %s, interstate_st_number = %s
-                        WHERE name = %s AND subscribe_id = %s
-                    """, params)
-                    return False
-                else:
-                    cur.execute("""
-                        INSERT INTO tally_ledgers (
-                            parent, address, led_state_name, pincode, ledger_mobile,
-                            opening_balance, closing_balance, bill_by_bill, is_bill_wise_on,
-                            credit_days, country_of_residence, gst_registration_type,
-                            party_gstin, bank_details, ifsc_code, bank_name, account_number,
-                            income_tax_number, registration_type, vattin_number,
-                            interstate_st_number, name, subscribe_id
-                        ) VALUES (
-                            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                            %s, %s, %s, %s, %s, %s, %s, %s, %s
-                        )
-                    """, params)
-                    self.existing_entries.add((ledger_data['name'], ledger_data['subscribe_id']))
-                    return True
+        column_list = ', '.join(LEDGER_COLUMNS)
+        update_list = ', '.join(
+            f"{column} = EXCLUDED.{column}" for column in LEDGER_COLUMNS if column not in ('name', 'subscribe_id')
+        )
+        with self.pool.connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(f"""
+                        CREATE TEMP TABLE tally_ledgers_staging ON COMMIT DROP AS
+                        SELECT {column_list} FROM tally_ledgers WITH NO DATA
+                    """)
+                    copy_rows(
+                        cur,
+                        ([ledger_data[column] for column in LEDGER_COLUMNS] for ledger_data in unique_ledgers.values()),
+                        'tally_ledgers_staging',
+                        LEDGER_COLUMNS
+                    )
+                    cur.execute(f"""
+                        INSERT INTO tally_ledgers ({column_list})
+                        SELECT {column_list} FROM tally_ledgers_staging
+                        ON CONFLICT (name, subscribe_id) DO UPDATE SET {update_list}
+                        WHERE tally_ledgers.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+                        RETURNING (xmax = 0) AS inserted
+                    """)
+                    results = cur.fetchall()
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                print(f"Failed to write ledgers: {str(e)}")
+                raise
+        inserted = sum(1 for row in results if row[0])
+        return inserted, len(results) - inserted, len(unique_ledgers) - len(results)
 
 def main(session_data):
     print("Starting Tally integration...")
@@ -268,26 +288,19 @@ def main(session_data):
     
     print("Setting up database...")
     tally.ensure_table_exists()
-    tally.load_existing_entries()
     
     print("Fetching data from Tally...")
     root = tally.fetch_tally_data()
     
     print("Processing ledgers...")
-    new_count = update_count = 0
-    
-    for ledger in root.findall('.//LEDGER'):
-        ledger_data = tally.parse_ledger(ledger)
-        if ledger_data:  # Skip empty ledger data
-            if tally.upsert_data(ledger_data):
-                new_count += 1
-            else:
-                update_count += 1
+    ledgers = [tally.parse_ledger(ledger) for ledger in root.findall('.//LEDGER')]
+    new_count, update_count, unchanged_count = tally.upsert_ledgers(ledgers)
     
     print(f"\nSync completed successfully!")
     print(f"New entries: {new_count}")
     print(f"Updated entries: {update_count}")
-    print(f"Total processed: {new_count + update_count}")
+    print(f"Unchanged entries: {unchanged_count}")
+    print(f"Total processed: {new_count + update_count + unchanged_count}")
 
 if __name__ == "__main__":
     import sys
@@ -0,0 +1,183 @@
+import re
+import html
+import codecs
+import datetime
+import itertools
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+# Date format used by Tally XML exports, e.g. 1-Apr-23
+TALLY_DATE_FORMAT = '%d-%b-%y'
+ZERO_AMOUNT = Decimal('0')
+
+
+@lru_cache(maxsize=4096)
+def _parse_tally_date(date_text: str) -> datetime.date:
+    return datetime.datetime.strptime(date_text, TALLY_DATE_FORMAT).date()
+
+
+def parse_tally_date(date_text: str) -> datetime.date:
+    """
+    Parse a Tally export date such as '1-Apr-23'.
+    An export repeats a few hundred distinct dates, so results are memoized.
+    Raises ValueError for a missing or malformed date.
+    """
+    if not date_text:
+        raise ValueError(f"Invalid Tally date: {date_text!r}")
+    return _parse_tally_date(date_text.strip())
+
+
+def parse_tally_amount(amount_text: str) -> Decimal:
+    """
+    Parse a Tally amount into an exact Decimal, in one pass and without going through float.
+    Negative amounts may be written as '(-)1234.50' or '-1234.50'.
+    Raises ValueError for anything that is not a finite number.
+    """
+    text = amount_text.strip()
+    if text.startswith('(-)'):
+        text = '-' + text[3:].lstrip()
+    try:
+        amount = Decimal(text)
+    except InvalidOperation:
+        raise ValueError(f"Invalid Tally amount: {amount_text!r}") from None
+    if not amount.is_finite():
+        raise ValueError(f"Invalid Tally amount: {amount_text!r}")
+    return amount
+
+
+# Entities Tally writes into names and text; &amp; is decoded last so it never forms another
+XML_ENTITIES = (('&lt;', '<'), ('&gt;', '>'), ('&quot;', '"'), ('&apos;', "'"))
+
+
+def unescape_xml_text(text: str) -> str:
+    """
+    html.unescape for Tally export text. Plain replaces decode the XML entities without
+    html.unescape's per-reference callback; any other reference falls back to it.
+    """
+    decoded = text
+    for entity, char in XML_ENTITIES:
+        decoded = decoded.replace(entity, char)
+    if '&' in decoded.replace('&amp;', ''):
+        return html.unescape(text)
+    return decoded.replace('&amp;', '&')
+
+
+# One match per LEDGER element: its NAME attribute and the text of the first PARENT
+# inside it. The unrolled loop passes over other tags without backtracking and stops at
+# the element's close tag (or the next LEDGER open tag), leaving the PARENT group empty
+# when the element has none. {p} marks the quantifiers that never need to give back.
+LEDGER_PARENT_REGEX = (
+    r'<LEDGER\b[^>]*?\bNAME="([^"]*)"[^>]*{p}>'
+    r'[^<]*{p}(?:<(?!PARENT\b|/?LEDGER\b)[^<]*{p})*{p}'
+    r'(?:<PARENT\b[^>]*{p}>([^<]*{p})<)?'
+)
+try:
+    # Possessive quantifiers (Python 3.11+) spare the engine a backtrack point per skipped tag
+    LEDGER_PARENT_PATTERN = re.compile(LEDGER_PARENT_REGEX.format(p='+'))
+except re.error:
+    LEDGER_PARENT_PATTERN = re.compile(LEDGER_PARENT_REGEX.format(p=''))
+# Same pattern for raw response bytes in an ASCII-compatible encoding such as UTF-8
+LEDGER_PARENT_BYTES_PATTERN = re.compile(LEDGER_PARENT_PATTERN.pattern.encode('ascii'))
+INVALID_XML_CHARS_PATTERN = re.compile(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]')
+XML_MARKUP_SAMPLE = '<LEDGER NAME="">'
+# Captured names cannot contain a double quote, so it safely joins them for batch decoding
+NAME_SEPARATOR = '"'
+
+
+def _is_ascii_compatible(encoding: str) -> bool:
+    try:
+        return XML_MARKUP_SAMPLE.encode(encoding) == XML_MARKUP_SAMPLE.encode('ascii')
+    except LookupError:
+        raise ValueError(f"Unknown encoding for Tally response: {encoding!r}") from None
+
+
+def _strip_invalid_xml_chars(text: str) -> str:
+    # isprintable() is a cheap check that rules out control characters for most values
+    return text if text.isprintable() else INVALID_XML_CHARS_PATTERN.sub('', text)
+
+
+def _decode_chunks(byte_chunks: Iterable[bytes], encoding: str) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    for chunk in byte_chunks:
+        yield decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+
+def scan_tally_ledger_parents(
+    xml_chunks: Iterable[Union[str, bytes]],
+    encoding: str = 'utf-8'
+) -> Iterator[Tuple[List[str], List[Optional[str]]]]:
+    """
+    Scan a Tally ledger export for ledger names and their parents, in batches.
+    xml_chunks may be text or raw response bytes in the given encoding. Bytes in an
+    ASCII-compatible encoding are scanned as they are and only the captured values are
+    decoded; anything else (e.g. UTF-16) is decoded incrementally first.
+    Yields (names, parents) for the LEDGER elements each chunk completes. Each ledger is
+    paired with the first PARENT inside its own element, and parent is None when the
+    element has no PARENT or an empty one. Only the data after the last LEDGER close tag
+    of each chunk is carried over, so memory stays bounded by the chunk and ledger size.
+    Invalid XML control characters are dropped from the captured values only, rather
+    than from the whole export. Names and parents keep their XML entities escaped.
+    """
+    chunks = iter(xml_chunks)
+    first_chunk = next(chunks, None)
+    if first_chunk is None:
+        return
+    chunks = itertools.chain([first_chunk], chunks)
+    if isinstance(first_chunk, bytes) and not _is_ascii_compatible(encoding):
+        chunks = _decode_chunks(chunks, encoding)
+        first_chunk = ''
+    if isinstance(first_chunk, bytes):
+        pattern = LEDGER_PARENT_BYTES_PATTERN
+        tail, bom, close_tag, open_tag = b'', codecs.BOM_UTF8, b'</LEDGER>', b'<LEDGER'
+        separator = NAME_SEPARATOR.encode('ascii')
+
+        def to_text(value):
+            return value.decode(encoding, errors='replace')
+    else:
+        pattern = LEDGER_PARENT_PATTERN
+        tail, bom, close_tag, open_tag = '', '\ufeff', '</LEDGER>', '<LEDGER'
+        separator = NAME_SEPARATOR
+
+        def to_text(value):
+            return value
+
+    # A company has few groups, so each distinct parent is decoded once
+    parent_texts = {tail: None}
+
+    at_start = True
+    for chunk in chunks:
+        buffer = tail + chunk
+        if at_start:
+            if len(buffer) < len(bom) and bom.startswith(buffer):
+                tail = buffer
+                continue
+            if buffer.startswith(bom):
+                buffer = buffer[len(bom):]
+            at_start = False
+        end = buffer.rfind(close_tag)
+        if end < 0:
+            # Keep an open LEDGER element, or else a tag cut off by the chunk boundary
+            keep_from = buffer.rfind(open_tag)
+            tail = buffer[keep_from if keep_from >= 0 else max(buffer.rfind(open_tag[:1]), 0):]
+            continue
+        end += len(close_tag)
+        matches = pattern.findall(buffer, 0, end)
+        tail = buffer[end:]
+        if not matches:
+            continue
+        raw_names, raw_parents = zip(*matches)
+        names = _strip_invalid_xml_chars(to_text(separator.join(raw_names))).split(NAME_SEPARATOR)
+        for parent in set(raw_parents).difference(parent_texts):
+            parent_texts[parent] = _strip_invalid_xml_chars(to_text(parent))
+        yield names, [parent_texts[parent] for parent in raw_parents]
+
+
+def iter_tally_ledger_parents(
+    xml_chunks: Iterable[Union[str, bytes]],
+    encoding: str = 'utf-8'
+) -> Iterator[Tuple[str, Optional[str]]]:
+    """(ledger name, parent) pairs of a Tally ledger export; see scan_tally_ledger_parents."""
+    for names, parents in scan_tally_ledger_parents(xml_chunks, encoding):
+        yield from zip(names, parents)
@@ -0,0 +1,97 @@
+"""
+Benchmark of the ledger export parser on a 50k-ledger export.
+
+Times TallyLedgerSync.parse_tally_response (the line-by-line parser over the decoded
+response) against parse_tally_ledger_response (the streaming scan over 64KB byte
+chunks), checks both return the same ledgers and exits non-zero when the median
+speedup is below the target.
+
+    python scripts/tests/bench_ledger_parsing.py [--ledgers N] [--runs N] [--target X]
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ledgergroups import TallyLedgerSync  # noqa: E402
+
+PARENTS = ['Sundry Debtors', 'Sundry Creditors', 'Sales Accounts', 'Indirect Expenses']
+CHUNK_SIZE = 64 * 1024
+
+
+def ledger_xml(index: int, escaped: bool) -> str:
+    """One LEDGER element in the shape of the Tally ledger collection export."""
+    name = f"Ledger &amp; Co {index}" if escaped else f"Ledger {index}"
+    return (
+        f'  <LEDGER NAME="{name}" RESERVEDNAME="">\n'
+        f'   <ADDRESS.LIST TYPE="String">\n'
+        f'    <ADDRESS>Shop {index}, Main Road</ADDRESS>\n'
+        f'    <ADDRESS>Ahmedabad</ADDRESS>\n'
+        f'   </ADDRESS.LIST>\n'
+        f'   <MAILINGNAME.LIST TYPE="String">\n'
+        f'    <MAILINGNAME>{name}</MAILINGNAME>\n'
+        f'   </MAILINGNAME.LIST>\n'
+        f'   <GUID>abcd-{index:08d}</GUID>\n'
+        f'   <PARENT>{PARENTS[index % len(PARENTS)]}</PARENT>\n'
+        f'   <CURRENCYNAME>₹</CURRENCYNAME>\n'
+        f'   <LEDSTATENAME>Gujarat</LEDSTATENAME>\n'
+        f'   <COUNTRYNAME>India</COUNTRYNAME>\n'
+        f'   <GSTREGISTRATIONTYPE>Regular</GSTREGISTRATIONTYPE>\n'
+        f'   <PARTYGSTIN>24ABCDE{index:04d}F1Z5</PARTYGSTIN>\n'
+        f'   <OPENINGBALANCE>-{index}.00</OPENINGBALANCE>\n'
+        f'   <LANGUAGENAME.LIST>\n'
+        f'    <NAME.LIST TYPE="String">\n'
+        f'     <NAME>{name}</NAME>\n'
+        f'    </NAME.LIST>\n'
+        f'    <LANGUAGEID> 1033</LANGUAGEID>\n'
+        f'   </LANGUAGENAME.LIST>\n'
+        f'  </LEDGER>\n'
+    )
+
+
+def export_bytes(count: int, escaped_every: int) -> bytes:
+    body = ''.join(ledger_xml(index, index % escaped_every == 0) for index in range(count))
+    return f'<ENVELOPE>\n <BODY>\n  <DATA>\n   <COLLECTION>\n{body}   </COLLECTION>\n  </DATA>\n </BODY>\n</ENVELOPE>\n'.encode('utf-8')
+
+
+def compare(sync: TallyLedgerSync, raw: bytes, runs: int):
+    """Median seconds of the line-by-line and the streaming parser, run interleaved."""
+    chunks = [raw[start:start + CHUNK_SIZE] for start in range(0, len(raw), CHUNK_SIZE)]
+    line_times, stream_times = [], []
+    for _ in range(runs):
+        started = time.process_time()
+        expected = sync.parse_tally_response(raw.decode('utf-8'))
+        line_times.append(time.process_time() - started)
+        started = time.process_time()
+        parsed = sync.parse_tally_ledger_response(iter(chunks), 'utf-8')
+        stream_times.append(time.process_time() - started)
+        assert parsed == expected, "parsers disagree"
+    return statistics.median(line_times), statistics.median(stream_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--ledgers', type=int, default=50000)
+    parser.add_argument('--runs', type=int, default=15)
+    parser.add_argument('--target', type=float, default=5.0)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    sync = TallyLedgerSync({'userId': '1'}, 'http://localhost:9000')
+    met = True
+    for label, escaped_every in [('every name escaped', 1), ('one name in ten escaped', 10)]:
+        raw = export_bytes(args.ledgers, escaped_every)
+        line_median, stream_median = compare(sync, raw, args.runs)
+        speedup = line_median / stream_median
+        met = met and speedup >= args.target
+        print(f"{args.ledgers} ledgers, {len(raw) / 1e6:.1f}MB, {label}: line-by-line {line_median:.3f}s, "
+              f"streaming {stream_median:.3f}s median of {args.runs}, {speedup:.1f}x")
+    return 0 if met else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
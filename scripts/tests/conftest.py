@@ -0,0 +1,66 @@
+import os
+import sys
+import uuid
+
+import psycopg2
+import pytest
+
+# The scripts run as `python scripts/<name>.py` and import each other by module name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def voucher_xml(index: int, alter_id: int = None) -> str:
+    """One VOUCHER element in the shape of the MyReportAccountingVoucherTable export."""
+    alter_id = index if alter_id is None else alter_id
+    return (
+        f"<VOUCHER><GUID>{uuid.UUID(int=index)}</GUID><DATE>1-Apr-23</DATE>"
+        f"<VOUCHERTYPE>Sales</VOUCHERTYPE><VOUCHERNUMBER>S{index}</VOUCHERNUMBER>"
+        f"<PARTYNAME>Party {index}</PARTYNAME><Narration>Voucher {index}</Narration><ALTERID>{alter_id}</ALTERID>"
+        f"<ACCOUNTING_ALLOCATION><LEDGER>Party {index}</LEDGER><AMOUNT>-{index}.50</AMOUNT><DRCR>Dr</DRCR></ACCOUNTING_ALLOCATION>"
+        f"<ACCOUNTING_ALLOCATION><LEDGER>Sales</LEDGER><AMOUNT>{index}.50</AMOUNT><DRCR>Cr</DRCR></ACCOUNTING_ALLOCATION>"
+        f"</VOUCHER>"
+    )
+
+
+def export_xml(count: int, start: int = 1) -> bytes:
+    """A Tally voucher export holding vouchers start .. start + count - 1."""
+    body = "".join(voucher_xml(index) for index in range(start, start + count))
+    return f'<?xml version="1.0" encoding="utf-8"?><ENVELOPE><DATA>{body}</DATA></ENVELOPE>'.encode("utf-8")
+
+
+@pytest.fixture
+def session_data():
+    return {
+        'userId': '1',
+        'userCompanyId': '1',
+        'tallyCompanyId': 'Test Company',
+        'subscribeId': '7',
+        'start_date': '2023-04-01',
+        'end_date': '2023-04-30',
+    }
+
+
+@pytest.fixture
+def db_params(session_data):
+    """Connection settings of the user database, inside a throwaway schema dropped afterwards."""
+    params = {
+        'dbname': f"user_{session_data['userId']}_db",
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+        'host': os.getenv('DB_HOST'),
+        'port': os.getenv('DB_PORT')
+    }
+    try:
+        conn = psycopg2.connect(**params)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"PostgreSQL is not available: {e}")
+    schema = f"tally_test_{uuid.uuid4().hex[:12]}"
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute(f"CREATE SCHEMA {schema}")
+    try:
+        yield dict(params, options=f"-c search_path={schema}")
+    finally:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA {schema} CASCADE")
+        conn.close()
@@ -0,0 +1,88 @@
+import json
+import sqlite3
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import gl_code
+
+ENTRIES = [
+    {'ledger_name': f"Ledger {index}", 'primary_group': f"Primary {index}", 'parent_group': f"Group {index}",
+     'group_parent': None}
+    for index in range(4)
+]
+
+
+@pytest.fixture
+def api_requests(monkeypatch):
+    """Number of entries in each fake API request; only the first entry gets a valid answer."""
+    requests = []
+
+    def create(**kwargs):
+        count = kwargs['messages'][1]['content'].count('Entry:')
+        requests.append(count)
+        content = json.dumps(['CASH'] + ['NOT-A-CODE'] * (count - 1))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    monkeypatch.setattr(gl_code.openai.ChatCompletion, 'create', create)
+    return requests
+
+
+def classify(cache_path):
+    classifier = gl_code.LedgerAIClassifier('test-key', cache_path=str(cache_path))
+    classifications = classifier.batch_classify_entries(ENTRIES)
+    return classifications, sorted(classifier.classification_sources.values())
+
+
+def test_rerun_reuses_fallback_answers(tmp_path, api_requests):
+    cache_path = tmp_path / 'cache.sqlite3'
+    first, first_sources = classify(cache_path)
+    second, second_sources = classify(cache_path)
+
+    assert api_requests == [4]
+    assert first_sources == ['api', 'fallback', 'fallback', 'fallback']
+    assert second_sources == ['cache'] * 4
+    assert second == first
+    with sqlite3.connect(cache_path) as cache_db:
+        assert cache_db.execute(
+            "SELECT source, count(*) FROM classification_cache GROUP BY source ORDER BY source"
+        ).fetchall() == [('api', 1), ('fallback', 3)]
+
+
+def test_expired_fallback_answers_are_asked_again(tmp_path, api_requests):
+    cache_path = tmp_path / 'cache.sqlite3'
+    classify(cache_path)
+    with sqlite3.connect(cache_path) as cache_db:
+        cache_db.execute(
+            "UPDATE classification_cache SET created_at = ?",
+            (time.time() - (gl_code.CLASSIFICATION_FALLBACK_TTL_DAYS + 1) * 86400,)
+        )
+
+    _, sources = classify(cache_path)
+
+    # Only the three fallback keys go back to the API
+    assert api_requests == [4, 3]
+    assert sources == ['api', 'cache', 'fallback', 'fallback']
+
+
+def test_cache_without_source_column_is_migrated(tmp_path, api_requests):
+    cache_path = tmp_path / 'cache.sqlite3'
+    schema_version = gl_code.LedgerAIClassifier('test-key', cache_path=None).schema_version
+    with sqlite3.connect(cache_path) as cache_db:
+        cache_db.execute("""
+            CREATE TABLE classification_cache (
+                cache_key TEXT NOT NULL, schema_version TEXT NOT NULL, category TEXT NOT NULL,
+                created_at REAL NOT NULL, PRIMARY KEY (cache_key, schema_version)
+            )
+        """)
+        cache_db.executemany(
+            "INSERT INTO classification_cache VALUES (?, ?, 'PURC', ?)",
+            [(f"Primary {index}::Group {index}", schema_version, time.time()) for index in range(4)]
+        )
+
+    classifications, sources = classify(cache_path)
+
+    assert api_requests == []
+    assert sources == ['cache'] * 4
+    assert set(classifications.values()) == {'PURC'}
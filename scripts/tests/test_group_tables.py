@@ -0,0 +1,120 @@
+import logging
+
+import psycopg2
+import pytest
+
+from group_tables import GROUP_CLOSURE_TABLE_NAME, ensure_group_closure_table, refresh_group_closure
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def cursor(db_params):
+    conn = psycopg2.connect(**db_params)
+    with conn.cursor() as cursor:
+        cursor.execute("CREATE TABLE group_data (name TEXT PRIMARY KEY, parent_group TEXT)")
+        ensure_group_closure_table(cursor)
+        yield cursor
+    conn.close()
+
+
+def closure(cursor):
+    cursor.execute(f"SELECT ancestor, descendant, depth FROM {GROUP_CLOSURE_TABLE_NAME} ORDER BY 1, 2")
+    return cursor.fetchall()
+
+
+def test_closure_holds_every_ancestor_pair(cursor):
+    cursor.execute("""
+        INSERT INTO group_data VALUES
+            ('Current Assets', 'Primary'), ('Sundry Debtors', 'Current Assets'), ('Loose', NULL)
+    """)
+
+    refresh_group_closure(cursor, 'group_data', logger)
+
+    assert closure(cursor) == [
+        ('Current Assets', 'Current Assets', 0),
+        ('Current Assets', 'Sundry Debtors', 1),
+        ('Loose', 'Loose', 0),
+        ('Sundry Debtors', 'Sundry Debtors', 0),
+    ]
+
+
+def test_refresh_follows_moved_groups_and_stops_at_cycles(cursor):
+    cursor.execute("INSERT INTO group_data VALUES ('A', NULL), ('B', 'A'), ('C', 'B')")
+    refresh_group_closure(cursor, 'group_data', logger)
+
+    # C moves under A, and A and B now point at each other
+    cursor.execute("UPDATE group_data SET parent_group = 'A' WHERE name = 'C'")
+    cursor.execute("UPDATE group_data SET parent_group = 'B' WHERE name = 'A'")
+    refresh_group_closure(cursor, 'group_data', logger)
+
+    assert closure(cursor) == [
+        ('A', 'A', 0), ('A', 'B', 1), ('A', 'C', 1),
+        ('B', 'A', 1), ('B', 'B', 0), ('B', 'C', 2),
+        ('C', 'C', 0),
+    ]
+
+
+def group(name, parent_group, group_name=None):
+    return {
+        'name': name, 'primary_group': 'Assets', 'parent_group': parent_group,
+        'group_name': group_name or name, 'is_revenue': False, 'is_deemed_positive': True,
+        'affects_gross_profit': False, 'sort_position': 1,
+    }
+
+
+LEDGERS = [
+    {'name': 'Cash', 'parent_group': 'Current Assets'},
+    {'name': 'Acme', 'parent_group': 'Sundry Debtors'},
+    {'name': 'Orphan', 'parent_group': 'No Such Group'},
+]
+
+
+@pytest.fixture
+def ledger_sync(db_params, monkeypatch):
+    """group_and_ledgers.TallyLedgerSync with both groups saved, in the mode set by set_mode."""
+    import group_and_ledgers
+    import group_tables
+
+    def set_mode(mode):
+        monkeypatch.setattr(group_tables, 'LEDGER_GROUP_MODE', mode)
+        monkeypatch.setattr(group_and_ledgers, 'LEDGER_GROUP_MODE', mode)
+        sync = group_and_ledgers.TallyLedgerSync(db_params, 'http://localhost:9000')
+        sync.save_group_data_to_database([group('Current Assets', 'Primary'), group('Sundry Debtors', 'Current Assets')])
+        return sync
+    return set_mode
+
+
+def fetch_all(db_params, query):
+    conn = psycopg2.connect(**db_params)
+    with conn.cursor() as cursor:
+        cursor.execute(query)
+        rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+
+def test_copy_mode_stores_group_details_on_ledgers(ledger_sync, db_params):
+    ledger_sync('copy').save_to_database(LEDGERS)
+
+    assert fetch_all(db_params, "SELECT ledger_name, parent_group, group_name, group_parent FROM ledger_table ORDER BY 1") == [
+        ('Acme', 'Sundry Debtors', 'Sundry Debtors', 'Current Assets'),
+        ('Cash', 'Current Assets', 'Current Assets', 'Primary'),
+    ]
+
+
+def test_view_mode_stores_only_the_parent_group(ledger_sync, db_params):
+    sync = ledger_sync('view')
+    sync.save_to_database(LEDGERS)
+    written = fetch_all(db_params, "SELECT ledger_name, xmin::text FROM ledger_table ORDER BY 1")
+
+    # A renamed group and a second run leave every ledger row as it was
+    sync.save_group_data_to_database([group('Sundry Debtors', 'Current Assets', 'Debtors')])
+    sync.save_to_database(LEDGERS)
+
+    assert fetch_all(db_params, "SELECT ledger_name, xmin::text FROM ledger_table ORDER BY 1") == written
+    assert fetch_all(db_params, "SELECT count(*) FROM ledger_table WHERE group_name IS NOT NULL") == [(0,)]
+    assert fetch_all(db_params, "SELECT ledger_name, group_name, group_parent FROM ledger_table_enriched ORDER BY 1") == [
+        ('Acme', 'Debtors', 'Current Assets'),
+        ('Cash', 'Current Assets', 'Primary'),
+    ]
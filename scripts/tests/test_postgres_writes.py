@@ -0,0 +1,124 @@
+import datetime
+import uuid
+from decimal import Decimal
+
+import pytest
+
+import tally_data
+from conftest import export_xml, voucher_xml
+from db_utils import ConnectionPool, copy_rows
+
+TRANSACTIONS_DDL = """
+    CREATE TABLE transactions (
+        id SERIAL PRIMARY KEY,
+        transaction_id TEXT,
+        batch_id TEXT,
+        transaction_batch_id TEXT,
+        GUID UUID,
+        subscribe_id INTEGER,
+        file_status TEXT,
+        original_filename TEXT,
+        masterkeyids TEXT,
+        date DATE,
+        document_type TEXT,
+        document_number TEXT,
+        narration TEXT,
+        party_name TEXT,
+        total_amount NUMERIC(15, 2),
+        user_id INTEGER,
+        filepath TEXT,
+        push_status INTEGER,
+        pushed_at TIMESTAMP,
+        created_by INTEGER,
+        updated_by INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+
+@pytest.fixture
+def pg_tally(session_data, db_params):
+    tally = tally_data.TallyIntegration(session_data)
+    tally.pool = ConnectionPool(db_params, 1, 2, 30)
+    with tally.db_cursor() as cursor:
+        cursor.execute(TRANSACTIONS_DDL)
+        tally.monthly_summary.ensure_tables(cursor)
+    yield tally
+    tally.pool.close()
+
+
+def fetch_all(tally, query):
+    with tally.db_cursor() as cursor:
+        cursor.execute(query)
+        return [tuple(row) for row in cursor.fetchall()]
+
+
+def parsed_chunk(tally, xml_data):
+    (chunk, _, _), = tally.parse_tally_vouchers(xml_data, 7)
+    return chunk
+
+
+def test_copy_rows_round_trips_values(pg_tally):
+    rows = [
+        (1, 'plain', Decimal('12.50'), datetime.date(2023, 4, 1)),
+        (2, 'comma, "quotes"\nand a newline', Decimal('-0.01'), None),
+        (3, None, None, datetime.date(2024, 2, 29)),
+        (4, '', Decimal('0'), None),
+    ]
+    with pg_tally.db_cursor() as cursor:
+        cursor.execute("CREATE TEMP TABLE copied (id INTEGER, label TEXT, amount NUMERIC, day DATE)")
+        copy_rows(cursor, iter(rows), 'copied', ['id', 'label', 'amount', 'day'])
+        cursor.execute("SELECT id, label, amount, day FROM copied ORDER BY id")
+        copied = [tuple(row) for row in cursor.fetchall()]
+
+    # CSV COPY reads an unquoted empty field as an empty string, not NULL
+    assert copied == rows
+
+
+def test_new_vouchers_are_inserted_with_transaction_ids(pg_tally):
+    inserted, updated = pg_tally.insert_transactions_into_postgres(parsed_chunk(pg_tally, export_xml(3)), 'transactions')
+
+    assert (inserted, updated) == (3, 0)
+    assert fetch_all(pg_tally, """
+        SELECT transaction_id, GUID::text, document_number, date, total_amount, subscribe_id, push_status
+        FROM transactions ORDER BY id
+    """) == [
+        (f"TRN0000{index}", str(uuid.UUID(int=index)), f"S{index}", datetime.date(2023, 4, 1),
+         Decimal(f"{2 * index + 1}.00"), 7, 0)
+        for index in range(1, 4)
+    ]
+    assert fetch_all(pg_tally, "SELECT subscribe_id, month FROM ledger_summary_pending_months") == [
+        (7, datetime.date(2023, 4, 1))
+    ]
+
+
+def test_existing_document_numbers_are_updated(pg_tally):
+    pg_tally.insert_transactions_into_postgres(parsed_chunk(pg_tally, export_xml(2)), 'transactions')
+    # S2 comes back with a new GUID, next to a new voucher S3
+    resent = export_xml(2, start=2).replace(
+        str(uuid.UUID(int=2)).encode(), str(uuid.UUID(int=202)).encode()
+    )
+
+    inserted, updated = pg_tally.insert_transactions_into_postgres(parsed_chunk(pg_tally, resent), 'transactions')
+
+    assert (inserted, updated) == (1, 1)
+    assert fetch_all(pg_tally, "SELECT transaction_id, GUID::text, document_number FROM transactions ORDER BY id") == [
+        ("TRN00001", str(uuid.UUID(int=1)), "S1"),
+        ("TRN00002", str(uuid.UUID(int=202)), "S2"),
+        ("TRN00003", str(uuid.UUID(int=3)), "S3"),
+    ]
+
+
+def test_duplicate_new_document_number_keeps_last_guid(pg_tally):
+    # Two vouchers numbered S1 on different dates in one chunk: one row, with the GUID
+    # of the later voucher
+    second = voucher_xml(2).replace('<VOUCHERNUMBER>S2<', '<VOUCHERNUMBER>S1<').replace('1-Apr-23', '2-Apr-23')
+    xml_data = f"<ENVELOPE><DATA>{voucher_xml(1)}{second}</DATA></ENVELOPE>".encode("utf-8")
+
+    inserted, updated = pg_tally.insert_transactions_into_postgres(parsed_chunk(pg_tally, xml_data), 'transactions')
+
+    assert (inserted, updated) == (1, 0)
+    assert fetch_all(pg_tally, "SELECT transaction_id, GUID::text, document_number FROM transactions") == [
+        ("TRN00001", str(uuid.UUID(int=2)), "S1"),
+    ]
@@ -0,0 +1,95 @@
+import codecs
+import datetime
+import html
+from decimal import Decimal
+
+import pytest
+
+from tally_parsing import iter_tally_ledger_parents, parse_tally_amount, parse_tally_date, unescape_xml_text
+
+LEDGER_EXPORT = (
+    '<ENVELOPE>\n'
+    '<LEDGER NAME="Cash &amp; Bank ₹" RESERVEDNAME=""><PARENT TYPE="String">Cash-in-Hand\x01</PARENT></LEDGER>\n'
+    '<LEDGER NAME="Suspense"><ADDRESS.LIST><ADDRESS>Main Road</ADDRESS></ADDRESS.LIST></LEDGER>\n'
+    '<LEDGER NAME="Sales">\n <PARENT>Sales Accounts</PARENT>\n <PARENT>Other</PARENT>\n</LEDGER>\n'
+    '</ENVELOPE>\n'
+)
+EXPECTED_LEDGERS = [
+    ('Cash &amp; Bank ₹', 'Cash-in-Hand'),
+    ('Suspense', None),
+    ('Sales', 'Sales Accounts'),
+]
+
+
+def split(data, size):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('1-Apr-23', datetime.date(2023, 4, 1)),
+    (' 31-Mar-24\n', datetime.date(2024, 3, 31)),
+    ('29-Feb-24', datetime.date(2024, 2, 29)),
+])
+def test_parse_tally_date(text, expected):
+    assert parse_tally_date(text) == expected
+
+
+@pytest.mark.parametrize('text', [None, '', '2023-04-01', '29-Feb-23'])
+def test_parse_tally_date_rejects_invalid(text):
+    with pytest.raises(ValueError):
+        parse_tally_date(text)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('1234.50', Decimal('1234.50')),
+    ('-1234.50', Decimal('-1234.50')),
+    ('(-)1234.50', Decimal('-1234.50')),
+    ('(-) 0.10', Decimal('-0.10')),
+    (' 7 ', Decimal('7')),
+])
+def test_parse_tally_amount(text, expected):
+    amount = parse_tally_amount(text)
+    assert amount == expected
+    assert isinstance(amount, Decimal)
+
+
+@pytest.mark.parametrize('text', ['', '12,50', 'abc', 'NaN', 'Infinity'])
+def test_parse_tally_amount_rejects_invalid(text):
+    with pytest.raises(ValueError):
+        parse_tally_amount(text)
+
+
+def test_ledger_parents_from_text():
+    assert list(iter_tally_ledger_parents([LEDGER_EXPORT])) == EXPECTED_LEDGERS
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 16, 64, 4096])
+def test_ledger_parents_across_chunk_boundaries(size):
+    assert list(iter_tally_ledger_parents(split(LEDGER_EXPORT, size))) == EXPECTED_LEDGERS
+    raw = codecs.BOM_UTF8 + LEDGER_EXPORT.encode('utf-8')
+    assert list(iter_tally_ledger_parents(split(raw, size), 'utf-8')) == EXPECTED_LEDGERS
+
+
+@pytest.mark.parametrize('encoding', ['utf-16', 'utf-16-le'])
+@pytest.mark.parametrize('size', [1, 3, 64])
+def test_ledger_parents_from_utf16_bytes(encoding, size):
+    raw = LEDGER_EXPORT.encode(encoding)
+    assert list(iter_tally_ledger_parents(split(raw, size), encoding)) == EXPECTED_LEDGERS
+
+
+def test_ledger_parents_of_empty_response():
+    assert list(iter_tally_ledger_parents([])) == []
+    assert list(iter_tally_ledger_parents([b''], 'utf-8')) == []
+
+
+def test_ledger_parents_rejects_unknown_encoding():
+    with pytest.raises(ValueError):
+        list(iter_tally_ledger_parents([b'<ENVELOPE/>'], 'no-such-encoding'))
+
+
+@pytest.mark.parametrize('text', [
+    'Cash &amp; Bank', '&lt;A&gt; &quot;B&quot; &apos;C&apos;', '&amp;lt;', '&amp;amp;',
+    'R&amp;D &#8377;', '&copy; &lt', 'plain', '',
+])
+def test_unescape_xml_text_matches_html_unescape(text):
+    assert unescape_xml_text(text) == html.unescape(text)
@@ -0,0 +1,205 @@
+import datetime
+from contextlib import contextmanager
+from unittest import mock
+
+import pytest
+import requests
+
+import tally_data
+from conftest import export_xml
+
+
+class FakeSyncStore:
+    """In-memory stand-in for the tables sync_tally_data reads and writes."""
+
+    def __init__(self):
+        self.checkpoints = {}
+        self.watermark = None
+        self.transactions = []
+        self.reconcile_calls = 0
+        self.fail_reconcile_calls = set()
+        self.reconciled_guids = []
+
+
+@pytest.fixture
+def store():
+    return FakeSyncStore()
+
+
+@pytest.fixture
+def integration(session_data, store, monkeypatch):
+    tally = tally_data.TallyIntegration(session_data)
+    tally.xml_response = export_xml(1500)
+
+    @contextmanager
+    def db_cursor():
+        yield None
+
+    def save_sync_checkpoint(subscribe_id, run_key, window_start, window_end, status, vouchers_committed, last_guid=None):
+        store.checkpoints[(window_start, window_end)] = {
+            'run_key': run_key, 'status': status, 'vouchers_committed': vouchers_committed, 'last_guid': last_guid
+        }
+
+    def delete_sync_checkpoints(subscribe_id, window=None):
+        if window is None:
+            store.checkpoints.clear()
+        else:
+            store.checkpoints.pop(window, None)
+
+    def insert_transactions_into_postgres(chunk, table_name):
+        store.transactions.extend(chunk.column('document_number'))
+        return len(chunk), 0
+
+    def get_transaction_details_by_guids(cursor, guid_strs):
+        store.reconcile_calls += 1
+        if store.reconcile_calls in store.fail_reconcile_calls:
+            raise RuntimeError("connection lost")
+        return {}
+
+    def insert_transaction_details(ledger_entries, cursor=None):
+        store.reconciled_guids.extend(dict.fromkeys(str(entry['GUID']) for entry in ledger_entries))
+
+    def get_tally_xml_source(payload, retry_timeouts=True):
+        return iter([tally.xml_response[start:start + 4096] for start in range(0, len(tally.xml_response), 4096)])
+
+    monkeypatch.setattr(tally, 'db_cursor', db_cursor)
+    monkeypatch.setattr(tally, 'ensure_sync_indexes', lambda: None)
+    monkeypatch.setattr(tally, 'resolve_min_alter_id', lambda subscribe_id: None)
+    monkeypatch.setattr(tally, 'load_window_densities', lambda subscribe_id: {})
+    monkeypatch.setattr(tally, 'record_window_density', lambda *args: None)
+    monkeypatch.setattr(tally, 'load_sync_checkpoints', lambda subscribe_id, run_key: {
+        window: dict(checkpoint) for window, checkpoint in store.checkpoints.items() if checkpoint['run_key'] == run_key
+    })
+    monkeypatch.setattr(tally, 'save_sync_checkpoint', save_sync_checkpoint)
+    monkeypatch.setattr(tally, 'delete_sync_checkpoints', delete_sync_checkpoints)
+    monkeypatch.setattr(tally, 'save_alter_id_watermark', lambda subscribe_id, alter_id: setattr(store, 'watermark', alter_id))
+    monkeypatch.setattr(tally, 'insert_transactions_into_postgres', insert_transactions_into_postgres)
+    monkeypatch.setattr(tally, 'get_transaction_details_by_guids', get_transaction_details_by_guids)
+    monkeypatch.setattr(tally, 'insert_transaction_details', insert_transaction_details)
+    monkeypatch.setattr(tally, 'get_tally_xml_source', get_tally_xml_source)
+    monkeypatch.setattr(tally.monthly_summary, 'refresh', lambda subscribe_id: 0)
+    return tally
+
+
+def test_sync_advances_watermark_after_clean_run(integration, store):
+    success_chunks, failed_chunks = integration.sync_tally_data('7')
+
+    assert failed_chunks == []
+    assert len(store.transactions) == 1500
+    assert len(store.reconciled_guids) == 1500
+    assert store.watermark == 1500
+    assert store.checkpoints == {}
+
+
+def test_reconcile_failure_keeps_watermark(integration, store):
+    store.fail_reconcile_calls = {2}
+
+    success_chunks, failed_chunks = integration.sync_tally_data('7')
+
+    assert len(failed_chunks) == 1
+    assert store.watermark is None
+    assert integration.details_failure_count == 500
+
+
+def test_reconcile_failure_resumes_window_from_last_good_batch(integration, store):
+    store.fail_reconcile_calls = {2}
+    integration.sync_tally_data('7')
+
+    (window, checkpoint), = store.checkpoints.items()
+    assert window == (datetime.date(2023, 4, 1), datetime.date(2023, 4, 30))
+    assert checkpoint['status'] == 'in_progress'
+    assert checkpoint['vouchers_committed'] == 1000
+    first_run_guids = list(store.reconciled_guids)
+    assert len(first_run_guids) == 1000
+
+    store.reconciled_guids.clear()
+    success_chunks, failed_chunks = integration.sync_tally_data('7')
+
+    assert failed_chunks == []
+    assert success_chunks == ["2023-04-01 to 2023-04-30"]
+    # Only the vouchers of the failed batch are read again
+    assert len(store.reconciled_guids) == 500
+    assert not set(store.reconciled_guids) & set(first_run_guids)
+    assert store.watermark == 1500
+    assert store.checkpoints == {}
+
+
+def test_first_sync_plans_one_year_windows(integration):
+    windows = integration.plan_sync_windows('7', datetime.date(2022, 4, 1), datetime.date(2024, 6, 30))
+
+    assert windows == [
+        (datetime.date(2022, 4, 1), datetime.date(2023, 3, 31)),
+        (datetime.date(2023, 4, 1), datetime.date(2024, 3, 31)),
+        (datetime.date(2024, 4, 1), datetime.date(2024, 6, 30)),
+    ]
+
+
+@pytest.mark.parametrize('error', [requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError])
+def test_stream_read_error_is_reported_as_interrupted(integration, error):
+    response = mock.MagicMock()
+    response.__enter__.return_value = response
+
+    def iter_content(chunk_size):
+        yield b"<ENVELOPE>"
+        raise error("Read timed out")
+
+    response.iter_content.side_effect = iter_content
+    with mock.patch.object(tally_data.requests, 'post', return_value=response):
+        stream = integration.fetch_tally_data_stream("<ENVELOPE/>", retry_timeouts=False)
+        assert next(stream) == b"<ENVELOPE>"
+        with pytest.raises(tally_data.TallyResponseInterrupted):
+            next(stream)
+
+
+def test_interrupted_window_is_bisected(integration, store, monkeypatch):
+    fetched_windows = []
+    monkeypatch.setattr(integration, 'construct_tally_data_payload', lambda start, end, company, min_alter_id=None: (start, end))
+
+    def get_tally_xml_source(window, retry_timeouts=True):
+        fetched_windows.append(window)
+        if len(fetched_windows) == 1:
+            def broken_stream():
+                yield integration.xml_response[:4096]
+                raise tally_data.TallyResponseInterrupted("broke off")
+            return broken_stream()
+        return iter([integration.xml_response])
+
+    monkeypatch.setattr(integration, 'get_tally_xml_source', get_tally_xml_source)
+    success_chunks, failed_chunks = integration.sync_tally_data('7')
+
+    assert failed_chunks == []
+    assert fetched_windows == [
+        (datetime.date(2023, 4, 1), datetime.date(2023, 4, 30)),
+        (datetime.date(2023, 4, 1), datetime.date(2023, 4, 15)),
+        (datetime.date(2023, 4, 16), datetime.date(2023, 4, 30)),
+    ]
+
+
+def test_transaction_ids_are_reserved_once_per_run(integration, monkeypatch):
+    reserved_blocks = []
+
+    def allocate_transaction_id_block(cursor):
+        block_end = (len(reserved_blocks) + 1) * tally_data.TRANSACTION_ID_BLOCK_SIZE
+        reserved_blocks.append(block_end)
+        return block_end - tally_data.TRANSACTION_ID_BLOCK_SIZE + 1, block_end
+
+    monkeypatch.setattr(integration, 'allocate_transaction_id_block', allocate_transaction_id_block)
+    # Small windows ask for a few IDs at a time and share the run's block
+    first = integration.take_transaction_ids(None, 3)
+    second = integration.take_transaction_ids(None, 2)
+    spanning = integration.take_transaction_ids(None, tally_data.TRANSACTION_ID_BLOCK_SIZE)
+
+    assert first == ["TRN00001", "TRN00002", "TRN00003"]
+    assert second == ["TRN00004", "TRN00005"]
+    assert spanning[0] == "TRN00006" and spanning[-1] == "TRN01005"
+    assert len(reserved_blocks) == 2
+
+
+def test_malformed_response_fails_the_window(integration, store):
+    integration.xml_response = export_xml(1500).replace(b'</PARTYNAME>', b'</PARTY>', 1)
+
+    success_chunks, failed_chunks = integration.sync_tally_data('7')
+
+    assert success_chunks == []
+    assert failed_chunks == ["2023-04-01 to 2023-04-30"]
+    assert store.watermark is None
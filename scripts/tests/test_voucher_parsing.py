@@ -0,0 +1,86 @@
+import uuid
+from decimal import Decimal
+
+import pytest
+
+import tally_data
+from conftest import export_xml
+
+
+@pytest.fixture
+def tally(session_data):
+    return tally_data.TallyIntegration(session_data)
+
+
+def split(data, size):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('size', [1, 7, 100, 1 << 20])
+def test_vouchers_stream_across_chunk_boundaries(tally, size):
+    guids = [voucher.findtext('GUID') for voucher in tally.iter_voucher_elements(split(export_xml(5), size))]
+
+    assert guids == [str(uuid.UUID(int=index)) for index in range(1, 6)]
+
+
+def test_parsed_vouchers_are_detached_from_the_tree(tally):
+    vouchers = tally.iter_voucher_elements(export_xml(3))
+    first = next(vouchers)
+    assert first.findtext('VOUCHERNUMBER') == 'S1'
+
+    next(vouchers)
+    # Moving on clears the previous voucher, so memory stays bounded by one voucher
+    assert len(first) == 0
+
+
+def test_vouchers_are_chunked_with_progress(tally):
+    chunks = list(tally.parse_tally_vouchers(split(export_xml(1500), 4096), 7))
+
+    assert [len(chunk) for chunk, _, _ in chunks] == [1000, 500]
+    assert [len(ledger_batch) for _, ledger_batch, _ in chunks] == [1000, 500]
+    assert [progress for _, _, progress in chunks] == [
+        (1000, str(uuid.UUID(int=1000))),
+        (1500, str(uuid.UUID(int=1500))),
+    ]
+    assert tally.max_alter_id_seen == 1500
+
+
+def test_voucher_columns_and_ledger_entries(tally):
+    (chunk, ledger_batch, _), = tally.parse_tally_vouchers(export_xml(1, start=12), 7)
+
+    row, = chunk.to_dicts()
+    assert row['GUID'] == uuid.UUID(int=12)
+    assert row['document_number'] == 'S12'
+    assert row['party_name'] == 'Party 12'
+    assert row['total_amount'] == Decimal('25.00')
+    assert row['subscribe_id'] == 7
+    guid_str, ledger_entries = ledger_batch[0]
+    assert guid_str == str(uuid.UUID(int=12))
+    assert [(entry['ledger_name'], entry['ledger_amount'], entry['amount_status']) for entry in ledger_entries] == [
+        ('Party 12', Decimal('12.50'), 'Dr'),
+        ('Sales', Decimal('12.50'), 'Cr'),
+    ]
+
+
+def test_resume_skips_committed_vouchers(tally):
+    chunks = list(tally.parse_tally_vouchers(export_xml(1500), 7, skip_vouchers=1000,
+                                             skip_until_guid=str(uuid.UUID(int=1000))))
+
+    (chunk, _, progress), = chunks
+    assert chunk.column('document_number')[0] == 'S1001'
+    assert progress == (1500, str(uuid.UUID(int=1500)))
+
+
+def test_resume_rejects_reordered_response(tally):
+    with pytest.raises(tally_data.TallyCheckpointMismatch):
+        list(tally.parse_tally_vouchers(export_xml(1500), 7, skip_vouchers=1000,
+                                        skip_until_guid=str(uuid.UUID(int=999))))
+
+
+@pytest.mark.parametrize('xml_data', [
+    export_xml(3)[:-40],
+    export_xml(3).replace(b'</PARTYNAME>', b'</PARTY>', 1),
+])
+def test_malformed_xml_raises_instead_of_exiting(tally, xml_data):
+    with pytest.raises(tally_data.TallyResponseParseError):
+        list(tally.parse_tally_vouchers(split(xml_data, 256), 7))